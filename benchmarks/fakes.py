@@ -0,0 +1,209 @@
+"""Локальные заглушки Telegram Bot API, Outline и ЮMoney для нагрузочных тестов."""
+import asyncio
+import itertools
+import json
+import random
+import time
+import urllib.parse
+from typing import Callable
+
+# Ответ заглушки: HTTP-статус и JSON.
+Response = tuple[int, dict]
+
+
+class FakeServer:
+    """
+    HTTP-сервер на asyncio с keep-alive соединениями.
+
+    Каждый ответ задерживается примерно на `latency` секунд, а с вероятностью
+    `error_rate` вместо ответа возвращается ошибка сервера.
+    """
+
+    def __init__(self, latency: float = 0, error_rate: float = 0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._server: asyncio.Server | None = None
+
+    @property
+    def url(self) -> str:
+        if not self._server:
+            raise RuntimeError("Server is not started.")
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, "127.0.0.1", 0
+        )
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    def handle(self, method: str, path: str, params: dict) -> Response:
+        raise NotImplementedError
+
+    def error(self) -> Response:
+        return 500, {"error": "internal_error"}
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while request_line := await reader.readline():
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))  # noqa: S311
+                if random.random() < self.error_rate:  # noqa: S311
+                    status, data = self.error()
+                else:
+                    url = urllib.parse.urlsplit(target)
+                    params = _parse_params(url.query, body, headers)
+                    status, data = self.handle(method, url.path, params)
+
+                payload = json.dumps(data).encode() if status != 204 else b""
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _parse_params(query: str, body: bytes, headers: dict) -> dict:
+    params = dict(urllib.parse.parse_qsl(query))
+    if not body:
+        return params
+    if headers.get("content-type", "").startswith("application/json"):
+        params.update(json.loads(body))
+    else:
+        params.update(urllib.parse.parse_qsl(body.decode()))
+    return params
+
+
+class FakeTelegram(FakeServer):
+    """Bot API: отвечает на методы, которые вызывает бот, и запоминает сообщения."""
+
+    def __init__(
+        self,
+        latency: float = 0,
+        error_rate: float = 0,
+        on_message: Callable[[int, str], None] | None = None,
+    ) -> None:
+        super().__init__(latency, error_rate)
+        self.on_message = on_message
+        self._message_ids = itertools.count(1)
+
+    def error(self) -> Response:
+        return 500, {
+            "ok": False,
+            "error_code": 500,
+            "description": "Internal Server Error",
+        }
+
+    def handle(self, method: str, path: str, params: dict) -> Response:
+        api_method = path.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            result: object = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Benchmark",
+                "username": "benchmark_bot",
+            }
+        elif api_method == "getChatMember":
+            result = {
+                "status": "member",
+                "user": {
+                    "id": int(params["user_id"]),
+                    "is_bot": False,
+                    "first_name": "User",
+                },
+            }
+        elif api_method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            if self.on_message:
+                self.on_message(chat_id, params.get("text", ""))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}
+
+
+class FakeOutline(FakeServer):
+    """Outline Management API, у каждого пути-префикса свой список ключей."""
+
+    def __init__(self, latency: float = 0, error_rate: float = 0) -> None:
+        super().__init__(latency, error_rate)
+        self._keys: dict[str, dict[str, dict]] = {}
+        self._key_ids = itertools.count(1)
+
+    def handle(self, method: str, path: str, params: dict) -> Response:
+        prefix, _, resource = path.partition("/access-keys/")
+        keys = self._keys.setdefault(prefix, {})
+        if method == "GET":
+            return 200, {"accessKeys": list(keys.values())}
+        if method == "POST":
+            key_id = str(next(self._key_ids))
+            keys[key_id] = {"id": key_id, "name": "", "accessUrl": f"ss://{key_id}"}
+            return 201, keys[key_id]
+        key_id = resource.split("/")[0]
+        if key_id in keys:
+            keys[key_id]["name"] = params.get("name", "")
+        return 204, {}
+
+
+class FakeYooMoney(FakeServer):
+    """
+    API ЮMoney: история поступлений содержит счета, отмеченные `pay`,
+    за вычетом комиссии `commission`.
+    """
+
+    def __init__(
+        self, latency: float = 0, error_rate: float = 0, commission: float = 0.01
+    ) -> None:
+        super().__init__(latency, error_rate)
+        self._commission = commission
+        self._payments: list[tuple[str, float]] = []
+
+    def pay(self, label: str, bill_sum: float) -> None:
+        self._payments.append((label, round(bill_sum * (1 - self._commission), 2)))
+
+    def handle(self, method: str, path: str, params: dict) -> Response:
+        if path.endswith("account-info"):
+            return 200, {"account": "4100000000000000"}
+        start = int(params.get("start_record", 0))
+        records = int(params.get("records", 100))
+        page = self._payments[start : start + records]
+        history: dict = {
+            "operations": [
+                {
+                    "label": label,
+                    "amount": amount,
+                    "status": "success",
+                    "direction": "in",
+                }
+                for label, amount in page
+            ]
+        }
+        if start + records < len(self._payments):
+            history["next_record"] = str(start + records)
+        return 200, history
@@ -0,0 +1,381 @@
+"""Нагрузочный тест бота.
+
+Настоящие обработчики из `handlers.py` работают против локальных заглушек
+Telegram Bot API, Outline и ЮMoney, а пользователи проходят сценарий:
+/balance, /list_servers, пополнение счёта, покупка ключа, /balance.
+
+Запуск: python benchmarks/run.py [--users 100] [--save-baseline]
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Iterator
+
+from fakes import FakeOutline, FakeTelegram, FakeYooMoney
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCHMARKS_DIR.parent / "src"
+BASELINE_FILE = BENCHMARKS_DIR / "baseline.json"
+CHANNEL_ID = -1001
+PAYMENT_LABEL = re.compile(r"label=([0-9a-f-]+)")
+PAYMENT_SUM = re.compile(r"\bsum=(\d+)")
+PAYMENT_CONFIRMATION = "Оплата счёта принята"
+
+# Сценарий пользователя: текст команды или данные кнопки.
+SCENARIO = (
+    ("command", "/balance"),
+    ("command", "/list_servers"),
+    ("callback", "balance_add"),
+    ("callback", "server_auto"),
+    ("command", "/balance"),
+)
+
+
+class Recorder:
+    """Отправляет обновления боту и замеряет время до конца их обработки."""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self._pending: dict[int, tuple[float, asyncio.Future]] = {}
+
+    def wrap(self, name: str, callback: Callable) -> Callable:
+        async def timed(update: Any, context: Any) -> None:
+            try:
+                await callback(update, context)
+            except Exception:
+                logger.exception(f"Handler {name} failed.")
+                self.errors[name] += 1
+            finally:
+                enqueued_at, done = self._pending.pop(update.update_id)
+                self.latencies[name].append(time.monotonic() - enqueued_at)
+                done.set_result(None)
+
+        return timed
+
+    async def submit(self, application: Any, update: Any) -> None:
+        done = asyncio.get_running_loop().create_future()
+        self._pending[update.update_id] = (time.monotonic(), done)
+        await application.update_queue.put(update)
+        await done
+
+    def observe(self, name: str, latency: float, failed: bool = False) -> None:
+        self.latencies[name].append(latency)
+        if failed:
+            self.errors[name] += 1
+
+
+class Payments:
+    """Оплачивает выставленные счета и ждёт подтверждения зачисления."""
+
+    def __init__(self, yoomoney: FakeYooMoney, recorder: Recorder) -> None:
+        self._yoomoney = yoomoney
+        self._recorder = recorder
+        self._payed_at: dict[int, float] = {}
+        self._confirmed: dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+
+    def on_message(self, chat_id: int, text: str) -> None:
+        label, bill_sum = PAYMENT_LABEL.search(text), PAYMENT_SUM.search(text)
+        if label and bill_sum:
+            self._yoomoney.pay(label.group(1), float(bill_sum.group(1)))
+            self._payed_at[chat_id] = time.monotonic()
+        elif text.startswith(PAYMENT_CONFIRMATION) and chat_id in self._payed_at:
+            payed_at = self._payed_at.pop(chat_id)
+            self._recorder.observe("payment", time.monotonic() - payed_at)
+            self._confirmed[chat_id].set()
+
+    async def wait_confirmation(self, chat_id: int, timeout: float) -> None:
+        if chat_id not in self._payed_at:
+            return
+        try:
+            await asyncio.wait_for(self._confirmed[chat_id].wait(), timeout)
+        except asyncio.TimeoutError:
+            self._payed_at.pop(chat_id, None)
+            self._recorder.observe("payment", timeout, failed=True)
+
+
+def _user(user_id: int) -> dict:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": "User",
+        "username": f"user{user_id}",
+    }
+
+
+def _message(message_id: int, user_id: int, text: str) -> dict:
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+
+
+def _update_data(update_id: int, user_id: int, kind: str, data: str) -> dict:
+    if kind == "command":
+        message = _message(update_id, user_id, data)
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(data)}
+        ]
+        return {"update_id": update_id, "message": message}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": _message(update_id, user_id, "keyboard"),
+        },
+    }
+
+
+def _import_bot() -> ModuleType:
+    """Импортирует `src/__main__.py`, когда окружение уже настроено."""
+    sys.path.insert(0, str(SRC_DIR))
+    spec = importlib.util.spec_from_file_location("bot_main", SRC_DIR / "__main__.py")
+    if not spec or not spec.loader:
+        raise RuntimeError("Can't load bot entry point.")
+    bot_main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot_main)
+    return bot_main
+
+
+def _handler_name(handler: Any) -> str:
+    if hasattr(handler, "commands"):
+        return "/" + sorted(handler.commands)[0]
+    return handler.callback.__name__
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def reconcile_payments(recorder: Recorder, interval: float) -> None:
+    """Проверяет оплату чаще, чем бот, чтобы точнее замерить время зачисления."""
+    from services import bill_watch
+
+    while True:
+        await asyncio.sleep(interval)
+        started = time.monotonic()
+        try:
+            await bill_watch.watcher.poll(datetime.now())
+        except Exception:
+            logger.exception("Payments reconciliation failed.")
+            recorder.observe("reconcile_payments", 0, failed=True)
+        else:
+            recorder.observe("reconcile_payments", time.monotonic() - started)
+
+
+async def simulate_user(
+    user_id: int,
+    application: Any,
+    recorder: Recorder,
+    payments: Payments,
+    update_ids: Iterator[int],
+    args: argparse.Namespace,
+) -> None:
+    from telegram import Update
+
+    await asyncio.sleep(random.uniform(0, args.ramp_up))  # noqa: S311
+    for kind, data in SCENARIO:
+        update = Update.de_json(
+            _update_data(next(update_ids), user_id, kind, data), application.bot
+        )
+        await recorder.submit(application, update)
+        if data == "balance_add":
+            await payments.wait_confirmation(user_id, args.payment_timeout)
+        await asyncio.sleep(random.expovariate(1 / args.think_time))  # noqa: S311
+
+
+def _configure_environment(
+    args: argparse.Namespace,
+    data_dir: str,
+    telegram: FakeTelegram,
+    yoomoney: FakeYooMoney,
+) -> None:
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+            "VPN_TELEGRAM_BOT_CHANNEL_ID": str(CHANNEL_ID),
+            "TELEGRAM_API_URL": telegram.url,
+            "YOOMONEY_API_URL": f"{yoomoney.url}/api/",
+            "YOOMONEY_TOKEN": "benchmark",
+            "SQLITE_DB_FILE": str(Path(data_dir) / "db.sqlite3"),
+            "METRICS_PORT": "0",
+        }
+    )
+    if not args.telegram_limits:
+        os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+        os.environ["TELEGRAM_CHAT_RATE"] = "1000000"
+
+
+def _summarize(recorder: Recorder, elapsed: float) -> dict:
+    return {
+        name: {
+            "count": len(latencies),
+            "errors": recorder.errors[name],
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "rps": round(len(latencies) / elapsed, 2),
+        }
+        for name, latencies in sorted(recorder.latencies.items())
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    recorder = Recorder()
+    telegram = FakeTelegram(args.telegram_latency, args.error_rate)
+    outline = FakeOutline(args.outline_latency, args.error_rate)
+    yoomoney = FakeYooMoney(args.yoomoney_latency, args.error_rate)
+    payments = Payments(yoomoney, recorder)
+    telegram.on_message = payments.on_message
+    for fake in (telegram, outline, yoomoney):
+        await fake.start()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        _configure_environment(args, data_dir, telegram, yoomoney)
+        bot_main = _import_bot()
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        from services import catalogue
+
+        application = bot_main.build_application(use_updater=False)
+        for group_handlers in application.handlers.values():
+            for handler in group_handlers:
+                handler.callback = recorder.wrap(
+                    _handler_name(handler), handler.callback
+                )
+
+        await application.initialize()
+        await bot_main.post_init(application)
+        for number in range(args.servers):
+            await catalogue.add_server(
+                "BM", f"10.0.0.{number}", f"{outline.url}/server{number}"
+            )
+        await application.start()
+
+        reconciler = asyncio.create_task(
+            reconcile_payments(recorder, args.reconcile_interval)
+        )
+        update_ids = itertools.count(1)
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                simulate_user(
+                    user_id, application, recorder, payments, update_ids, args
+                )
+                for user_id in range(1, args.users + 1)
+            )
+        )
+        elapsed = time.monotonic() - started
+        reconciler.cancel()
+
+        await application.stop()
+        await bot_main.post_shutdown(application)
+        await application.shutdown()
+    for fake in (telegram, outline, yoomoney):
+        await fake.stop()
+    return _summarize(recorder, elapsed)
+
+
+def print_results(results: dict) -> None:
+    print(  # noqa: T201
+        f"{'handler':<28}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'rps':>10}"
+    )
+    for name, result in results.items():
+        print(  # noqa: T201
+            f"{name:<28}{result['count']:>8}{result['errors']:>8}"
+            f"{result['p50_ms']:>10}{result['p99_ms']:>10}{result['rps']:>10}"
+        )
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Обработчики, у которых задержка или пропускная способность хуже базовой
+    или ошибок больше, чем в базовом прогоне.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if not actual:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if actual[metric] > expected[metric] * (1 + tolerance):
+                regressions.append((name, metric, expected[metric], actual[metric]))
+        if actual["rps"] < expected["rps"] * (1 - tolerance):
+            regressions.append((name, "rps", expected["rps"], actual["rps"]))
+        if actual["errors"] > expected["errors"]:
+            regressions.append((name, "errors", expected["errors"], actual["errors"]))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument(
+        "--ramp-up", type=float, default=10, help="за сколько секунд приходят все"
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=0.5, help="средняя пауза между действиями"
+    )
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--outline-latency", type=float, default=0.1)
+    parser.add_argument("--yoomoney-latency", type=float, default=0.2)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="доля ответов заглушек с ошибкой"
+    )
+    parser.add_argument("--reconcile-interval", type=float, default=1)
+    parser.add_argument("--payment-timeout", type=float, default=30)
+    parser.add_argument(
+        "--telegram-limits",
+        action="store_true",
+        help="отправлять сообщения с реальными лимитами Telegram",
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="записать результат как базовый"
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"Baseline saved to {args.baseline}")  # noqa: T201
+        return 0
+    if not args.baseline.exists():
+        return 0
+    regressions = compare_with_baseline(
+        results, json.loads(args.baseline.read_text()), args.tolerance
+    )
+    for name, metric, expected, actual in regressions:
+        print(f"REGRESSION {name} {metric}: {expected} -> {actual}")  # noqa: T201
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,22 @@
 import logging
 
 import handlers
+import metrics
+import templates
+import webhook
+import yoomoney_notifications
+import services.billing
 from db import async_init_db
+from outbox import outbox
+from services import bill_watch, fee_scheduler, outline, validation, yoomoney
 from telegram import Update
+from telegram_request import InstrumentedRequest
+from update_processor import TimestampedUpdateQueue, UserOrderedUpdateProcessor
 from telegram.ext import (
     Application,
     ApplicationBuilder,
     CallbackQueryHandler,
+    ChatMemberHandler,
     CommandHandler,
 )
 
@@ -21,9 +31,10 @@ COMMAND_HANDLERS = {
 }
 
 CALLBACK_QUERY_HANDLERS = {
-    rf"^{config.SERVER_PATTERN}(\d+)$": handlers.get_new_key,
+    rf"^{config.SERVER_PATTERN}(\d+|{config.SERVER_AUTO})$": handlers.get_new_key,
     rf"^{config.BALANCE_PATTERN}add$": handlers.add_account_balance,
     rf"^{config.BILL_PATTERN}.+$": handlers.check_account_balance,
+    rf"^{config.SERVERS_PAGE_PATTERN}(\d+)$": handlers.list_servers_page,
     # rf"^{config.BILLING_LIST_PATTERN}(\d+)$": handlers.all_books_button,
 }
 
@@ -40,28 +51,101 @@ if not config.TELEGRAM_BOT_TOKEN or not config.VPN_TELEGRAM_BOT_CHANNEL_ID:
         "wasn't implemented in .env (both should be initialized)."
     )
 
+if config.RUN_MODE == "webhook" and (
+    not config.WEBHOOK_URL or not config.WEBHOOK_SECRET_TOKEN
+):
+    raise ValueError(
+        "WEBHOOK_URL and WEBHOOK_SECRET_TOKEN env variables are required "
+        "when RUN_MODE is webhook."
+    )
+
+
+metrics_server = metrics.MetricsServer(config.METRICS_LISTEN, config.METRICS_PORT)
+
 
 async def post_init(application: Application) -> None:
+    templates.warm_up()
+    if config.METRICS_PORT:
+        await metrics_server.start()
+    outbox.start(application.bot)
     await async_init_db()
+    await services.billing.backfill_balance_snapshots()
     await handlers.trigger_check_payment_job(application)
+    if config.YOOMONEY_NOTIFICATION_SECRET:
+        await yoomoney_notifications.listener.start()
     await handlers.trigger_monthly_jobs(application)
+    await handlers.trigger_key_pool_job(application)
+    await handlers.trigger_key_inventory_job(application)
     # await handlers.trigger_notification_jobs(application)
 
 
-def main():
-    application = (
+async def post_shutdown(application: Application) -> None:
+    await yoomoney_notifications.listener.stop()
+    await outbox.stop()
+    await bill_watch.watcher.stop()
+    await metrics_server.stop()
+    await fee_scheduler.scheduler.stop()
+    await yoomoney.close_client()
+    await outline.close_clients()
+    await validation.close_client()
+
+
+def _instrument_handler(name: str, handler):
+    return metrics.instrument(metrics.HANDLER_DURATION, metrics.HANDLER_ERRORS, name)(
+        handler
+    )
+
+
+def build_application(use_updater: bool = True) -> Application:
+    update_queue = TimestampedUpdateQueue()
+    builder = (
         ApplicationBuilder()
         .token(config.TELEGRAM_BOT_TOKEN)
+        .base_url(f"{config.TELEGRAM_API_URL}/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
         .post_init(post_init)
-        .build()
+        .post_shutdown(post_shutdown)
+        .update_queue(update_queue)
+        .concurrent_updates(
+            UserOrderedUpdateProcessor(
+                max_workers=config.UPDATE_WORKERS,
+                max_pending_updates=config.UPDATE_MAX_PENDING,
+                update_queue=update_queue,
+            )
+        )
     )
+    if not use_updater:
+        builder.updater(None)
+    application = builder.build()
     for command_name, command_handler in COMMAND_HANDLERS.items():
-        application.add_handler(CommandHandler(command_name, command_handler))
+        application.add_handler(
+            CommandHandler(
+                command_name, _instrument_handler(f"/{command_name}", command_handler)
+            )
+        )
 
     for pattern, handler in CALLBACK_QUERY_HANDLERS.items():
-        application.add_handler(CallbackQueryHandler(handler, pattern=pattern))
+        application.add_handler(
+            CallbackQueryHandler(
+                _instrument_handler(handler.__name__, handler), pattern=pattern
+            )
+        )
+
+    application.add_handler(
+        ChatMemberHandler(
+            handlers.track_channel_membership, ChatMemberHandler.CHAT_MEMBER
+        )
+    )
+    return application
+
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+def main():
+    if config.RUN_MODE == "webhook":
+        # Обновления приходят в webhook.WebhookListener, getUpdates не нужен.
+        webhook.run_webhook(build_application(use_updater=False))
+    else:
+        build_application().run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,11 @@
 import os
 from pathlib import Path
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 load_dotenv("./config/.env")
 
@@ -10,23 +13,178 @@ load_dotenv("./config/.env")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 
 VPN_TELEGRAM_BOT_CHANNEL_ID = int(os.getenv("VPN_TELEGRAM_BOT_CHANNEL_ID", "0"))
+# Можно заменить на локальный Bot API сервер или заглушку для нагрузочных тестов.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# polling — опрос getUpdates, webhook — приём обновлений HTTP-сервером бота.
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+# Публичный адрес, который регистрируется в Telegram через setWebhook.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", urlsplit(WEBHOOK_URL).path or "/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")  # noqa: S104
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# Сколько секунд при остановке ждать приёма начатых запросов.
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+# Сколько обновлений обрабатывать одновременно и сколько держать в ожидании.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+
+# Лимиты Telegram на отправку сообщений: всего и в один чат, сообщений в секунду.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))
+
+# Адрес, на котором отдаются метрики Prometheus (GET /metrics), 0 — не отдавать.
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+TELEGRAM_API_TIMEOUT = float(os.getenv("TELEGRAM_API_TIMEOUT", "10"))
+# Сколько секунд доверять закешированному членству в канале.
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", str(6 * 60 * 60)))
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "60"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "100000"))
 SERVER_PATTERN = "server_"
+SERVER_AUTO = "auto"
 BALANCE_PATTERN = "balance_"
 BILL_PATTERN = "bill_"
+SERVERS_PAGE_PATTERN = "servers_page_"
 
 BASE_DIR = Path(__file__).resolve().parent
-SQLITE_DB_FILE = "/var/bot_service_data/db.sqlite3"
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "/var/bot_service_data/db.sqlite3")
 TEMPLATES_DIR = BASE_DIR / "templates"
+# Скомпилированные шаблоны, собираются командой `manage.py compile-templates`.
+TEMPLATES_BUNDLE = BASE_DIR / "templates_compiled.zip"
+
+# production: WAL и настройки соединений SQLite, development: настройки по умолчанию.
+DB_PROFILE = os.getenv("DB_PROFILE", "production")
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Отрицательное значение — размер кеша в KiB.
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
 
 DEFAULT_SUM = int(os.getenv("DEFAULT_SUM", "150"))
 MONTHLY_FEE = int(os.getenv("MONTHLY_FEE", "150"))
 
 YOOMONEY_TOKEN = os.getenv("YOOMONEY_TOKEN", "")
+YOOMONEY_API_URL = os.getenv("YOOMONEY_API_URL", "https://yoomoney.ru/api/")
+YOOMONEY_TIMEOUT = float(os.getenv("YOOMONEY_TIMEOUT", "10"))
+YOOMONEY_MAX_CONNECTIONS = int(os.getenv("YOOMONEY_MAX_CONNECTIONS", "10"))
+# Номер кошелька можно задать явно, тогда account-info не запрашивается.
+YOOMONEY_RECEIVER = os.getenv("YOOMONEY_RECEIVER", "")
+YOOMONEY_ACCOUNT_TTL = int(os.getenv("YOOMONEY_ACCOUNT_TTL", str(24 * 60 * 60)))
+# Наибольшая доля платежа, которую ЮMoney удерживает как комиссию: поступление
+# (amount) закрывает счёт, если оно не меньше суммы счёта за вычетом этой доли.
+YOOMONEY_MAX_COMMISSION = float(os.getenv("YOOMONEY_MAX_COMMISSION", "0.03"))
+# Секрет из настроек HTTP-уведомлений кошелька, без него уведомления не принимаются.
+YOOMONEY_NOTIFICATION_SECRET = os.getenv("YOOMONEY_NOTIFICATION_SECRET", "")
+YOOMONEY_NOTIFICATION_LISTEN = os.getenv("YOOMONEY_NOTIFICATION_LISTEN", "127.0.0.1")
+YOOMONEY_NOTIFICATION_PORT = int(os.getenv("YOOMONEY_NOTIFICATION_PORT", "8081"))
+YOOMONEY_NOTIFICATION_PATH = os.getenv("YOOMONEY_NOTIFICATION_PATH", "/yoomoney")
 
-DATE_FORMAT = "%d.%m.%Y"
+# Сколько секунд счёт ждёт оплаты и как часто проверять оплату открытых счетов.
+# С уведомлениями ЮMoney опрос только страхует от потерянных уведомлений.
+BILL_TTL = int(os.getenv("BILL_TTL", str(10 * 60)))
+BILL_POLL_INTERVAL = float(
+    os.getenv("BILL_POLL_INTERVAL", "120" if YOOMONEY_NOTIFICATION_SECRET else "40")
+)
+
+# bot — списания и проверку оплаты выполняет процесс бота, worker — отдельные
+# процессы `worker.py`, которые делят пользователей на WORKER_SHARDS частей.
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "bot")
+if BACKGROUND_JOBS not in ("bot", "worker"):
+    raise ValueError(f"BACKGROUND_JOBS must be bot or worker, not {BACKGROUND_JOBS!r}")
+
+
+def jobs_run_in_bot() -> bool:
+    """Выполняет ли фоновую работу процесс бота, а не воркеры."""
+    return BACKGROUND_JOBS == "bot"
+
+
+WORKER_SHARDS = int(os.getenv("WORKER_SHARDS", "4"))
+WORKER_ID = os.getenv("WORKER_ID", "")
+# Сколько секунд действует аренда части и как часто её продлевать.
+WORKER_LEASE_TTL = int(os.getenv("WORKER_LEASE_TTL", "60"))
+WORKER_LEASE_RENEW_INTERVAL = float(os.getenv("WORKER_LEASE_RENEW_INTERVAL", "20"))
+# Как часто перечитывать ключи: ключи, купленные в боте, попадают к воркеру так.
+WORKER_KEYS_RELOAD_INTERVAL = int(os.getenv("WORKER_KEYS_RELOAD_INTERVAL", "3600"))
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
 
+OUTLINE_CONNECT_TIMEOUT = float(os.getenv("OUTLINE_CONNECT_TIMEOUT", "5"))
+OUTLINE_READ_TIMEOUT = float(os.getenv("OUTLINE_READ_TIMEOUT", "15"))
+OUTLINE_MAX_CONNECTIONS = int(os.getenv("OUTLINE_MAX_CONNECTIONS", "5"))
 
-engine = create_async_engine(
-    "sqlite+aiosqlite:////var/bot_service_data/db.sqlite3",
-    echo=True,
+# Сколько готовых ключей держать на каждом сервере и при каком остатке пополнять.
+KEY_POOL_SIZE = int(os.getenv("KEY_POOL_SIZE", "10"))
+KEY_POOL_LOW_WATER = int(os.getenv("KEY_POOL_LOW_WATER", "5"))
+# Как часто (в секундах) сверять ключи в БД с ключами на серверах Outline.
+KEY_INVENTORY_SYNC_INTERVAL = int(os.getenv("KEY_INVENTORY_SYNC_INTERVAL", "900"))
+# Сколько секунд повторное нажатие на кнопку сервера получает уже выданный ключ.
+KEY_PURCHASE_DEDUP_WINDOW = float(os.getenv("KEY_PURCHASE_DEDUP_WINDOW", "5"))
+
+# Через сколько секунд перечитать список серверов, изменённых в обход бота.
+SERVER_CATALOGUE_TTL = int(os.getenv("SERVER_CATALOGUE_TTL", "300"))
+# Как часто проверять, не изменились ли серверы в другом процессе (manage.py).
+SERVER_CATALOGUE_CHECK_INTERVAL = float(
+    os.getenv("SERVER_CATALOGUE_CHECK_INTERVAL", "5")
 )
+# Для выбора наименее загруженного сервера, если у сервера не задан capacity.
+SERVER_DEFAULT_CAPACITY = int(os.getenv("SERVER_DEFAULT_CAPACITY", "1000"))
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+def _sqlite_pragmas(read_only: bool) -> list[str]:
+    if DB_PROFILE != "production":
+        return []
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}",
+        f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}",
+        "PRAGMA synchronous = NORMAL",
+    ]
+    if read_only:
+        return pragmas + ["PRAGMA query_only = ON"]
+    return ["PRAGMA journal_mode = WAL"] + pragmas
+
+
+def create_engine(read_only: bool = False) -> AsyncEngine:
+    """
+    Движок SQLite для профиля `DB_PROFILE`.
+
+    В профиле production включаются WAL и настройки соединений,
+    запись идёт через единственное соединение, а чтение — через
+    отдельный пул соединений только для чтения.
+    """
+    pool_options = {}
+    if DB_PROFILE == "production":
+        pool_options = {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": DB_READ_POOL_SIZE if read_only else 1,
+            "max_overflow": 0,
+        }
+    new_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{SQLITE_DB_FILE}",
+        echo=SQL_ECHO,
+        **pool_options,
+    )
+    pragmas = _sqlite_pragmas(read_only)
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return new_engine
+
+
+# Все записи в БД идут через `engine`, запросы только на чтение — через `read_engine`.
+engine = create_engine()
+read_engine = create_engine(read_only=True)
@@ -1,3 +1,4 @@
+from migrations import run_migrations
 from sqlmodel import SQLModel
 
 import config
@@ -6,3 +7,4 @@ import config
 async def async_init_db() -> None:
     async with config.engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(run_migrations)
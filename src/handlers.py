@@ -1,10 +1,24 @@
+import functools
 import logging
-from typing import cast
+import uuid
+from datetime import datetime
+from typing import Any, Sequence, cast
+
+import models
 
 import services.billing
 import services.db_management as db_management
 import telegram
-from services import yoomoney
+from services import (
+    bill_watch,
+    fee_scheduler,
+    key_inventory,
+    key_pool,
+    validation,
+    yoomoney,
+)
+from services.catalogue import ServerFullError, ServerNotAvailableError, catalogue
+from outbox import outbox
 from services.validation import is_user_in_channel
 from telegram import (
     Chat,
@@ -20,18 +34,23 @@ import config
 
 logger = logging.getLogger(__name__)
 
+# Telegram показывает не больше 100 кнопок,
+# три из них занимают автовыбор сервера и листание.
+SERVERS_PAGE_SIZE = 97
+
+_servers_keyboards: list[InlineKeyboardMarkup] = []
+_servers_keyboards_version: int | None = None
+
 
 def validate_user(handler):
+    @functools.wraps(handler)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = cast(User, update.effective_user).id
         if not await is_user_in_channel(user_id, config.VPN_TELEGRAM_BOT_CHANNEL_ID):
             await send_response(
                 update,
                 context,
-                response=render_template(
-                    "not_authorized.j2",
-                    data={"billing_account": "deprecated"},
-                ),
+                response=render_template("not_authorized.j2"),
             )
             return
         await handler(update, context)
@@ -39,14 +58,27 @@ def validate_user(handler):
     return wrapped
 
 
+async def track_channel_membership(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Обновляет индекс членства по событиям канала пользователей VPN."""
+    chat_member = update.chat_member
+    if not chat_member or chat_member.chat.id != config.VPN_TELEGRAM_BOT_CHANNEL_ID:
+        return
+    validation.set_membership(
+        user_id=chat_member.new_chat_member.user.id,
+        channel_id=chat_member.chat.id,
+        is_member=chat_member.new_chat_member.status in validation.MEMBER_STATUSES,
+    )
+
+
 async def send_response(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     response: str,
     keyboard: InlineKeyboardMarkup | None = None,
 ) -> None:
-    args = {
-        "chat_id": _get_chat_id(update),
+    args: dict[str, Any] = {
         "disable_web_page_preview": True,
         "text": response,
         "parse_mode": telegram.constants.ParseMode.HTML,
@@ -54,7 +86,7 @@ async def send_response(
     if keyboard:
         args["reply_markup"] = keyboard
 
-    await context.bot.send_message(**args)  # type: ignore
+    await outbox.send(_get_chat_id(update), **args)
 
 
 def _get_chat_id(update: Update) -> int:
@@ -109,6 +141,21 @@ async def get_new_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "Нажми /balance для проверки."
             ),
         )
+        return
+    except ServerFullError:
+        await send_response(
+            update,
+            context,
+            response="На этом сервере закончились места, выбери другой /list_servers.",
+        )
+        return
+    except ServerNotAvailableError:
+        await send_response(
+            update,
+            context,
+            response="Этот сервер больше недоступен, выбери другой /list_servers.",
+        )
+        return
     await send_response(
         update,
         context,
@@ -119,10 +166,13 @@ async def get_new_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-def _get_server_id(query_data) -> int:
+def _get_server_id(query_data) -> int | None:
+    """Номер выбранного сервера, None — выбрать сервер автоматически."""
     pattern_prefix_length = len(config.SERVER_PATTERN)
-
-    return int(query_data[pattern_prefix_length:])
+    server_id = query_data[pattern_prefix_length:]
+    if server_id == config.SERVER_AUTO:
+        return None
+    return int(server_id)
 
 
 def _get_bill_id(query_data) -> str:
@@ -147,24 +197,78 @@ async def list_all_servers_handler(
 ) -> None:
     if not update.message:
         return
-    servers = await db_management.get_available_servers()
+    await send_response(
+        update,
+        context,
+        response="Посмотри доступные серверы, и выбери в списке ниже",
+        keyboard=await _get_servers_keyboard(page=0),
+    )
 
-    reply_keyboard = [
-        [
-            InlineKeyboardButton(
-                f"Сервер {key.country_code}: {key.ip_address}",
-                callback_data=f"{config.SERVER_PATTERN}{key.id}",
-            )
-        ]
-        for key in servers
-    ]
 
-    await update.message.reply_text(
-        "Посмотри доступные серверы, и выбери в списке ниже",
-        reply_markup=InlineKeyboardMarkup(
-            reply_keyboard,
-        ),
-    )
+async def list_servers_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not query or not query.data:
+        return
+    await query.answer()
+    page = int(query.data[len(config.SERVERS_PAGE_PATTERN) :])
+    await query.edit_message_reply_markup(await _get_servers_keyboard(page))
+
+
+async def _get_servers_keyboard(page: int) -> InlineKeyboardMarkup:
+    """Клавиатура со списком серверов, пересобирается при изменении каталога."""
+    global _servers_keyboards, _servers_keyboards_version
+    servers = await catalogue.servers()
+    if _servers_keyboards_version != catalogue.version:
+        _servers_keyboards = _build_servers_keyboards(servers)
+        _servers_keyboards_version = catalogue.version
+    return _servers_keyboards[min(page, len(_servers_keyboards) - 1)]
+
+
+def _build_servers_keyboards(
+    servers: Sequence[models.Server],
+) -> list[InlineKeyboardMarkup]:
+    pages = [
+        servers[start : start + SERVERS_PAGE_SIZE]
+        for start in range(0, len(servers), SERVERS_PAGE_SIZE)
+    ] or [[]]
+    keyboards = []
+    for page, page_servers in enumerate(pages):
+        reply_keyboard = [
+            [
+                InlineKeyboardButton(
+                    f"Сервер {server.country_code}: {server.ip_address}",
+                    callback_data=f"{config.SERVER_PATTERN}{server.id}",
+                )
+            ]
+            for server in page_servers
+        ]
+        if page == 0 and servers:
+            reply_keyboard.insert(
+                0,
+                [
+                    InlineKeyboardButton(
+                        "Выбрать автоматически",
+                        callback_data=f"{config.SERVER_PATTERN}{config.SERVER_AUTO}",
+                    )
+                ],
+            )
+        navigation = []
+        if page > 0:
+            navigation.append(
+                InlineKeyboardButton(
+                    "⬅️", callback_data=f"{config.SERVERS_PAGE_PATTERN}{page - 1}"
+                )
+            )
+        if page < len(pages) - 1:
+            navigation.append(
+                InlineKeyboardButton(
+                    "➡️", callback_data=f"{config.SERVERS_PAGE_PATTERN}{page + 1}"
+                )
+            )
+        if navigation:
+            reply_keyboard.append(navigation)
+        keyboards.append(InlineKeyboardMarkup(reply_keyboard))
+    return keyboards
 
 
 async def send_message_job(context: ContextTypes.DEFAULT_TYPE):
@@ -173,58 +277,69 @@ async def send_message_job(context: ContextTypes.DEFAULT_TYPE):
     if not job or not job.chat_id:
         return
 
-    await context.bot.send_message(chat_id=int(job.chat_id), text="job executed")
+    outbox.send_nowait(int(job.chat_id), text="job executed")
 
 
-async def check_bills_handler(context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет оплаченность счетов и пишет сообщения
-    пользователям в случае успешного проведения."""
-    job = context.job
-
-    if not job or not job.user_id or not job.chat_id:
-        return
-    user_id = int(job.user_id)
-    await services.billing.delete_stale_bills()
-    payed_bills = await services.billing.check_payment_status_for_bills(user_id)
-
+def notify_payed_bills(payed_bills: list[models.Bill]) -> None:
+    """Пишет пользователям об оплаченных счетах."""
     for bill in payed_bills:
-        await context.bot.send_message(
-            chat_id=bill.user_id,
+        outbox.send_nowait(
+            bill.user_id,
             text="Оплата счёта принята 😎🍻. Проверь баланс /balance.",
         )
 
 
 async def trigger_check_payment_job(application: Application):
-    """Задание на проверку оплаты счетов."""
-    users = await db_management.list_all_user_chats()
+    """
+    Проверка оплаты открытых счетов, пока они не оплачены или не истекли.
+    С воркерами счета проверяют они, а бот только сообщает об оплате
+    из уведомлений ЮMoney.
+    """
+    if not config.jobs_run_in_bot():
+        bill_watch.watcher.on_payed(notify_payed_bills)
+        return
+    await bill_watch.watcher.start(on_payed=notify_payed_bills)
+
+
+async def trigger_monthly_jobs(application: Application):
+    """Ежемесячные списания, срабатывают в срок оплаты каждого ключа."""
+    if not config.jobs_run_in_bot():
+        return
+    await fee_scheduler.scheduler.start()
+
+
+async def refill_key_pools_handler(context: ContextTypes.DEFAULT_TYPE):
+    await key_pool.refill_key_pools()
+
+
+async def trigger_key_pool_job(application: Application):
+    """Пополнение пулов готовых ключей на серверах."""
     job = application.job_queue
     if not job:
         return
-    for user in users:
-        job.run_repeating(
-            callback=check_bills_handler,
-            interval=40.0,
-            first=0.0,
-            chat_id=user.telegram_id,
-            user_id=user.telegram_id,
-        )
+    job.run_repeating(
+        callback=refill_key_pools_handler,
+        interval=60.0,
+        first=0.0,
+    )
 
 
-async def withdraw_monthly_fee_handler(context: ContextTypes.DEFAULT_TYPE):
-    await services.billing.withdraw_monthly_fee()
+async def sync_key_inventory_handler(context: ContextTypes.DEFAULT_TYPE):
+    await key_inventory.sync_inventory()
 
 
-async def trigger_monthly_jobs(application: Application):
-    """Ежемесячные задания."""
+async def trigger_key_inventory_job(application: Application):
+    """Синхронизация инвентаря ключей с серверами Outline."""
     job = application.job_queue
     if not job:
         return
     job.run_repeating(
-        callback=withdraw_monthly_fee_handler,
-        interval=10.0,
+        callback=sync_key_inventory_handler,
+        interval=config.KEY_INVENTORY_SYNC_INTERVAL,
         first=0.0,
     )
 
+
 async def trigger_notification_jobs(application: Application):
     """Восстанавливаем напоминания пользователям."""
     users = await db_management.list_all_user_chats()
@@ -266,9 +381,11 @@ async def add_account_balance(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not update.effective_user:
         return
 
-    _, url = await yoomoney.create_new_bill_coro(
+    bill_id, url = await yoomoney.create_new_bill_coro(
         user_id=update.effective_user.id,
     )
+    if config.jobs_run_in_bot():
+        bill_watch.watcher.watch(uuid.UUID(bill_id), issued_at=datetime.now())
 
     await send_response(
         context=context,
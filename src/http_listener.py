@@ -0,0 +1,138 @@
+"""Небольшой HTTP-сервер на asyncio для вебхуков и метрик."""
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+
+
+class HttpListener:
+    """
+    HTTP-сервер, который принимает по одному запросу на соединение.
+
+    Запросы на `url_path` с методом `method` передаются в `handle`,
+    остальным сразу отвечает 404 или 405. Некорректный или не дошедший
+    за `request_timeout` секунд запрос получает 400.
+    """
+
+    # Как сервер называется в логах.
+    name = "HTTP server"
+    method = "POST"
+    max_body_size = 1024 * 1024
+    # Сколько секунд ждать от клиента запрос целиком.
+    request_timeout: float = 10
+    content_type: str | None = None
+
+    def __init__(self, listen: str, port: int, url_path: str) -> None:
+        self._listen = listen
+        self._port = port
+        self._url_path = url_path
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    @property
+    def port(self) -> int:
+        """Порт, на котором слушает сервер (если в настройках указан 0)."""
+        if not self._server:
+            return self._port
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self._listen, self._port
+        )
+        logger.info(
+            f"{self.name} is listening on {self._listen}:{self.port}{self._url_path}."
+        )
+
+    async def stop(self, timeout: float | None = None) -> None:
+        """
+        Перестаёт принимать соединения. С `timeout` ещё и ждёт, пока
+        начатые запросы обработаются, а оставшиеся после него отменяет.
+        """
+        if not self._server:
+            return
+        self._server.close()
+        self._server = None
+        if timeout is None or not self._connections:
+            return
+        _, pending = await asyncio.wait(self._connections, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(
+                f"{self.name}: {len(pending)} requests were dropped on stop."
+            )
+
+    async def handle(self, request: Request) -> HTTPStatus:
+        raise NotImplementedError
+
+    def response_body(self) -> bytes:
+        """Тело ответа 200."""
+        return b""
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        if task:
+            self._connections.add(task)
+        try:
+            try:
+                status = await asyncio.wait_for(
+                    self._handle_request(reader), timeout=self.request_timeout
+                )
+            except (
+                ValueError,
+                TypeError,
+                KeyError,
+                asyncio.IncompleteReadError,
+                asyncio.TimeoutError,
+            ):
+                status = HTTPStatus.BAD_REQUEST
+            except Exception:
+                logger.exception(f"{self.name} request failed.")
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = self.response_body() if status == HTTPStatus.OK else b""
+            content_type = (
+                f"Content-Type: {self.content_type}\r\n" if self.content_type else ""
+            )
+            writer.write(
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"{content_type}"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            if task:
+                self._connections.discard(task)
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> HTTPStatus:
+        method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path.split("?", 1)[0] != self._url_path:
+            return HTTPStatus.NOT_FOUND
+        if method != self.method:
+            return HTTPStatus.METHOD_NOT_ALLOWED
+        content_length = int(headers.get("content-length", "0"))
+        if content_length > self.max_body_size:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        body = await reader.readexactly(content_length)
+        return await self.handle(Request(method, path, headers, body))
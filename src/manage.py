@@ -0,0 +1,166 @@
+"""Служебные команды бота.
+
+Запуск: python ./src/manage.py <команда>
+"""
+import argparse
+import asyncio
+import sys
+
+import migrations
+import services.billing
+import templates
+from db import async_init_db
+from services import catalogue, key_inventory
+
+
+async def check_balances(fix: bool) -> int:
+    """Сверяет снимки балансов с журналом операций."""
+    drifts = await services.billing.find_balance_drift()
+    for drift in drifts:
+        print(  # noqa: T201
+            f"user_id={drift.user_id} snapshot={drift.snapshot} ledger={drift.ledger}"
+        )
+    print(f"Balances with drift: {len(drifts)}")  # noqa: T201
+    if drifts and fix:
+        await services.billing.rebuild_balance_snapshots()
+        print("Balance snapshots were rebuilt from the ledger.")  # noqa: T201
+        return 0
+    return 1 if drifts else 0
+
+
+async def check_keys() -> int:
+    """Синхронизирует инвентарь ключей и показывает расхождения с серверами."""
+    await async_init_db()
+    report = await key_inventory.sync_inventory()
+    for result in report.synced:
+        print(  # noqa: T201
+            f"server={result.server_id} added={result.added} "
+            f"updated={result.updated} removed={result.removed}"
+        )
+    for server_id in report.failed_server_ids:
+        print(f"server={server_id} sync failed")  # noqa: T201
+    for key in report.orphaned:
+        print(  # noqa: T201
+            f"orphaned: server={key.server_id} key_id={key.outline_key_id} "
+            f"name={key.name}"
+        )
+    for user_key in report.missing:
+        print(  # noqa: T201
+            f"missing: server={user_key.server_id} user_id={user_key.telegram_id} "
+            f"key_id={user_key.id}"
+        )
+    print(  # noqa: T201
+        f"Orphaned keys: {len(report.orphaned)}, missing keys: {len(report.missing)}"
+    )
+    return 1 if report.orphaned or report.missing or report.failed_server_ids else 0
+
+
+async def add_server(
+    country_code: str, ip_address: str, api_url: str, capacity: int | None
+) -> int:
+    await async_init_db()
+    server = await catalogue.add_server(country_code, ip_address, api_url, capacity)
+    print(f"Server {server.id} was added.")  # noqa: T201
+    return 0
+
+
+async def update_server(server_id: int, **fields) -> int:
+    try:
+        await catalogue.update_server(server_id, **fields)
+    except catalogue.ServerNotAvailableError:
+        print(f"Server {server_id} not found.")  # noqa: T201
+        return 1
+    print(f"Server {server_id} was updated: {fields}.")  # noqa: T201
+    return 0
+
+
+def migrate(dry_run: bool) -> int:
+    """Применяет миграции схемы или показывает, что будет сделано."""
+    if not dry_run:
+        asyncio.run(async_init_db())
+        print("Migrations applied.")  # noqa: T201
+        return 0
+    pending, plans = migrations.dry_run()
+    print(f"Pending migrations: {len(pending)}")  # noqa: T201
+    for migration in pending:
+        print(f"  {migration.version}: {migration.description}")  # noqa: T201
+    for name, plan in plans.items():
+        print(f"\n{name}")  # noqa: T201
+        for detail in plan:
+            print(f"  {detail}")  # noqa: T201
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check_balances_parser = commands.add_parser(
+        "check-balances", help="сверить балансы с журналом операций"
+    )
+    check_balances_parser.add_argument(
+        "--fix", action="store_true", help="пересчитать снимки балансов по журналу"
+    )
+
+    migrate_parser = commands.add_parser("migrate", help="применить миграции схемы")
+    migrate_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="не менять БД, показать миграции и планы запросов после них",
+    )
+
+    commands.add_parser(
+        "compile-templates", help="собрать скомпилированные шаблоны ответов"
+    )
+
+    add_server_parser = commands.add_parser("add-server", help="добавить сервер")
+    add_server_parser.add_argument("country_code")
+    add_server_parser.add_argument("ip_address")
+    add_server_parser.add_argument("api_url", help="адрес Outline Management API")
+    add_server_parser.add_argument(
+        "--capacity", type=int, help="сколько ключей можно выдать на сервере"
+    )
+
+    set_server_active_parser = commands.add_parser(
+        "set-server-active", help="включить или отключить сервер"
+    )
+    set_server_active_parser.add_argument("server_id", type=int)
+    set_server_active_parser.add_argument(
+        "--off", action="store_true", help="отключить сервер"
+    )
+
+    set_server_capacity_parser = commands.add_parser(
+        "set-server-capacity", help="ограничить число ключей на сервере"
+    )
+    set_server_capacity_parser.add_argument("server_id", type=int)
+    set_server_capacity_parser.add_argument(
+        "capacity", type=int, nargs="?", help="без значения — снять ограничение"
+    )
+
+    commands.add_parser(
+        "check-keys", help="сверить ключи в БД с ключами на серверах Outline"
+    )
+
+    args = parser.parse_args()
+    if args.command == "check-balances":
+        return asyncio.run(check_balances(fix=args.fix))
+    if args.command == "migrate":
+        return migrate(dry_run=args.dry_run)
+    if args.command == "add-server":
+        return asyncio.run(
+            add_server(args.country_code, args.ip_address, args.api_url, args.capacity)
+        )
+    if args.command == "set-server-active":
+        return asyncio.run(update_server(args.server_id, is_active=not args.off))
+    if args.command == "set-server-capacity":
+        return asyncio.run(update_server(args.server_id, capacity=args.capacity))
+    if args.command == "check-keys":
+        return asyncio.run(check_keys())
+    if args.command == "compile-templates":
+        templates.compile_templates()
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""Метрики бота, отдаются в текстовом формате Prometheus."""
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Iterator, Protocol, TypeVar
+
+from http_listener import HttpListener, Request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Function = TypeVar("Function", bound=Callable[..., Awaitable[Any]])
+
+
+class Metric(Protocol):
+    def render(self) -> list[str]:
+        ...
+
+
+_registry: list[Metric] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    values = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in labels.items()
+    )
+    return f"{{{values}}}"
+
+
+class _MetricFamily:
+    """
+    Метрика с необязательными метками: значения хранятся отдельно
+    для каждого набора значений меток, `labels(...)` возвращает такую серию.
+    """
+
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._series: dict[tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}.")
+        if values not in self._series:
+            self._series[values] = self._new_series()
+        return self._series[values]
+
+    def _new_series(self) -> Any:
+        raise NotImplementedError
+
+    def _samples(self, labels: dict[str, str]) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        if not self.labelnames:
+            return lines + self._samples({})
+        for values, series in sorted(self._series.items()):
+            lines += series._samples(dict(zip(self.labelnames, values, strict=True)))
+        return lines
+
+
+class Histogram(_MetricFamily):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple = DEFAULT_BUCKETS,
+        labelnames: tuple[str, ...] = (),
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_series(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started)
+
+    def _samples(self, labels: dict[str, str]) -> list[str]:
+        lines = []
+        cumulative = 0
+        bucket_counts = self._bucket_counts[:-1]
+        for bound, bucket_count in zip(self.buckets, bucket_counts, strict=True):
+            cumulative += bucket_count
+            bucket_labels = _format_labels({**labels, "le": str(bound)})
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        inf_labels = _format_labels({**labels, "le": "+Inf"})
+        lines += [
+            f"{self.name}_bucket{inf_labels} {self.count}",
+            f"{self.name}_sum{_format_labels(labels)} {self.sum}",
+            f"{self.name}_count{_format_labels(labels)} {self.count}",
+        ]
+        return lines
+
+
+class Counter(_MetricFamily):
+    type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def _new_series(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _samples(self, labels: dict[str, str]) -> list[str]:
+        return [f"{self.name}{_format_labels(labels)} {self.value}"]
+
+
+class Gauge(_MetricFamily):
+    type = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def _new_series(self) -> "Gauge":
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def _samples(self, labels: dict[str, str]) -> list[str]:
+        return [f"{self.name}{_format_labels(labels)} {self.value}"]
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    buckets: tuple = DEFAULT_BUCKETS,
+    labelnames: tuple[str, ...] = (),
+) -> Histogram:
+    metric = Histogram(name, documentation, buckets, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def counter(
+    name: str, documentation: str, labelnames: tuple[str, ...] = ()
+) -> Counter:
+    metric = Counter(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+    metric = Gauge(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus."""
+    return "".join(f"{line}\n" for metric in _registry for line in metric.render())
+
+
+HANDLER_DURATION = histogram(
+    "bot_handler_duration_seconds",
+    "Время работы обработчика команды или кнопки.",
+    labelnames=("handler",),
+)
+HANDLER_ERRORS = counter(
+    "bot_handler_errors_total",
+    "Сколько раз обработчик завершился исключением.",
+    labelnames=("handler",),
+)
+SERVICE_DURATION = histogram(
+    "bot_service_duration_seconds",
+    "Время работы функции сервиса.",
+    labelnames=("function",),
+)
+SERVICE_ERRORS = counter(
+    "bot_service_errors_total",
+    "Сколько раз функция сервиса завершилась исключением.",
+    labelnames=("function",),
+)
+EXTERNAL_DURATION = histogram(
+    "bot_external_request_duration_seconds",
+    "Время запроса к внешнему API: Telegram, Outline или ЮMoney.",
+    labelnames=("service", "method"),
+)
+EXTERNAL_ERRORS = counter(
+    "bot_external_request_errors_total",
+    "Сколько запросов к внешнему API завершились ошибкой.",
+    labelnames=("service", "method"),
+)
+
+
+@contextmanager
+def track(
+    duration: Histogram, errors: Counter, *label_values: str
+) -> Iterator[None]:
+    """Замеряет время блока и считает исключения, которые из него вылетели."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        errors.labels(*label_values).inc()
+        raise
+    finally:
+        duration.labels(*label_values).observe(time.monotonic() - started)
+
+
+def instrument(
+    duration: Histogram, errors: Counter, *label_values: str
+) -> Callable[[Function], Function]:
+    """Декоратор корутины: замеряет время и считает исключения."""
+
+    def decorator(function: Function) -> Function:
+        @functools.wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with track(duration, errors, *label_values):
+                return await function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def service(function: Function) -> Function:
+    """Замеряет функцию сервиса, метка — `модуль.функция`."""
+    module = function.__module__.rsplit(".", 1)[-1]
+    return instrument(
+        SERVICE_DURATION, SERVICE_ERRORS, f"{module}.{function.__name__}"
+    )(function)
+
+
+class MetricsServer(HttpListener):
+    """HTTP-сервер, который отдаёт метрики на GET /metrics."""
+
+    name = "Metrics server"
+    method = "GET"
+    content_type = CONTENT_TYPE
+
+    def __init__(self, listen: str, port: int) -> None:
+        super().__init__(listen, port, "/metrics")
+
+    async def handle(self, request: Request) -> HTTPStatus:
+        return HTTPStatus.OK
+
+    def response_body(self) -> bytes:
+        return render().encode()
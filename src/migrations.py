@@ -0,0 +1,208 @@
+"""Версионные миграции схемы БД.
+
+Таблицы создаются по моделям через `SQLModel.metadata.create_all`,
+а всё, что create_all не умеет (индексы, новые колонки в существующих
+таблицах, перенос данных), описывается здесь и применяется при старте.
+"""
+import logging
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+import models
+from sqlalchemy import Connection, create_engine, insert, inspect, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlmodel import SQLModel, col
+
+import config
+from services import billing, catalogue, db_management, key_inventory, key_pool
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaOutdatedError(Exception):
+    """Нужные процессу миграции ещё не применены."""
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_index(
+    conn: Connection,
+    name: str,
+    table: str,
+    columns: str,
+    where: str | None = None,
+) -> None:
+    statement = f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        statement += f" WHERE {where}"
+    conn.exec_driver_sql(statement)
+
+
+def _add_billing_and_key_indexes(conn: Connection) -> None:
+    _create_index(conn, "ix_balance_user_id", "balance", "user_id")
+    _create_index(
+        conn, "ix_bill_unpaid_user_id", "bill", "user_id", where="payed_at IS NULL"
+    )
+    _create_index(
+        conn, "ix_bill_unpaid_issued_at", "bill", "issued_at", where="payed_at IS NULL"
+    )
+    _create_index(conn, "ix_user_key_last_payed_at", "user_key", "last_payed_at")
+    _create_index(conn, "ix_user_key_user_server", "user_key", "telegram_id, server_id")
+    _create_index(conn, "ix_user_key_server_id", "user_key", "server_id")
+    _create_index(conn, "ix_pooled_key_server_id", "pooled_key", "server_id, id")
+
+
+def _add_server_capacity(conn: Connection) -> None:
+    columns = {row.name for row in conn.exec_driver_sql("PRAGMA table_info(server)")}
+    if "capacity" not in columns:
+        conn.exec_driver_sql("ALTER TABLE server ADD COLUMN capacity INTEGER")
+    if "key_count" not in columns:
+        conn.exec_driver_sql(
+            "ALTER TABLE server ADD COLUMN key_count INTEGER NOT NULL DEFAULT 0"
+        )
+    conn.exec_driver_sql(
+        "UPDATE server SET key_count = "
+        "(SELECT count(*) FROM user_key WHERE user_key.server_id = server.id)"
+    )
+
+
+def _add_inventory_indexes(conn: Connection) -> None:
+    _create_index(
+        conn, "ix_inventory_key_server_name", "inventory_key", "server_id, name"
+    )
+    _create_index(conn, "ix_inventory_key_access_url", "inventory_key", "access_url")
+    _create_index(conn, "ix_user_key_key_body", "user_key", "key_body")
+    _create_index(conn, "ix_pooled_key_access_url", "pooled_key", "access_url")
+
+
+def _create_job_lease_table(conn: Connection) -> None:
+    SQLModel.metadata.create_all(
+        conn, tables=[models.JobLease.__table__]  # type: ignore
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "indexes for billing and key queries", _add_billing_and_key_indexes),
+    Migration(2, "server capacity and key counts", _add_server_capacity),
+    Migration(3, "indexes for outline key inventory", _add_inventory_indexes),
+    Migration(4, "job leases for background workers", _create_job_lease_table),
+]
+
+
+class ExplainQueryPlan(Executable, ClauseElement):
+    """EXPLAIN QUERY PLAN для запроса SQLAlchemy."""
+
+    inherit_cache = False
+
+    def __init__(self, statement: Executable) -> None:
+        self.statement = statement
+
+
+@compiles(ExplainQueryPlan, "sqlite")
+def _compile_explain_query_plan(element: ExplainQueryPlan, compiler, **kw) -> str:
+    return f"EXPLAIN QUERY PLAN {compiler.process(element.statement, **kw)}"
+
+
+def service_queries() -> dict[str, Executable]:
+    """
+    Запросы сервисов, планы которых показывает `manage.py migrate --dry-run`.
+
+    Запросы строятся теми же функциями, что используют сервисы,
+    с произвольными значениями параметров.
+    """
+    return {
+        "billing.check_balance": billing.balance_snapshot_query(1),
+        "billing.check_balance (ledger)": billing.ledger_sum_query(1),
+        "billing.list_unpayed_bills": billing.unpayed_bills_query(1),
+        "billing.reconcile_payments": billing.open_bills_query(),
+        "billing.delete_expired_bills": billing.expired_bills_statement(
+            [uuid.uuid4(), uuid.uuid4()]
+        ),
+        "billing.list_keys_to_withdraw": billing.keys_to_withdraw_query(
+            datetime.now()
+        ),
+        "db_management._check_if_user_has_key": db_management.user_keys_query(
+            models.BotUser(telegram_id=1), server_id=1
+        ),
+        "catalogue.ServerCatalogue": catalogue.active_servers_query(),
+        "key_inventory.find_key": key_inventory.find_key_query("user", server_id=1),
+        "key_inventory.find_orphaned_keys": key_inventory.orphaned_keys_query([1]),
+        "key_pool.claim_key": key_pool.claim_key_statement(1),
+    }
+
+
+def pending_migrations(conn: Connection) -> list[Migration]:
+    SQLModel.metadata.create_all(
+        conn, tables=[models.SchemaMigration.__table__]  # type: ignore
+    )
+    applied = set(conn.scalars(select(col(models.SchemaMigration.version))))
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def require_version(conn: Connection, version: int) -> None:
+    """
+    Бросает `SchemaOutdatedError`, если не применены миграции до `version`
+    включительно. Миграции применяет бот при старте или `manage.py migrate`.
+    """
+    applied: set[int] = set()
+    if inspect(conn).has_table(models.SchemaMigration.__tablename__):
+        applied = set(conn.scalars(select(col(models.SchemaMigration.version))))
+    missing = [
+        migration.version
+        for migration in MIGRATIONS
+        if migration.version <= version and migration.version not in applied
+    ]
+    if missing:
+        raise SchemaOutdatedError(f"Migrations {missing} are not applied.")
+
+
+def run_migrations(conn: Connection) -> list[Migration]:
+    """Применяет ещё не применённые миграции, возвращает их список."""
+    migrations = pending_migrations(conn)
+    for migration in migrations:
+        logger.info(f"Applying migration {migration.version}: {migration.description}")
+        migration.upgrade(conn)
+        conn.execute(
+            insert(models.SchemaMigration).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.now(),
+            )
+        )
+    return migrations
+
+
+def explain_service_queries(conn: Connection) -> dict[str, list[str]]:
+    """Планы выполнения (EXPLAIN QUERY PLAN) запросов сервисов."""
+    return {
+        name: [row.detail for row in conn.execute(ExplainQueryPlan(statement))]
+        for name, statement in service_queries().items()
+    }
+
+
+def dry_run(db_file: str = config.SQLITE_DB_FILE) -> tuple[list[Migration], dict]:
+    """
+    Применяет миграции к копии БД в памяти.
+
+    Возвращает миграции, которые будут применены, и планы запросов
+    сервисов после их применения. Файл БД не изменяется.
+    """
+    copy = sqlite3.connect(":memory:", check_same_thread=False)
+    source = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    source.backup(copy)
+    source.close()
+    engine = create_engine("sqlite://", creator=lambda: copy, poolclass=StaticPool)
+    with engine.begin() as conn:
+        SQLModel.metadata.create_all(conn)
+        migrations = run_migrations(conn)
+        plans = explain_service_queries(conn)
+    engine.dispose()
+    return migrations, plans
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import Optional
 from uuid import UUID
 
+from sqlalchemy import UniqueConstraint
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -52,7 +53,40 @@ class Server(SQLModel, table=True):
     )
     is_active: bool = Field(default=True)
     api_url: str
+    # Сколько ключей можно выдать на сервере, None — без ограничения.
+    capacity: Optional[int] = Field(default=None)
+    # Число выданных ключей, меняется вместе с выдачей ключа.
+    key_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
+    @property
+    def is_full(self) -> bool:
+        return self.capacity is not None and self.key_count >= self.capacity
+
+
+class PooledKey(SQLModel, table=True):
+    """Заранее созданные на сервере ключи, которые ещё не выданы."""
+
+    __tablename__ = "pooled_key"
+
+    id: Optional[int] = Field(primary_key=True, default=None)
+    server_id: int = Field(foreign_key="server.id")
+    outline_key_id: str
+    access_url: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+
+class InventoryKey(SQLModel, table=True):
+    """Ключи на серверах Outline по данным последней синхронизации."""
+
+    __tablename__ = "inventory_key"
+    __table_args__ = (UniqueConstraint("server_id", "outline_key_id"),)
+
+    id: Optional[int] = Field(primary_key=True, default=None)
+    server_id: int = Field(foreign_key="server.id")
+    outline_key_id: str
+    name: str
+    access_url: str
+    synced_at: datetime = Field(default_factory=lambda: datetime.now())
 
 
 class Bill(SQLModel, table=True):
@@ -72,3 +106,41 @@ class Balance(SQLModel, table=True):
     user_id: int = Field(foreign_key="bot_user.telegram_id")
     user: BotUser = Relationship(back_populates="balance")
     sum: int
+
+
+class UserBalance(SQLModel, table=True):
+    """Текущий баланс пользователя, обновляется вместе с каждой операцией."""
+
+    __tablename__ = "user_balance"
+
+    user_id: int = Field(primary_key=True, foreign_key="bot_user.telegram_id")
+    sum: int = Field(default=0)
+
+
+class SchemaMigration(SQLModel, table=True):
+    """Применённые миграции схемы БД."""
+
+    __tablename__ = "schema_migration"
+
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime = Field(default_factory=lambda: datetime.now())
+
+
+class CacheVersion(SQLModel, table=True):
+    """Версия данных, закешированных в процессе бота, меняется из других процессов."""
+
+    __tablename__ = "cache_version"
+
+    name: str = Field(primary_key=True)
+    version: int = 0
+
+
+class JobLease(SQLModel, table=True):
+    """Аренда фоновой работы процессом `worker.py`."""
+
+    __tablename__ = "job_lease"
+
+    name: str = Field(primary_key=True)
+    owner: str
+    expires_at: datetime = Field(index=True)
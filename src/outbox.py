@@ -0,0 +1,252 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, NamedTuple
+
+import metrics
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_QUEUE_DEPTH = metrics.gauge(
+    "bot_outbox_queue_depth", "Сколько сообщений ждёт отправки в Telegram."
+)
+OUTBOX_SEND_LATENCY = metrics.histogram(
+    "bot_outbox_send_latency_seconds",
+    "Время от постановки сообщения в очередь до его отправки.",
+)
+# Начиная с этого числа корзин чатов неактивные корзины удаляются.
+CHAT_BUCKETS_PRUNE_SIZE = 1000
+
+
+class Priority(IntEnum):
+    # Ответы пользователю отправляются раньше рассылок.
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def delay(self) -> float:
+        """Сколько секунд ждать следующего токена, не забирая его."""
+        idle = time.monotonic() - self._updated_at
+        tokens = min(self.capacity, self._tokens + idle * self.rate)
+        return max((1 - tokens) / self.rate, 0)
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд ждать его появления."""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+        self._tokens -= 1
+        return max(-self._tokens / self.rate, 0)
+
+    def is_idle(self) -> bool:
+        """Корзина наполнилась бы до конца, её можно пересоздать без потерь."""
+        idle = time.monotonic() - self._updated_at
+        return self._tokens + idle * self.rate >= self.capacity
+
+
+class OutgoingMessage(NamedTuple):
+    chat_id: int
+    kwargs: dict[str, Any]
+    queued_at: float
+    result: asyncio.Future | None
+
+
+QueueEntry = tuple[int, int, OutgoingMessage]
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений Telegram.
+
+    Скорость отправки ограничивается корзинами токенов: общей для бота
+    и отдельной для каждого чата. Сообщения чата, корзина которого пуста,
+    откладываются до появления токена, не занимая обработчики очереди,
+    и возвращаются в очередь в прежнем порядке. Если Telegram ответил 429,
+    отправка приостанавливается на `retry_after`, а сообщение
+    отправляется повторно.
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.PriorityQueue[QueueEntry] = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._global_bucket = TokenBucket(
+            config.TELEGRAM_GLOBAL_RATE, config.TELEGRAM_GLOBAL_RATE
+        )
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._parked: dict[int, deque[QueueEntry]] = {}
+        self._release_timers: dict[int, asyncio.TimerHandle] = {}
+        # Номера сообщений, которые отправляются раньше отложенных в их чате.
+        self._resumed: set[int] = set()
+        self._paused_until = 0.0
+        self._bot: Bot | None = None
+        self._workers: list[asyncio.Task] = []
+
+    async def send(
+        self,
+        chat_id: int,
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs: Any,
+    ) -> None:
+        """Ставит сообщение в очередь и ждёт, пока оно будет отправлено."""
+        result = asyncio.get_running_loop().create_future()
+        self._put(priority, OutgoingMessage(chat_id, kwargs, time.monotonic(), result))
+        await result
+
+    def send_nowait(
+        self,
+        chat_id: int,
+        priority: Priority = Priority.NOTIFICATION,
+        **kwargs: Any,
+    ) -> None:
+        """Ставит сообщение в очередь, ошибки отправки только логируются."""
+        self._put(priority, OutgoingMessage(chat_id, kwargs, time.monotonic(), None))
+
+    def _put(
+        self, priority: int, message: OutgoingMessage, sequence: int | None = None
+    ) -> None:
+        if sequence is None:
+            sequence = next(self._sequence)
+        self._queue.put_nowait((priority, sequence, message))
+        OUTBOX_QUEUE_DEPTH.set(self._queue.qsize())
+
+    async def _work(self) -> None:
+        while True:
+            priority, sequence, message = await self._queue.get()
+            OUTBOX_QUEUE_DEPTH.set(self._queue.qsize())
+            if self._park((priority, sequence, message)):
+                # Отложенное сообщение остаётся незавершённым до возврата
+                # в очередь, чтобы stop() его дождался.
+                continue
+            try:
+                await self._deliver(message)
+            except RetryAfter as error:
+                logger.warning(f"Telegram asked to retry after {error.retry_after}s.")
+                self._paused_until = time.monotonic() + error.retry_after
+                # Номер в очереди сохраняется, сообщение уйдёт первым.
+                self._resumed.add(sequence)
+                self._queue.put_nowait((priority, sequence, message))
+            except TelegramError as error:
+                logger.warning(f"Message to chat {message.chat_id} failed: {error}")
+                self._fail(message, error)
+            except Exception as error:
+                logger.exception(f"Message to chat {message.chat_id} failed.")
+                self._fail(message, error)
+            finally:
+                self._queue.task_done()
+
+    def _park(self, entry: QueueEntry) -> bool:
+        """
+        Откладывает сообщение, если его чату пока нельзя писать или в чате
+        уже есть отложенные сообщения. Иначе забирает токен чата.
+        """
+        _, sequence, message = entry
+        chat_id = message.chat_id
+        resumed = sequence in self._resumed
+        self._resumed.discard(sequence)
+        if not resumed and chat_id in self._parked:
+            self._parked[chat_id].append(entry)
+            return True
+        bucket = self._get_chat_bucket(chat_id)
+        if bucket.delay() > 0:
+            parked = self._parked.setdefault(chat_id, deque())
+            if resumed:
+                parked.appendleft(entry)
+            else:
+                parked.append(entry)
+            self._schedule_release(chat_id)
+            return True
+        bucket.reserve()
+        if chat_id in self._parked and not self._parked[chat_id]:
+            del self._parked[chat_id]
+        self._schedule_release(chat_id)
+        return False
+
+    def _schedule_release(self, chat_id: int) -> None:
+        if not self._parked.get(chat_id) or chat_id in self._release_timers:
+            return
+        self._release_timers[chat_id] = asyncio.get_running_loop().call_later(
+            self._get_chat_bucket(chat_id).delay(), self._release, chat_id
+        )
+
+    def _release(self, chat_id: int) -> None:
+        """
+        Возвращает в очередь первое отложенное сообщение чата. Пустая очередь
+        чата остаётся, пока это сообщение не заберёт токен, чтобы новые
+        сообщения чата не обогнали его.
+        """
+        del self._release_timers[chat_id]
+        entry = self._parked[chat_id].popleft()
+        self._resumed.add(entry[1])
+        self._put(entry[0], entry[2], sequence=entry[1])
+        # Новая запись в очереди заменяет отложенную.
+        self._queue.task_done()
+
+    async def _deliver(self, message: OutgoingMessage) -> None:
+        delay = max(
+            self._global_bucket.reserve(), self._paused_until - time.monotonic()
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not self._bot:
+            raise RuntimeError("Outbox is not started.")
+        await self._bot.send_message(chat_id=message.chat_id, **message.kwargs)
+        OUTBOX_SEND_LATENCY.observe(time.monotonic() - message.queued_at)
+        if message.result and not message.result.done():
+            message.result.set_result(None)
+
+    def _fail(self, message: OutgoingMessage, error: Exception) -> None:
+        if message.result and not message.result.done():
+            message.result.set_exception(error)
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        if len(self._chat_buckets) >= CHAT_BUCKETS_PRUNE_SIZE:
+            self._chat_buckets = {
+                bucket_chat_id: bucket
+                for bucket_chat_id, bucket in self._chat_buckets.items()
+                if not bucket.is_idle()
+            }
+        if chat_id not in self._chat_buckets:
+            self._chat_buckets[chat_id] = TokenBucket(
+                config.TELEGRAM_CHAT_RATE, config.TELEGRAM_CHAT_BURST
+            )
+        return self._chat_buckets[chat_id]
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(config.OUTBOX_WORKERS)
+        ]
+
+    async def stop(self, timeout: float = config.OUTBOX_DRAIN_TIMEOUT) -> None:
+        """Дожидается отправки сообщений из очереди и останавливает отправку."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._queue.qsize()} messages were not sent on stop.")
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        for timer in self._release_timers.values():
+            timer.cancel()
+        self._release_timers = {}
+
+
+outbox = Outbox()
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Callable
+
+import metrics
+import models
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from services import billing
+from services.deadlines import DeadlineQueue
+from services.shards import UserShard, in_shard
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_BILLS_PER_SWEEP = metrics.histogram(
+    "bot_expired_bills_per_sweep",
+    "Сколько просроченных счетов удалено за одну очистку.",
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000),
+)
+
+PayedBillsCallback = Callable[[list[models.Bill]], None]
+
+
+class BillWatcher:
+    """
+    Проверка оплаты счетов и удаление просроченных.
+
+    Счёт наблюдается с момента выставления до оплаты или до истечения
+    `billing.BILL_TTL`. ЮMoney опрашивается, только пока есть наблюдаемые
+    счета, поэтому нагрузка зависит от числа открытых счетов,
+    а не от числа пользователей.
+
+    Сроки счетов хранятся в куче: после каждой проверки оплаты просроченные
+    счета удаляются одним пакетом по первичному ключу.
+
+    С `shard` наблюдаются только счета пользователей этой части.
+    """
+
+    def __init__(self, shard: UserShard | None = None) -> None:
+        self.shard = shard
+        self._expirations: DeadlineQueue[uuid.UUID] = DeadlineQueue()
+        self._wakeup = asyncio.Event()
+        self._on_payed: PayedBillsCallback | None = None
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._expirations)
+
+    def watch(self, bill_id: uuid.UUID, issued_at: datetime) -> None:
+        self._expirations.schedule(bill_id, issued_at + billing.BILL_TTL)
+        self._wakeup.set()
+
+    async def load(self) -> None:
+        """
+        Восстанавливает наблюдение за неоплаченными счетами. Счета, истёкшие
+        пока бот был остановлен, удалятся при первой проверке. Повторная
+        загрузка добавляет счета, выставленные в другом процессе.
+        """
+        async with AsyncSession(config.read_engine) as session:
+            bills = (
+                await session.exec(
+                    select(models.Bill.bill_id, models.Bill.issued_at)
+                    .where(col(models.Bill.payed_at) == None)
+                    .where(in_shard(col(models.Bill.user_id), self.shard))
+                )
+            ).all()
+        open_bill_ids = {bill_id for bill_id, _ in bills}
+        # Счета, оплаченные или удалённые другим процессом.
+        for bill_id in self._expirations:
+            if bill_id not in open_bill_ids:
+                self._expirations.cancel(bill_id)
+        for bill_id, issued_at in bills:
+            self.watch(bill_id, issued_at)
+        logger.debug(f"Bill watcher loaded {len(bills)} open bills.")
+
+    async def poll(self, now: datetime) -> list[models.Bill]:
+        """
+        Сверяет оплату наблюдаемых счетов, затем удаляет просроченные:
+        счёт, оплаченный перед самым истечением, успеет зачислиться.
+        """
+        if not self._expirations:
+            return []
+        payed_bills = await billing.reconcile_payments(self.shard)
+        self.mark_payed(payed_bills)
+        await self.sweep(now)
+        return payed_bills
+
+    async def sweep(self, now: datetime) -> int:
+        """Удаляет неоплаченные счета, срок которых истёк к `now`."""
+        expired_bill_ids = self._expirations.pop_due(now)
+        if not expired_bill_ids:
+            return 0
+        try:
+            deleted = await billing.delete_expired_bills(expired_bill_ids)
+        except Exception:
+            for bill_id in expired_bill_ids:
+                self._expirations.schedule(bill_id, now)
+            raise
+        EXPIRED_BILLS_PER_SWEEP.observe(deleted)
+        logger.info(f"{deleted} expired bills were deleted.")
+        return deleted
+
+    def mark_payed(self, payed_bills: list[models.Bill]) -> None:
+        """Снимает оплаченные счета с наблюдения и сообщает об оплате."""
+        for bill in payed_bills:
+            self._expirations.cancel(bill.bill_id)
+        if payed_bills and self._on_payed:
+            self._on_payed(payed_bills)
+
+    async def run(self) -> None:
+        while True:
+            if not self._expirations:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(config.BILL_POLL_INTERVAL)
+            try:
+                await self.poll(datetime.now())
+            except Exception:
+                logger.exception("Payments check failed.")
+
+    def on_payed(self, callback: PayedBillsCallback) -> None:
+        """Чем сообщать об оплаченных счетах."""
+        self._on_payed = callback
+
+    async def start(self, on_payed: PayedBillsCallback) -> None:
+        self.on_payed(on_payed)
+        await self.load()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+watcher = BillWatcher()
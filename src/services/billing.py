@@ -1,116 +1,442 @@
 import logging
+import time
+import uuid
 from datetime import datetime, timedelta
+from typing import NamedTuple
 
+import metrics
 import models
-from sqlalchemy import func
+from sqlalchemy import and_, func, literal, true, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlmodel import col, delete, or_, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 import config
 from services import yoomoney
+from services.shards import UserShard, in_shard
 
 logger = logging.getLogger(__name__)
 
+# Запас на расхождение часовых поясов между ботом и ЮMoney.
+RECONCILE_LOOKBACK = timedelta(days=1)
+BILLING_PERIOD = timedelta(days=31)
+BILL_TTL = timedelta(seconds=config.BILL_TTL)
+# Сколько счетов удалять одним запросом, с запасом до лимита параметров SQLite.
+EXPIRED_BILLS_BATCH_SIZE = 500
 
+
+class BalanceDrift(NamedTuple):
+    user_id: int
+    snapshot: int | None
+    ledger: int
+
+
+class WithdrawalReport(NamedTuple):
+    charged_keys: int
+    elapsed: float
+    charged_key_ids: list[int]
+    charged_at: datetime
+
+
+@metrics.service
 async def add_money_to_balance(
     user_id: int, ammount: int, session: AsyncSession
 ) -> None:
+    """
+    Добавляет операцию в журнал и в той же транзакции обновляет
+    текущий баланс пользователя.
+    """
     session.add(models.Balance(user_id=user_id, sum=ammount))
+    await session.flush()
+    # Если снимка ещё нет, он считается по журналу, уже включая эту операцию.
+    ledger_sum = (
+        select(func.coalesce(func.sum(models.Balance.sum), 0))
+        .where(models.Balance.user_id == user_id)
+        .scalar_subquery()
+    )
+    await session.exec(
+        insert(models.UserBalance)  # type: ignore
+        .values(user_id=user_id, sum=ledger_sum)
+        .on_conflict_do_update(
+            index_elements=[col(models.UserBalance.user_id)],
+            set_={"sum": models.UserBalance.sum + ammount},
+        )
+    )
+
 
+@metrics.service
+async def withdraw_from_balance(
+    user_id: int, ammount: int, session: AsyncSession
+) -> bool:
+    """
+    Списывает `ammount` с баланса в транзакции `session`, только если
+    на балансе хватает денег. Возвращает False, если не хватает.
+
+    Проверка и списание делаются одним UPDATE снимка баланса, поэтому
+    одновременные покупки не уведут баланс в минус.
+    """
+    ledger_sum = (
+        select(func.coalesce(func.sum(models.Balance.sum), 0))
+        .where(models.Balance.user_id == user_id)
+        .scalar_subquery()
+    )
+    await session.exec(
+        insert(models.UserBalance)  # type: ignore
+        .values(user_id=user_id, sum=ledger_sum)
+        .on_conflict_do_nothing()
+    )
+    withdrawn = (
+        await session.exec(
+            update(models.UserBalance)  # type: ignore
+            .where(col(models.UserBalance.user_id) == user_id)
+            .where(col(models.UserBalance.sum) >= ammount)
+            .values(sum=models.UserBalance.sum - ammount)
+            .returning(models.UserBalance.user_id)
+        )
+    ).first()
+    if withdrawn is None:
+        return False
+    session.add(models.Balance(user_id=user_id, sum=-ammount))
+    await session.flush()
+    return True
 
+
+def next_payment_at(last_payed_at: datetime | None) -> datetime:
+    """Когда наступает срок следующего списания за ключ."""
+    if last_payed_at is None:
+        return datetime.now()
+    return last_payed_at + BILLING_PERIOD
+
+
+def _is_key_due(now: datetime):
+    return or_(
+        col(models.UserKey.last_payed_at) <= now - BILLING_PERIOD,
+        col(models.UserKey.last_payed_at) == None,
+    )
+
+
+def keys_to_withdraw_query(now: datetime):
+    return select(models.UserKey).where(_is_key_due(now))
+
+
+@metrics.service
 async def list_keys_to_withdraw() -> list[models.UserKey]:
-    async with AsyncSession(config.engine) as session:
+    async with AsyncSession(config.read_engine) as session:
         return list(
-            (
-                await session.exec(
-                    select(models.UserKey).where(
-                        or_(
-                            models.UserKey.last_payed_at  # type: ignore
-                            < datetime.now() - timedelta(days=31),
-                            models.UserKey.last_payed_at == None,
-                        )
-                    )
-                )
-            )
-            .unique()
-            .all()
+            (await session.exec(keys_to_withdraw_query(datetime.now()))).unique().all()
         )
 
 
-async def withdraw_monthly_fee():
-    async with AsyncSession(config.engine) as session:
-        for key in await list_keys_to_withdraw():
-            await add_money_to_balance(
-                key.telegram_id,
-                ammount=-config.MONTHLY_FEE,
-                session=session,
-            )
-            key.last_payed_at = datetime.now()
-            logging.info(f"User={key.telegram_id} balance was withdrawn.")
-            session.add(key)
-            await session.commit()
-
+@metrics.service
+async def withdraw_monthly_fee(shard: UserShard | None = None) -> WithdrawalReport:
+    """
+    Списывает абонентскую плату за все ключи, срок оплаты которых наступил,
+    или только за ключи пользователей из части `shard`.
 
-async def list_unpayed_bills(user_id: int) -> list[models.Bill]:
+    Списание делается несколькими INSERT ... SELECT и UPDATE в одной
+    транзакции. Вместе со списанием ключу ставится новая дата оплаты,
+    поэтому повторный запуск в том же периоде ничего не списывает.
+    """
+    started = time.monotonic()
+    charged_at = datetime.now()
+    is_due = and_(
+        _is_key_due(charged_at), in_shard(col(models.UserKey.telegram_id), shard)
+    )
+    due_keys_count = (
+        select(func.count())
+        .select_from(models.UserKey)
+        .where(is_due)
+        .where(col(models.UserKey.telegram_id) == col(models.UserBalance.user_id))
+        .scalar_subquery()
+    )
     async with AsyncSession(config.engine) as session:
-        return list(
+        # Снимок баланса заводится до списания, чтобы посчитать его по журналу.
+        await session.exec(
+            insert(models.UserBalance)  # type: ignore
+            .from_select(
+                ["user_id", "sum"],
+                select(
+                    models.UserKey.telegram_id,
+                    select(func.coalesce(func.sum(models.Balance.sum), 0))
+                    .where(col(models.Balance.user_id) == models.UserKey.telegram_id)
+                    .scalar_subquery(),
+                )
+                .where(is_due)
+                .distinct(),
+            )
+            .on_conflict_do_nothing()
+        )
+        await session.exec(
+            insert(models.Balance).from_select(  # type: ignore
+                ["user_id", "sum"],
+                select(
+                    models.UserKey.telegram_id, literal(-config.MONTHLY_FEE)
+                ).where(is_due),
+            )
+        )
+        await session.exec(
+            update(models.UserBalance)  # type: ignore
+            .where(
+                col(models.UserBalance.user_id).in_(
+                    select(models.UserKey.telegram_id).where(is_due)
+                )
+            )
+            .values(sum=models.UserBalance.sum - config.MONTHLY_FEE * due_keys_count)
+        )
+        charged_key_ids = list(
             (
                 await session.exec(
-                    select(models.Bill)
-                    .where(
-                        models.Bill.user_id == user_id,
-                    )
-                    .where(
-                        models.Bill.payed_at == None,
-                    )
+                    update(models.UserKey)  # type: ignore
+                    .where(is_due)
+                    .values(last_payed_at=charged_at)
+                    .returning(models.UserKey.id)
                 )
-            ).all()
+            ).scalars()
         )
+        await session.commit()
+    report = WithdrawalReport(
+        charged_keys=len(charged_key_ids),
+        elapsed=time.monotonic() - started,
+        charged_key_ids=charged_key_ids,
+        charged_at=charged_at,
+    )
+    if report.charged_keys:
+        logger.info(
+            f"Monthly fee was withdrawn for {report.charged_keys} keys "
+            f"in {report.elapsed:.3f}s."
+        )
+    return report
+
+
+def unpayed_bills_query(user_id: int):
+    return (
+        select(models.Bill)
+        .where(models.Bill.user_id == user_id)
+        .where(col(models.Bill.payed_at) == None)
+    )
+
+
+@metrics.service
+async def list_unpayed_bills(user_id: int) -> list[models.Bill]:
+    async with AsyncSession(config.read_engine) as session:
+        return list((await session.exec(unpayed_bills_query(user_id))).all())
+
+
+def open_bills_query(shard: UserShard | None = None):
+    return (
+        select(models.Bill)
+        .where(col(models.Bill.payed_at) == None)
+        .where(in_shard(col(models.Bill.user_id), shard))
+    )
 
 
-async def check_payment_status_for_bills(user_id: int) -> list[models.Bill]:
+@metrics.service
+async def reconcile_payments(shard: UserShard | None = None) -> list[models.Bill]:
     """
-    Проверяет статус оплаты выписанных счетов.
+    Сверяет открытые счета (все или только пользователей из части `shard`)
+    с историей поступлений ЮMoney.
 
-    Возвращает идентификаторы UUID оплаченных счетов.
+    История запрашивается одним проходом для всех пользователей, оплаченные
+    счета зачисляются на баланс в одной транзакции.
+    Возвращает оплаченные счета.
     """
-    payed_bills = []
-    async with AsyncSession(config.engine) as session:
-        for bill in await list_unpayed_bills(user_id):
-            is_payed = await yoomoney.check_if_payment_done(bill.bill_id)
-            if is_payed:
-                bill.payed_at = datetime.now()
-                session.add(bill)
-                await add_money_to_balance(user_id, bill.sum, session)
-                await session.commit()
-                await session.refresh(bill)
-                payed_bills.append(bill)
-                logger.debug(f"Bill {bill.bill_id} is PAYED")
-                continue
-            logger.debug(f"Bill {bill.bill_id} is NOT payed")
-    return payed_bills
-
-
-async def delete_stale_bills() -> None:
-    async with AsyncSession(config.engine) as session:
-        delete_statement = (
-            delete(models.Bill)
-            .where(col(models.Bill.issued_at) < datetime.now() - timedelta(minutes=10))
-            .where(col(models.Bill.payed_at) == None)
+    async with AsyncSession(config.read_engine) as session:
+        open_bills = {
+            str(bill.bill_id): bill
+            for bill in (await session.exec(open_bills_query(shard))).all()
+        }
+    if not open_bills:
+        return []
+    since = min(bill.issued_at for bill in open_bills.values())
+    payed = await yoomoney.list_payed_labels(since=since - RECONCILE_LOOKBACK)
+    matched_bill_ids = []
+    for label in payed.keys() & open_bills.keys():
+        bill = open_bills[label]
+        if bill.sum <= covered_bill_sum(payed[label]):
+            matched_bill_ids.append(bill.bill_id)
+        else:
+            logger.warning(f"Bill {bill.bill_id} is underpaid: {payed[label]}.")
+    if not matched_bill_ids:
+        return []
+    return await credit_bills(matched_bill_ids)
+
+
+def covered_bill_sum(payed_amount: float) -> float:
+    """
+    Наибольшая сумма счёта, которую покрывает поступление `payed_amount`.
+    ЮMoney сообщает поступление за вычетом комиссии, и в уведомлении,
+    и в истории операций, поэтому комиссия до `YOOMONEY_MAX_COMMISSION`
+    недоплатой не считается.
+    """
+    return payed_amount / (1 - config.YOOMONEY_MAX_COMMISSION)
+
+
+@metrics.service
+async def credit_bills(
+    bill_ids: list[uuid.UUID], payed_amount: float | None = None
+) -> list[models.Bill]:
+    """
+    Отмечает счета оплаченными и зачисляет их суммы на баланс.
+    Если передано поступление `payed_amount`, зачисляются только счета,
+    которые оно покрывает (см. `covered_bill_sum`).
+
+    Уже оплаченные счета пропускаются, поэтому об одной оплате можно узнать
+    и из уведомления, и из истории операций: деньги зачислятся один раз.
+    Возвращает счета, оплаченные этим вызовом.
+    """
+    payed_at = datetime.now()
+    statement = (
+        update(models.Bill)
+        .where(col(models.Bill.bill_id).in_(bill_ids))
+        .where(col(models.Bill.payed_at) == None)
+    )
+    if payed_amount is not None:
+        statement = statement.where(
+            col(models.Bill.sum) <= covered_bill_sum(payed_amount)
         )
-        await session.exec(delete_statement)  # type: ignore
+    async with AsyncSession(config.engine, expire_on_commit=False) as session:
+        payed_bills = (
+            await session.exec(
+                statement.values(payed_at=payed_at).returning(  # type: ignore
+                    models.Bill
+                )
+            )
+        ).scalars().all()
+        for bill in payed_bills:
+            await add_money_to_balance(bill.user_id, bill.sum, session)
+            logger.debug(f"Bill {bill.bill_id} is PAYED")
         await session.commit()
+    return list(payed_bills)
 
 
-async def check_balance(user_id: int) -> int:
+def expired_bills_statement(bill_ids: list[uuid.UUID]):
+    return (
+        delete(models.Bill)
+        .where(col(models.Bill.bill_id).in_(bill_ids))
+        .where(col(models.Bill.payed_at) == None)
+    )
+
+
+@metrics.service
+async def delete_expired_bills(bill_ids: list[uuid.UUID]) -> int:
     """
-    Получить сумму всех операций для user_id.
+    Удаляет неоплаченные счета из `bill_ids` пачками по первичному ключу
+    в одной транзакции. Возвращает число удалённых счетов.
     """
+    deleted = 0
     async with AsyncSession(config.engine) as session:
-        return (
+        for start in range(0, len(bill_ids), EXPIRED_BILLS_BATCH_SIZE):
+            result = await session.exec(
+                expired_bills_statement(  # type: ignore
+                    bill_ids[start : start + EXPIRED_BILLS_BATCH_SIZE]
+                )
+            )
+            deleted += result.rowcount
+        await session.commit()
+    return deleted
+
+
+def balance_snapshot_query(user_id: int):
+    return select(models.UserBalance).where(models.UserBalance.user_id == user_id)
+
+
+def ledger_sum_query(user_id: int):
+    return select(func.sum(models.Balance.sum)).where(
+        models.Balance.user_id == user_id
+    )
+
+
+@metrics.service
+async def check_balance(user_id: int) -> int:
+    """
+    Получить текущий баланс user_id.
+
+    Для пользователей без снимка баланса считается сумма всех операций.
+    """
+    async with AsyncSession(config.read_engine) as session:
+        snapshot = (await session.exec(balance_snapshot_query(user_id))).first()
+        if snapshot:
+            return snapshot.sum
+        return (await session.exec(ledger_sum_query(user_id))).one_or_none() or 0
+
+
+def _ledger_sums():
+    return (
+        select(
+            models.Balance.user_id,
+            func.sum(models.Balance.sum).label("ledger"),
+        )
+        .group_by(models.Balance.user_id)
+        .subquery()
+    )
+
+
+@metrics.service
+async def find_balance_drift() -> list[BalanceDrift]:
+    """
+    Пересчитывает балансы по журналу операций и возвращает пользователей,
+    у которых снимок баланса расходится с журналом.
+    """
+    ledger = _ledger_sums()
+    async with AsyncSession(config.read_engine) as session:
+        drifted_ledger = (
             await session.exec(
-                select(func.sum(models.Balance.sum)).where(
-                    models.Balance.user_id == user_id
+                select(ledger.c.user_id, models.UserBalance.sum, ledger.c.ledger)
+                .join(
+                    models.UserBalance,
+                    models.UserBalance.user_id == ledger.c.user_id,  # type: ignore
+                    isouter=True,
                 )
+                .where(
+                    or_(
+                        col(models.UserBalance.sum) == None,
+                        col(models.UserBalance.sum) != ledger.c.ledger,
+                    )
+                )
+            )
+        ).all()
+        snapshots_without_ledger = (
+            await session.exec(
+                select(models.UserBalance.user_id, models.UserBalance.sum)
+                .where(col(models.UserBalance.sum) != 0)
+                .where(col(models.UserBalance.user_id).not_in(select(ledger.c.user_id)))
             )
-        ).one_or_none() or 0
+        ).all()
+    return [
+        BalanceDrift(user_id, snapshot, ledger_sum)
+        for user_id, snapshot, ledger_sum in drifted_ledger
+    ] + [
+        BalanceDrift(user_id, snapshot, 0)
+        for user_id, snapshot in snapshots_without_ledger
+    ]
+
+
+@metrics.service
+async def rebuild_balance_snapshots() -> None:
+    """Заново считает все снимки балансов по журналу операций."""
+    ledger = _ledger_sums()
+    async with AsyncSession(config.engine) as session:
+        await session.exec(delete(models.UserBalance))  # type: ignore
+        await session.exec(
+            insert(models.UserBalance).from_select(  # type: ignore
+                ["user_id", "sum"], select(ledger.c.user_id, ledger.c.ledger)
+            )
+        )
+        await session.commit()
+
+
+@metrics.service
+async def backfill_balance_snapshots() -> None:
+    """Создаёт снимки балансов пользователям, у которых их ещё нет."""
+    ledger = _ledger_sums()
+    async with AsyncSession(config.engine) as session:
+        await session.exec(
+            insert(models.UserBalance)  # type: ignore
+            .from_select(
+                ["user_id", "sum"],
+                # WHERE нужен SQLite для разбора INSERT ... SELECT ... ON CONFLICT.
+                select(ledger.c.user_id, ledger.c.ledger).where(true()),
+            )
+            .on_conflict_do_nothing()
+        )
+        await session.commit()
@@ -0,0 +1,188 @@
+import time
+
+import models
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import col, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+
+# Имя версии каталога в таблице cache_version.
+CATALOGUE_VERSION_NAME = "servers"
+
+
+class ServerNotAvailableError(Exception):
+    """Сервер не найден или отключён."""
+
+
+class ServerFullError(ServerNotAvailableError):
+    """На сервере выдано `capacity` ключей."""
+
+
+class ServerCatalogue:
+    """
+    Кеш активных серверов.
+
+    Функции этого модуля меняют версию каталога в БД, и процесс бота
+    перечитывает серверы не позже чем через `SERVER_CATALOGUE_CHECK_INTERVAL`
+    секунд, даже если их изменили из `manage.py`. Изменения, сделанные
+    напрямую в БД, подхватываются через `SERVER_CATALOGUE_TTL` секунд.
+    Заполненные серверы в список для выбора не попадают.
+    """
+
+    def __init__(self) -> None:
+        self._servers: dict[int, models.Server] = {}
+        self._loaded_at: float | None = None
+        self._checked_at = 0.0
+        self._stored_version: int | None = None
+        # Растёт при каждой перезагрузке, по нему сбрасываются зависимые кеши.
+        self.version = 0
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    async def servers(self, include_full: bool = False) -> list[models.Server]:
+        """Активные серверы, на которых ещё можно выдать ключ."""
+        await self._refresh()
+        return [
+            server
+            for server in self._servers.values()
+            if include_full or not server.is_full
+        ]
+
+    async def get(self, server_id: int) -> models.Server:
+        await self._refresh()
+        try:
+            server = self._servers[server_id]
+        except KeyError:
+            raise ServerNotAvailableError(server_id) from None
+        if server.is_full:
+            raise ServerFullError(server_id)
+        return server
+
+    async def least_loaded(self) -> models.Server:
+        """
+        Сервер с наименьшей долей выданных ключей. Для серверов без
+        `capacity` доля считается от `SERVER_DEFAULT_CAPACITY`.
+        """
+        servers = await self.servers()
+        if not servers:
+            raise ServerNotAvailableError
+        return min(
+            servers,
+            key=lambda server: server.key_count
+            / (server.capacity or config.SERVER_DEFAULT_CAPACITY),
+        )
+
+    def record_key_issued(self, server_id: int) -> None:
+        """Учитывает выданный ключ, не перечитывая серверы из БД."""
+        server = self._servers.get(server_id)
+        if not server:
+            return
+        server.key_count += 1
+        if server.is_full:
+            self.version += 1
+
+    async def _refresh(self) -> None:
+        now = time.monotonic()
+        if (
+            self._loaded_at is not None
+            and now - self._loaded_at < config.SERVER_CATALOGUE_TTL
+        ):
+            if now - self._checked_at < config.SERVER_CATALOGUE_CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            async with AsyncSession(config.read_engine) as session:
+                if await _stored_version(session) == self._stored_version:
+                    return
+        async with AsyncSession(config.read_engine, expire_on_commit=False) as session:
+            self._stored_version = await _stored_version(session)
+            servers = (await session.exec(active_servers_query())).all()
+        self._servers = {server.id: server for server in servers}  # type: ignore
+        self._loaded_at = self._checked_at = time.monotonic()
+        self.version += 1
+
+
+catalogue = ServerCatalogue()
+
+
+async def _stored_version(session: AsyncSession) -> int | None:
+    stored = await session.get(models.CacheVersion, CATALOGUE_VERSION_NAME)
+    return stored.version if stored else None
+
+
+async def _bump_stored_version(session: AsyncSession) -> None:
+    """Сообщает процессам бота, что серверы изменились."""
+    await session.exec(
+        insert(models.CacheVersion)  # type: ignore
+        .values(name=CATALOGUE_VERSION_NAME, version=1)
+        .on_conflict_do_update(
+            index_elements=[col(models.CacheVersion.name)],
+            set_={"version": models.CacheVersion.version + 1},
+        )
+    )
+
+
+def active_servers_query():
+    return (
+        select(models.Server)
+        .filter(col(models.Server.is_active))
+        .order_by(col(models.Server.id))
+    )
+
+
+async def reserve_key_slot(server_id: int, session: AsyncSession) -> None:
+    """
+    Увеличивает счётчик ключей сервера в транзакции выдачи ключа.
+
+    Если сервер заполнился, пока ключ создавался, бросает `ServerFullError`.
+    """
+    reserved = (
+        await session.exec(
+            update(models.Server)  # type: ignore
+            .where(col(models.Server.id) == server_id)
+            .where(
+                or_(
+                    col(models.Server.capacity) == None,
+                    col(models.Server.key_count) < col(models.Server.capacity),
+                )
+            )
+            .values(key_count=models.Server.key_count + 1)
+            .returning(models.Server.id)
+        )
+    ).first()
+    if not reserved:
+        raise ServerFullError(server_id)
+
+
+async def add_server(
+    country_code: str, ip_address: str, api_url: str, capacity: int | None = None
+) -> models.Server:
+    server = models.Server(
+        country_code=country_code,
+        ip_address=ip_address,
+        api_url=api_url,
+        capacity=capacity,
+    )
+    async with AsyncSession(config.engine, expire_on_commit=False) as session:
+        session.add(server)
+        await _bump_stored_version(session)
+        await session.commit()
+    catalogue.invalidate()
+    return server
+
+
+async def update_server(server_id: int, **fields) -> models.Server:
+    """Меняет поля сервера `server_id`, например `is_active` или `capacity`."""
+    async with AsyncSession(config.engine, expire_on_commit=False) as session:
+        server = await session.get(models.Server, server_id)
+        if not server:
+            raise ServerNotAvailableError(server_id)
+        for field, value in fields.items():
+            setattr(server, field, value)
+        session.add(server)
+        await _bump_stored_version(session)
+        await session.commit()
+    catalogue.invalidate()
+    return server
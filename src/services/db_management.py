@@ -2,14 +2,17 @@ import logging
 from datetime import datetime
 from typing import NamedTuple, Sequence
 
+import metrics
 import models
 from sqlalchemy import exc
 from sqlmodel import SQLModel, col, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 import config
-from services import outline
-from services.billing import add_money_to_balance, check_balance
+from services import fee_scheduler, key_inventory, key_pool, outline
+from services.billing import check_balance, withdraw_from_balance
+from services.catalogue import ServerFullError, catalogue, reserve_key_slot
+from services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,7 @@ class NotEnoughMoneyOnBalanceError(Exception):
     """Недостаточно денег на счету."""
 
 
+@metrics.service
 async def user_get_or_create(
     telegram_user_id: int,
     telegram_username: str,
@@ -41,6 +45,9 @@ async def user_get_or_create(
             telegram_id=telegram_user_id,
             telegram_name=telegram_username,
             telegram_fullname=telegram_user_fullname,
+            # Коллекция нового пользователя считается загруженной,
+            # иначе выданный ключ не прочитать после закрытия сессии.
+            keys=[],
         )
         session.add(user)
     return user
@@ -51,36 +58,65 @@ class ServiceResult(NamedTuple):
     is_created: bool
 
 
-async def _get_server_by_id(server_id: int, session: AsyncSession) -> models.Server:
+# Покупки ключей по (telegram_user_id, server_id), None — автовыбор сервера.
+key_purchases: SingleFlight[tuple[int, int | None], ServiceResult] = SingleFlight(
+    window=config.KEY_PURCHASE_DEDUP_WINDOW
+)
+
+
+def user_keys_query(user: models.BotUser, server_id: int):
     return (
-        await session.exec(
-            select(models.Server).filter(col(models.Server.id) == server_id)
-        )
-    ).one()
+        select(models.UserKey)
+        .where(col(models.UserKey.user) == user)
+        .where(models.UserKey.server_id == server_id)
+    )
 
 
+@metrics.service
 async def _check_if_user_has_key(
     user: models.BotUser, server_id: int, session: AsyncSession
 ) -> list[models.UserKey]:
     return list(
-        (
-            await session.exec(
-                select(models.UserKey)
-                .where(col(models.UserKey.user) == user)
-                .where(models.UserKey.server_id == server_id)
-            )
-        )
+        (await session.exec(user_keys_query(user, server_id)))
         .unique()
         .fetchall()
     )
 
 
+@metrics.service
 async def add_new_key(
     telegram_user_id: int,
     telegram_user_name: str,
     telegram_user_fullname: str,
-    server_id: int,
+    server_id: int | None,
 ) -> ServiceResult:
+    """
+    Выдаёт пользователю ключ на сервере `server_id`,
+    если сервер не указан — на наименее загруженном.
+
+    Повторное нажатие на ту же кнопку не покупает второй ключ: одновременные
+    и повторные в течение `KEY_PURCHASE_DEDUP_WINDOW` вызовы получают
+    результат первого.
+    """
+    return await key_purchases.run(
+        (telegram_user_id, server_id),
+        lambda: _add_new_key(
+            telegram_user_id, telegram_user_name, telegram_user_fullname, server_id
+        ),
+    )
+
+
+async def _add_new_key(
+    telegram_user_id: int,
+    telegram_user_name: str,
+    telegram_user_fullname: str,
+    server_id: int | None,
+) -> ServiceResult:
+    if server_id is None:
+        server = await catalogue.least_loaded()
+    else:
+        server = await catalogue.get(server_id)
+
     async with AsyncSession(config.engine, expire_on_commit=False) as session:
         user = await user_get_or_create(
             telegram_user_id=telegram_user_id,
@@ -89,29 +125,80 @@ async def add_new_key(
             session=session,
         )
         user_keys = await _check_if_user_has_key(
-            user=user, server_id=server_id, session=session
+            user=user, server_id=server.id, session=session  # type: ignore
         )
         if user_keys:
             return ServiceResult(user, False)
         current_balance = await check_balance(user_id=telegram_user_id)
-        if current_balance >= config.MONTHLY_FEE:
-            await add_money_to_balance(
-                telegram_user_id, ammount=-config.MONTHLY_FEE, session=session
-            )
-        else:
+        if current_balance < config.MONTHLY_FEE:
             raise NotEnoughMoneyOnBalanceError
-        server = await _get_server_by_id(server_id, session=session)
-        key = outline.create_key(server=server, key_name=telegram_user_name)
-        user = await _add_new_key_to_db(
-            user=user,
-            key_body=key,
-            session=session,
-            server=server,
-        )
         await session.commit()
+
+    # Если выдать ключ не удалось, откат транзакции возвращает ключ в пул.
+    async with AsyncSession(config.engine, expire_on_commit=False) as session:
+        pooled_key = await key_pool.claim_key(server.id, session=session)  # type: ignore
+        if pooled_key:
+            user = await _issue_key(user, pooled_key.access_url, server, session)
+    if pooled_key:
+        await key_pool.assign_key(
+            pooled_key, key_name=telegram_user_name, server=server
+        )
         return ServiceResult(user, True)
 
+    # Пул ключей сервера пуст: создаём ключ на сервере Outline,
+    # запрос выполняется вне транзакции к БД.
+    key = await key_inventory.create_key(server=server, key_name=telegram_user_name)
 
+    try:
+        async with AsyncSession(config.engine, expire_on_commit=False) as session:
+            user = await _issue_key(user, key.access_url, server, session)
+    except (ServerFullError, NotEnoughMoneyOnBalanceError):
+        await _discard_key(key, server)
+        raise
+    return ServiceResult(user, True)
+
+
+async def _discard_key(key: outline.OutlineKey, server: models.Server) -> None:
+    """Удаляет ключ, созданный для покупки, которая не состоялась."""
+    logger.warning(
+        f"Key {key.key_id} was not issued, deleting it on server={server.id}."
+    )
+    try:
+        await key_inventory.delete_key(key.key_id, server=server)
+    except outline.OutlineError:
+        logger.warning(f"Failed to delete key {key.key_id} on server={server.id}.")
+
+
+@metrics.service
+async def _issue_key(
+    user: models.BotUser,
+    key_body: str,
+    server: models.Server,
+    session: AsyncSession,
+) -> models.BotUser:
+    """
+    Списывает плату и записывает ключ в транзакции `session`.
+
+    Баланс проверяется ещё раз при списании: пока создавался ключ,
+    деньги могла списать другая покупка.
+    """
+    await reserve_key_slot(server.id, session=session)  # type: ignore
+    if not await withdraw_from_balance(
+        user.telegram_id, ammount=config.MONTHLY_FEE, session=session
+    ):
+        raise NotEnoughMoneyOnBalanceError
+    user = await _add_new_key_to_db(
+        user=user,
+        key_body=key_body,
+        session=session,
+        server=server,
+    )
+    await session.commit()
+    catalogue.record_key_issued(server.id)  # type: ignore
+    return user
+
+
+@metrics.service
 async def _add_new_key_to_db(
     user: models.BotUser,
     key_body: str,
@@ -122,27 +209,29 @@ async def _add_new_key_to_db(
         key_body=key_body,
         user=user,
         key_name=user.telegram_name,
-        server=server,
+        # Сервер из каталога разделяется между запросами
+        # и не привязывается к сессии.
+        server_id=server.id,
         last_payed_at=datetime.now(),
     )
     session.add(key)
     await session.commit()
+    # С воркерами новый ключ они подхватят сами при перечитывании ключей.
+    if config.jobs_run_in_bot():
+        fee_scheduler.scheduler.schedule_key(key.id, key.last_payed_at)  # type: ignore
 
     return user
 
 
+@metrics.service
 async def get_available_servers() -> Sequence[models.Server]:
     """Получить список доступных серверов."""
-    async with AsyncSession(config.engine, expire_on_commit=False) as session:
-        return (
-            await session.exec(
-                select(models.Server).filter(col(models.Server.is_active))
-            )
-        ).fetchall()
+    return await catalogue.servers()
 
 
+@metrics.service
 async def list_all_user_chats() -> list[models.BotUser]:
-    async with AsyncSession(config.engine) as session:
+    async with AsyncSession(config.read_engine) as session:
         chats = (await session.exec(select(models.BotUser))).unique().all()
     return list(chats)
 
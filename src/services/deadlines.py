@@ -0,0 +1,56 @@
+import heapq
+from datetime import datetime
+from typing import Generic, Hashable, Iterator, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class DeadlineQueue(Generic[K]):
+    """
+    Очередь сроков на min-heap: у каждого ключа один актуальный срок.
+
+    При переназначении или отмене старая запись остаётся в куче
+    и отбрасывается, когда доходит до её вершины.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[datetime, K]] = []
+        self._deadlines: dict[K, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(list(self._deadlines))
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: K, deadline: datetime) -> None:
+        if self._deadlines.get(key) == deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+
+    def cancel(self, key: K) -> None:
+        self._deadlines.pop(key, None)
+
+    def next_deadline(self) -> datetime | None:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> list[K]:
+        """Снимает с очереди все ключи со сроком не позже `now`."""
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append(key)
+        return due
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            deadline, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import models
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from services import billing
+from services.deadlines import DeadlineQueue
+from services.shards import UserShard, in_shard
+
+logger = logging.getLogger(__name__)
+
+# Через сколько повторить списание, если оно завершилось ошибкой.
+RETRY_DELAY = timedelta(minutes=1)
+# Сколько ключей перечитывать одним запросом.
+RELOAD_BATCH_SIZE = 500
+
+
+class FeeScheduler:
+    """
+    Планировщик ежемесячных списаний.
+
+    Хранит срок следующего списания для каждого ключа и спит до ближайшего
+    из них, а не опрашивает БД по таймеру. С `shard` списывает плату только
+    с пользователей этой части.
+    """
+
+    def __init__(self, shard: UserShard | None = None) -> None:
+        self.shard = shard
+        self._deadlines: DeadlineQueue[int] = DeadlineQueue()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def schedule_key(self, key_id: int, last_payed_at: datetime | None) -> None:
+        """Ставит (или переносит) срок списания за ключ `key_id`."""
+        deadline = billing.next_payment_at(last_payed_at)
+        next_deadline = self._deadlines.next_deadline()
+        self._deadlines.schedule(key_id, deadline)
+        if next_deadline is None or deadline < next_deadline:
+            self._wakeup.set()
+
+    async def load(self) -> None:
+        async with AsyncSession(config.read_engine) as session:
+            keys = (
+                await session.exec(
+                    select(models.UserKey.id, models.UserKey.last_payed_at).where(
+                        in_shard(col(models.UserKey.telegram_id), self.shard)
+                    )
+                )
+            ).all()
+        for key_id, last_payed_at in keys:
+            self.schedule_key(key_id, last_payed_at)  # type: ignore
+        logger.info(f"Fee scheduler loaded {len(keys)} keys.")
+
+    async def reload_keys(self, key_ids: list[int]) -> None:
+        """
+        Ставит сроки ключам `key_ids` по их дате оплаты в БД.
+        Удалённые ключи снимаются с планирования.
+        """
+        for key_id in key_ids:
+            self._deadlines.cancel(key_id)
+        async with AsyncSession(config.read_engine) as session:
+            for start in range(0, len(key_ids), RELOAD_BATCH_SIZE):
+                keys = (
+                    await session.exec(
+                        select(models.UserKey.id, models.UserKey.last_payed_at).where(
+                            col(models.UserKey.id).in_(
+                                key_ids[start : start + RELOAD_BATCH_SIZE]
+                            )
+                        )
+                    )
+                ).all()
+                for loaded_key_id, last_payed_at in keys:
+                    self.schedule_key(loaded_key_id, last_payed_at)  # type: ignore
+
+    async def charge_due(self, now: datetime) -> billing.WithdrawalReport | None:
+        """Списывает плату, если срок хотя бы одного ключа наступил."""
+        due_key_ids = self._deadlines.pop_due(now)
+        if not due_key_ids:
+            return None
+        try:
+            report = await billing.withdraw_monthly_fee(self.shard)
+        except Exception:
+            logger.exception("Monthly fee withdrawal failed.")
+            for key_id in due_key_ids:
+                self._deadlines.schedule(key_id, now + RETRY_DELAY)
+            return None
+        for key_id in report.charged_key_ids:
+            self.schedule_key(key_id, report.charged_at)
+        # Ключи, за которые уже списал другой процесс, получают срок по БД.
+        not_charged_key_ids = list(set(due_key_ids) - set(report.charged_key_ids))
+        if not not_charged_key_ids:
+            return report
+        try:
+            await self.reload_keys(not_charged_key_ids)
+        except Exception:
+            logger.exception("Failed to reload keys after the withdrawal.")
+            for key_id in not_charged_key_ids:
+                self._deadlines.schedule(key_id, now + RETRY_DELAY)
+        return report
+
+    async def run(self) -> None:
+        while True:
+            next_deadline = self._deadlines.next_deadline()
+            timeout = None
+            if next_deadline is not None:
+                timeout = max((next_deadline - datetime.now()).total_seconds(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.charge_due(datetime.now())
+
+    async def start(self) -> None:
+        await self.load()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+scheduler = FeeScheduler()
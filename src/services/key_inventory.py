@@ -0,0 +1,240 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+import models
+from sqlalchemy import exists, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from services import outline
+from services.catalogue import catalogue
+
+logger = logging.getLogger(__name__)
+
+
+class SyncResult(NamedTuple):
+    server_id: int
+    added: int
+    updated: int
+    removed: int
+
+
+class InventoryReport(NamedTuple):
+    synced: list[SyncResult]
+    failed_server_ids: list[int]
+    # Ключи на серверах, которые не выданы пользователям и не лежат в пуле.
+    orphaned: list[models.InventoryKey]
+    # Выданные пользователям ключи, которых нет на серверах.
+    missing: list[models.UserKey]
+
+
+async def record_keys(
+    server_id: int, keys: Iterable[outline.OutlineKey], session: AsyncSession
+) -> None:
+    """Добавляет или обновляет ключи сервера в инвентаре в транзакции `session`."""
+    values = [
+        {
+            "server_id": server_id,
+            "outline_key_id": key.key_id,
+            "name": key.name,
+            "access_url": key.access_url,
+            "synced_at": datetime.now(),
+        }
+        for key in keys
+    ]
+    if not values:
+        return
+    statement = insert(models.InventoryKey).values(values)
+    await session.exec(
+        statement.on_conflict_do_update(  # type: ignore
+            index_elements=[
+                col(models.InventoryKey.server_id),
+                col(models.InventoryKey.outline_key_id),
+            ],
+            set_={
+                "name": statement.excluded.name,
+                "access_url": statement.excluded.access_url,
+                "synced_at": statement.excluded.synced_at,
+            },
+        )
+    )
+
+
+async def create_key(key_name: str, server: models.Server) -> outline.OutlineKey:
+    """Создаёт ключ на сервере и сразу записывает его в инвентарь."""
+    key = await outline.create_key(key_name=key_name, server=server)
+    async with AsyncSession(config.engine) as session:
+        await record_keys(server.id, [key], session=session)  # type: ignore
+        await session.commit()
+    return key
+
+
+async def delete_key(key_id: str, server: models.Server) -> None:
+    """Удаляет ключ с сервера и из инвентаря."""
+    await outline.delete_key(key_id, server=server)
+    async with AsyncSession(config.engine) as session:
+        await session.exec(
+            delete(models.InventoryKey)  # type: ignore
+            .where(col(models.InventoryKey.server_id) == server.id)
+            .where(col(models.InventoryKey.outline_key_id) == key_id)
+        )
+        await session.commit()
+
+
+async def rename_key(key_id: str, key_name: str, server: models.Server) -> None:
+    await outline.rename_key(key_id, key_name, server=server)
+    async with AsyncSession(config.engine) as session:
+        await session.exec(
+            update(models.InventoryKey)  # type: ignore
+            .where(col(models.InventoryKey.server_id) == server.id)
+            .where(col(models.InventoryKey.outline_key_id) == key_id)
+            .values(name=key_name)
+        )
+        await session.commit()
+
+
+def find_key_query(key_name: str, server_id: int):
+    return (
+        select(models.InventoryKey.access_url)
+        .where(models.InventoryKey.server_id == server_id)
+        .where(models.InventoryKey.name == key_name)
+        .limit(1)
+    )
+
+
+async def find_key(key_name: str, server_id: int) -> str | None:
+    async with AsyncSession(config.read_engine) as session:
+        return (await session.exec(find_key_query(key_name, server_id))).first()
+
+
+async def key_get_or_create(key_name: str, server: models.Server) -> str:
+    key = await find_key(key_name, server.id)  # type: ignore
+    if key:
+        # TODO: add support multiple keys per server
+        return key
+    return (await create_key(key_name, server)).access_url
+
+
+async def sync_server(server: models.Server) -> SyncResult:
+    """
+    Сверяет инвентарь с ключами на сервере и записывает только разницу.
+
+    Инвентарь читается до запроса к серверу: ключ, созданный ботом
+    в промежутке, придёт с сервера и не будет удалён из инвентаря.
+    """
+    async with AsyncSession(config.read_engine) as session:
+        local_keys = {
+            key.outline_key_id: key
+            for key in (
+                await session.exec(
+                    select(models.InventoryKey).where(
+                        models.InventoryKey.server_id == server.id
+                    )
+                )
+            ).all()
+        }
+    remote_keys = await outline.list_keys(server)
+
+    added = [key for key in remote_keys if key.key_id not in local_keys]
+    updated = [
+        key
+        for key in remote_keys
+        if key.key_id in local_keys
+        and (local_keys[key.key_id].name, local_keys[key.key_id].access_url)
+        != (key.name, key.access_url)
+    ]
+    removed = local_keys.keys() - {key.key_id for key in remote_keys}
+    if added or updated or removed:
+        async with AsyncSession(config.engine) as session:
+            await record_keys(server.id, added + updated, session=session)  # type: ignore
+            if removed:
+                await session.exec(
+                    delete(models.InventoryKey)  # type: ignore
+                    .where(col(models.InventoryKey.server_id) == server.id)
+                    .where(col(models.InventoryKey.outline_key_id).in_(removed))
+                )
+            await session.commit()
+    return SyncResult(server.id, len(added), len(updated), len(removed))  # type: ignore
+
+
+def orphaned_keys_query(server_ids: list[int]):
+    return (
+        select(models.InventoryKey)
+        .where(col(models.InventoryKey.server_id).in_(server_ids))
+        .where(
+            ~exists().where(
+                col(models.UserKey.key_body) == col(models.InventoryKey.access_url)
+            )
+        )
+        .where(
+            ~exists().where(
+                col(models.PooledKey.access_url) == col(models.InventoryKey.access_url)
+            )
+        )
+    )
+
+
+async def find_orphaned_keys(server_ids: list[int]) -> list[models.InventoryKey]:
+    async with AsyncSession(config.read_engine) as session:
+        return list((await session.exec(orphaned_keys_query(server_ids))).all())
+
+
+async def find_missing_keys(server_ids: list[int]) -> list[models.UserKey]:
+    async with AsyncSession(config.read_engine) as session:
+        return list(
+            (
+                await session.exec(
+                    select(models.UserKey)
+                    .where(col(models.UserKey.server_id).in_(server_ids))
+                    .where(
+                        ~exists().where(
+                            col(models.InventoryKey.access_url)
+                            == col(models.UserKey.key_body)
+                        )
+                    )
+                )
+            )
+            .unique()
+            .all()
+        )
+
+
+async def sync_inventory() -> InventoryReport:
+    """
+    Синхронизирует инвентарь со всеми активными серверами и ищет
+    расхождения между ключами в БД бота и на серверах.
+
+    Расхождения ищутся только по серверам, которые удалось синхронизировать.
+    """
+    servers = await catalogue.servers(include_full=True)
+    results = await asyncio.gather(
+        *(sync_server(server) for server in servers), return_exceptions=True
+    )
+    synced: list[SyncResult] = []
+    failed_server_ids: list[int] = []
+    for server, result in zip(servers, results, strict=True):
+        if isinstance(result, SyncResult):
+            synced.append(result)
+        else:
+            logger.warning(
+                f"Key inventory sync failed for server={server.id}: {result!r}"
+            )
+            failed_server_ids.append(server.id)  # type: ignore
+
+    synced_server_ids = [result.server_id for result in synced]
+    report = InventoryReport(
+        synced=synced,
+        failed_server_ids=failed_server_ids,
+        orphaned=await find_orphaned_keys(synced_server_ids),
+        missing=await find_missing_keys(synced_server_ids),
+    )
+    if report.orphaned or report.missing:
+        logger.warning(
+            f"Key inventory drift: {len(report.orphaned)} orphaned keys, "
+            f"{len(report.missing)} missing keys."
+        )
+    return report
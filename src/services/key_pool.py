@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+import models
+from sqlalchemy import func
+from sqlmodel import col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from services import key_inventory, outline
+from services.catalogue import catalogue
+
+logger = logging.getLogger(__name__)
+
+POOLED_KEY_NAME = "pooled"
+
+
+def claim_key_statement(server_id: int):
+    oldest_key_id = (
+        select(models.PooledKey.id)
+        .where(models.PooledKey.server_id == server_id)
+        .order_by(col(models.PooledKey.id))
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        delete(models.PooledKey)
+        .where(col(models.PooledKey.id) == oldest_key_id)
+        .returning(
+            models.PooledKey.outline_key_id,  # type: ignore
+            models.PooledKey.access_url,
+        )
+    )
+
+
+async def claim_key(server_id: int, session: AsyncSession) -> models.PooledKey | None:
+    """
+    Забирает из пула один готовый ключ сервера `server_id`.
+
+    Ключ удаляется из пула одним запросом, поэтому один и тот же ключ
+    не может достаться двум пользователям. Изменение фиксируется вместе
+    с транзакцией `session`.
+    """
+    claimed = (
+        await session.exec(claim_key_statement(server_id))  # type: ignore
+    ).one_or_none()
+    if not claimed:
+        return None
+    return models.PooledKey(
+        server_id=server_id,
+        outline_key_id=claimed.outline_key_id,
+        access_url=claimed.access_url,
+    )
+
+
+async def assign_key(
+    pooled_key: models.PooledKey, key_name: str, server: models.Server
+) -> None:
+    """Переименовывает выданный из пула ключ на сервере в имя пользователя."""
+    try:
+        await key_inventory.rename_key(
+            pooled_key.outline_key_id, key_name, server=server
+        )
+    except outline.OutlineError:
+        logger.warning(
+            f"Failed to rename pooled key {pooled_key.outline_key_id} "
+            f"on server={server.id} to {key_name}."
+        )
+
+
+async def _count_pooled_keys() -> dict[int, int]:
+    async with AsyncSession(config.read_engine) as session:
+        return {
+            server_id: count
+            for server_id, count in (
+                await session.exec(
+                    select(
+                        models.PooledKey.server_id, func.count()
+                    ).group_by(col(models.PooledKey.server_id))
+                )
+            ).all()
+        }
+
+
+async def _refill_server_pool(server: models.Server, missing: int) -> int:
+    keys = []
+    for _ in range(missing):
+        try:
+            keys.append(await outline.create_key(POOLED_KEY_NAME, server=server))
+        except outline.OutlineError:
+            logger.warning(f"Failed to refill key pool for server={server.id}.")
+            break
+    if not keys:
+        return 0
+    async with AsyncSession(config.engine) as session:
+        session.add_all(
+            models.PooledKey(
+                server_id=server.id,  # type: ignore
+                outline_key_id=key.key_id,
+                access_url=key.access_url,
+            )
+            for key in keys
+        )
+        await key_inventory.record_keys(server.id, keys, session=session)  # type: ignore
+        await session.commit()
+    return len(keys)
+
+
+async def refill_key_pools() -> int:
+    """
+    Пополняет пулы ключей активных серверов до `KEY_POOL_SIZE`,
+    если в пуле осталось меньше `KEY_POOL_LOW_WATER` ключей.
+
+    Возвращает количество созданных ключей.
+    """
+    servers = await catalogue.servers()
+    pooled_keys = await _count_pooled_keys()
+    refills = []
+    for server in servers:
+        pooled = pooled_keys.get(server.id, 0)  # type: ignore
+        if pooled < config.KEY_POOL_LOW_WATER:
+            refills.append(_refill_server_pool(server, config.KEY_POOL_SIZE - pooled))
+    created = sum(await asyncio.gather(*refills))
+    if created:
+        logger.info(f"Key pools refilled with {created} keys.")
+    return created
@@ -0,0 +1,62 @@
+"""
+Аренды фоновой работы в таблице `job_lease`.
+
+Аренда принадлежит одному владельцу, пока он продлевает её раньше
+`expires_at`. Истёкшую аренду может забрать любой другой процесс.
+"""
+from datetime import datetime, timedelta
+
+import models
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+
+
+async def acquire(name: str, owner: str, ttl: timedelta) -> bool:
+    """Берёт или продлевает аренду `name`, возвращает True, если она у `owner`."""
+    now = datetime.now()
+    statement = insert(models.JobLease).values(
+        name=name, owner=owner, expires_at=now + ttl
+    )
+    async with AsyncSession(config.engine) as session:
+        acquired = (
+            await session.exec(
+                statement.on_conflict_do_update(  # type: ignore
+                    index_elements=[col(models.JobLease.name)],
+                    set_={
+                        "owner": statement.excluded.owner,
+                        "expires_at": statement.excluded.expires_at,
+                    },
+                    where=(col(models.JobLease.owner) == owner)
+                    | (col(models.JobLease.expires_at) < now),
+                ).returning(models.JobLease.name)
+            )
+        ).first()
+        await session.commit()
+    return acquired is not None
+
+
+async def release(name: str, owner: str) -> None:
+    async with AsyncSession(config.engine) as session:
+        await session.exec(
+            delete(models.JobLease)  # type: ignore
+            .where(col(models.JobLease.name) == name)
+            .where(col(models.JobLease.owner) == owner)
+        )
+        await session.commit()
+
+
+async def count_live(name_prefix: str) -> int:
+    """Сколько действующих аренд с именем, начинающимся на `name_prefix`."""
+    async with AsyncSession(config.read_engine) as session:
+        return (
+            await session.exec(
+                select(func.count())
+                .select_from(models.JobLease)
+                .where(col(models.JobLease.name).startswith(name_prefix))
+                .where(col(models.JobLease.expires_at) >= datetime.now())
+            )
+        ).one()
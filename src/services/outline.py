@@ -1,33 +1,120 @@
-from functools import lru_cache
+import asyncio
+from typing import NamedTuple
 
+import httpx
+import metrics
 import models
-from outline_vpn.outline_vpn import OutlineKey, OutlineVPN
 
+import config
 
-@lru_cache
-def create_client(api_url: str) -> OutlineVPN:
-    return OutlineVPN(api_url=api_url)
 
+class OutlineError(Exception):
+    """Сервер Outline вернул неожиданный ответ."""
 
-def create_key(key_name: str, server: models.Server) -> str:
+
+class OutlineKey(NamedTuple):
+    key_id: str
+    name: str
+    access_url: str
+
+
+class OutlineClient:
+    """Клиент API Outline с пулом соединений и ограничением параллельных
+    запросов к одному серверу."""
+
+    def __init__(self, api_url: str) -> None:
+        self._http = httpx.AsyncClient(
+            base_url=api_url,
+            # Outline по умолчанию использует самоподписанный сертификат.
+            verify=False,  # noqa: S501
+            timeout=httpx.Timeout(
+                config.OUTLINE_READ_TIMEOUT, connect=config.OUTLINE_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=config.OUTLINE_MAX_CONNECTIONS,
+                max_keepalive_connections=config.OUTLINE_MAX_CONNECTIONS,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(config.OUTLINE_MAX_CONNECTIONS)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Метка без идентификатора ключа: "PUT access-keys".
+        label = f"{method} {url.split('/', 1)[0]}"
+        async with self._semaphore:
+            with metrics.track(
+                metrics.EXTERNAL_DURATION, metrics.EXTERNAL_ERRORS, "outline", label
+            ):
+                try:
+                    response = await self._http.request(method, url, **kwargs)
+                except httpx.HTTPError as error:
+                    raise OutlineError(f"{method} {url} failed: {error!r}") from error
+                if response.is_error:
+                    raise OutlineError(
+                        f"{method} {url} failed with status {response.status_code}"
+                    )
+        return response
+
+    async def get_keys(self) -> list[OutlineKey]:
+        response = await self._request("GET", "access-keys/")
+        return [_to_outline_key(key) for key in response.json()["accessKeys"]]
+
+    async def create_key(self, key_name: str | None = None) -> OutlineKey:
+        key = _to_outline_key((await self._request("POST", "access-keys/")).json())
+        if key_name:
+            await self.rename_key(key.key_id, key_name)
+            key = key._replace(name=key_name)
+        return key
+
+    async def rename_key(self, key_id: str, key_name: str) -> None:
+        await self._request(
+            "PUT", f"access-keys/{key_id}/name", data={"name": key_name}
+        )
+
+    async def delete_key(self, key_id: str) -> None:
+        await self._request("DELETE", f"access-keys/{key_id}")
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+def _to_outline_key(key: dict) -> OutlineKey:
+    return OutlineKey(
+        key_id=key["id"],
+        name=key.get("name") or "",
+        access_url=key["accessUrl"],
+    )
+
+
+_clients: dict[str, OutlineClient] = {}
+
+
+def create_client(api_url: str) -> OutlineClient:
+    if api_url not in _clients:
+        _clients[api_url] = OutlineClient(api_url)
+    return _clients[api_url]
+
+
+async def close_clients() -> None:
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+
+
+async def create_key(key_name: str, server: models.Server) -> OutlineKey:
     client = create_client(server.api_url)
-    key = client.create_key(key_name=key_name)
-    return key.access_url
+    return await client.create_key(key_name=key_name)
 
 
-def get_keys(key_name: str, server: models.Server) -> list[str]:
+async def rename_key(key_id: str, key_name: str, server: models.Server) -> None:
     client = create_client(server.api_url)
-    keys: list[OutlineKey] = client.get_keys()
+    await client.rename_key(key_id, key_name)
 
-    return [
-        outline_key.access_url
-        for outline_key in keys if outline_key.name==key_name
-    ]
 
+async def delete_key(key_id: str, server: models.Server) -> None:
+    client = create_client(server.api_url)
+    await client.delete_key(key_id)
 
-def key_get_or_create(key_name: str, server: models.Server) -> str:
-    keys = get_keys(key_name, server)
-    if keys:
-        # TODO: add support multiple keys per server
-        return keys[0]
-    return create_key(key_name, server)
+
+async def list_keys(server: models.Server) -> list[OutlineKey]:
+    client = create_client(server.api_url)
+    return await client.get_keys()
@@ -0,0 +1,24 @@
+from typing import Any, NamedTuple
+
+from sqlalchemy import ColumnElement, true
+
+
+class UserShard(NamedTuple):
+    """
+    Часть пользователей для фоновой работы: пользователи,
+    у которых `user_id % total == number`.
+    """
+
+    number: int
+    total: int
+
+    @property
+    def lease_name(self) -> str:
+        return f"shard:{self.number}/{self.total}"
+
+
+def in_shard(user_id_column: Any, shard: UserShard | None) -> ColumnElement[bool]:
+    """Условие на колонку с user_id, без части — все пользователи."""
+    if shard is None:
+        return true()
+    return user_id_column % shard.total == shard.number
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[K, T]):
+    """
+    Объединяет одновременные вызовы с одним ключом: выполняется только
+    первый, остальные ждут его результата.
+
+    Результат (или ошибка) первого вызова помнится ещё `window` секунд,
+    повторный вызов в это окно получает его же, а не выполняется заново.
+    """
+
+    def __init__(self, window: float) -> None:
+        self._window = window
+        self._calls: dict[K, asyncio.Task[T]] = {}
+        self._expires_at: dict[K, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: K, call: Callable[[], Awaitable[T]]) -> T:
+        self._prune(time.monotonic())
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._finish(key, task))
+        # Отмена одного из ждущих не отменяет общий вызов.
+        return await asyncio.shield(task)
+
+    def _finish(self, key: K, task: asyncio.Task[T]) -> None:
+        if self._calls.get(key) is task:
+            self._expires_at[key] = time.monotonic() + self._window
+
+    def _prune(self, now: float) -> None:
+        for key in [key for key, at in self._expires_at.items() if at <= now]:
+            del self._expires_at[key]
+            del self._calls[key]
@@ -1,21 +1,73 @@
+import time
 import urllib.parse
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple
 
 import httpx
+import metrics
 
 import config
 
+MEMBER_STATUSES = (
+    "member",
+    "creator",
+    "administrator",
+)
+
+
+class Membership(NamedTuple):
+    is_member: bool
+    expires_at: float
+
+
+# Индекс членства пользователей в каналах: (channel_id, user_id) -> Membership,
+# в порядке записи: при переполнении вытесняются самые старые записи.
+_memberships: OrderedDict[tuple[int, int], Membership] = OrderedDict()
+
+
+@lru_cache
+def create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=httpx.Timeout(config.TELEGRAM_API_TIMEOUT))
+
+
+async def close_client() -> None:
+    if create_client.cache_info().currsize:
+        await create_client().aclose()
+        create_client.cache_clear()
+
+
+def set_membership(user_id: int, channel_id: int, is_member: bool) -> None:
+    """Запоминает членство `user_id` в `channel_id`.
+
+    Отрицательный результат хранится меньше, чтобы только что добавленный
+    в канал пользователь не ждал долго."""
+    ttl = config.MEMBERSHIP_TTL if is_member else config.MEMBERSHIP_NEGATIVE_TTL
+    key = (channel_id, user_id)
+    _memberships[key] = Membership(is_member, time.monotonic() + ttl)
+    _memberships.move_to_end(key)
+    while len(_memberships) > config.MEMBERSHIP_CACHE_SIZE:
+        _memberships.popitem(last=False)
+
 
 async def is_user_in_channel(user_id: int, channel_id: int) -> bool:
     """Returns True if user `user_id` in `channel_id` now"""
+    membership = _memberships.get((channel_id, user_id))
+    if membership and membership.expires_at > time.monotonic():
+        return membership.is_member
+    is_member = await _fetch_membership(user_id, channel_id)
+    set_membership(user_id, channel_id, is_member)
+    return is_member
+
+
+async def _fetch_membership(user_id: int, channel_id: int) -> bool:
     url = _get_tg_url(method="getChatMember", chat_id=channel_id, user_id=user_id)
-    async with httpx.AsyncClient() as client:
-        json_response = (await client.get(url)).json()
+    with metrics.track(
+        metrics.EXTERNAL_DURATION, metrics.EXTERNAL_ERRORS, "telegram", "getChatMember"
+    ):
+        json_response = (await create_client().get(url)).json()
     try:
-        return json_response["result"]["status"] in (
-            "member",
-            "creator",
-            "administrator",
-        )
+        return json_response["result"]["status"] in MEMBER_STATUSES
     except KeyError:
         return False
 
@@ -23,7 +75,7 @@ async def is_user_in_channel(user_id: int, channel_id: int) -> bool:
 def _get_tg_url(method: str, **params) -> str:
     """Returns URL for Telegram Bot API method `method`
     and optional key=value `params`"""
-    url = f"https://api.telegram.org/bot{config.TELEGRAM_BOT_TOKEN}/{method}"
+    url = f"{config.TELEGRAM_API_URL}/bot{config.TELEGRAM_BOT_TOKEN}/{method}"
     if params:
         url += "?" + urllib.parse.urlencode(params)
     return url
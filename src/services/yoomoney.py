@@ -1,45 +1,160 @@
 import asyncio
+import logging
+import time
+import urllib.parse
 import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
 
+import httpx
+import metrics
 import models
 from sqlmodel.ext.asyncio.session import AsyncSession
-from yoomoney import Client, Quickpay
 
 import config
 
+logger = logging.getLogger(__name__)
 
-def create_client() -> Client:
-    token = config.YOOMONEY_TOKEN
-    client = Client(token)
-    return client
+QUICKPAY_URL = "https://yoomoney.ru/quickpay/confirm.xml"
+HISTORY_PAGE_SIZE = 100
 
 
-def _create_new_bill(bill_id: str) -> tuple[str, str]:
-    client = create_client()
-    quickpay = Quickpay(
-        receiver=client.account_info().account,
-        quickpay_form="shop",
-        targets="Заплатить за месячное пользование сервисом",
-        paymentType="SB",
-        sum=config.DEFAULT_SUM,
-        label=bill_id,
+class YooMoneyError(Exception):
+    """Ошибка, которую вернул API ЮMoney."""
+
+
+class ReceiverAccount(NamedTuple):
+    account: str
+    fetched_at: float
+
+
+_receiver_account: ReceiverAccount | None = None
+
+
+@lru_cache
+def create_client() -> httpx.AsyncClient:
+    """Общий для всех запросов клиент с пулом keep-alive соединений."""
+    return httpx.AsyncClient(
+        base_url=config.YOOMONEY_API_URL,
+        timeout=httpx.Timeout(config.YOOMONEY_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=config.YOOMONEY_MAX_CONNECTIONS,
+            max_keepalive_connections=config.YOOMONEY_MAX_CONNECTIONS,
+        ),
     )
-    return bill_id, quickpay.base_url
 
 
-async def create_new_bill_coro(user_id: int) -> tuple[str, str]:
+@lru_cache
+def _get_semaphore() -> asyncio.Semaphore:
+    return asyncio.Semaphore(config.YOOMONEY_MAX_CONNECTIONS)
+
+
+async def close_client() -> None:
+    if create_client.cache_info().currsize:
+        await create_client().aclose()
+        create_client.cache_clear()
+
+
+async def _request(method: str, **data) -> dict:
+    async with _get_semaphore():
+        with metrics.track(
+            metrics.EXTERNAL_DURATION, metrics.EXTERNAL_ERRORS, "yoomoney", method
+        ):
+            response = await create_client().post(
+                method,
+                data=data,
+                headers={"Authorization": f"Bearer {config.YOOMONEY_TOKEN}"},
+            )
+            response.raise_for_status()
+            json_response = response.json()
+            if "error" in json_response:
+                raise YooMoneyError(json_response["error"])
+    return json_response
 
+
+@lru_cache
+def _get_receiver_lock() -> asyncio.Lock:
+    return asyncio.Lock()
+
+
+async def get_receiver_account() -> str:
+    """
+    Номер кошелька получателя платежей.
+
+    Запрашивается у ЮMoney не чаще раза в `YOOMONEY_ACCOUNT_TTL` секунд,
+    если запрос не удался — используется ранее полученное значение.
+    """
+    global _receiver_account
+    if config.YOOMONEY_RECEIVER:
+        return config.YOOMONEY_RECEIVER
+    async with _get_receiver_lock():
+        if (
+            _receiver_account
+            and time.monotonic() - _receiver_account.fetched_at
+            < config.YOOMONEY_ACCOUNT_TTL
+        ):
+            return _receiver_account.account
+        try:
+            account = (await _request("account-info"))["account"]
+        except (httpx.HTTPError, YooMoneyError):
+            if not _receiver_account:
+                raise
+            logger.warning("Failed to refresh YooMoney account, using cached one.")
+            return _receiver_account.account
+        _receiver_account = ReceiverAccount(account, time.monotonic())
+        return account
+
+
+def build_payment_url(receiver: str, bill_id: str, bill_sum: int) -> str:
+    """Ссылка на форму оплаты счета, собирается без обращения к ЮMoney."""
+    params = {
+        "receiver": receiver,
+        "quickpay-form": "shop",
+        "targets": "Заплатить за месячное пользование сервисом",
+        "paymentType": "SB",
+        "sum": bill_sum,
+        "label": bill_id,
+    }
+    return f"{QUICKPAY_URL}?{urllib.parse.urlencode(params)}"
+
+
+async def create_new_bill_coro(user_id: int) -> tuple[str, str]:
+    receiver = await get_receiver_account()
     bill = models.Bill(user_id=user_id, bill_id=uuid.uuid4(), sum=config.DEFAULT_SUM)
-    async with AsyncSession(config.engine) as session:
+    async with AsyncSession(config.engine, expire_on_commit=False) as session:
         session.add(bill)
         await session.commit()
-        await session.refresh(bill)
 
-    return await asyncio.to_thread(_create_new_bill, bill_id=str(bill.bill_id))
+    bill_id = str(bill.bill_id)
+    return bill_id, build_payment_url(receiver, bill_id, bill.sum)
 
 
 async def check_if_payment_done(bill_id: uuid.UUID) -> bool:
     """Проверка что оплата по счету `bill_id` прошла."""
-    client = create_client()
-    history = client.operation_history(label=bill_id)
-    return len(history.operations) > 0
+    history = await _request("operation-history", label=str(bill_id))
+    return len(history["operations"]) > 0
+
+
+async def list_payed_labels(since: datetime) -> dict[str, float]:
+    """
+    Метки всех успешных поступлений начиная с `since` и поступившие по ним
+    суммы (`amount`, за вычетом комиссии ЮMoney).
+    """
+    payed: dict[str, float] = {}
+    page: dict = {}
+    while True:
+        history = await _request(
+            "operation-history",
+            type="deposition",
+            records=HISTORY_PAGE_SIZE,
+            **{"from": since.strftime("%Y-%m-%dT%H:%M:%S")},
+            **page,
+        )
+        for operation in history["operations"]:
+            if operation.get("label") and operation.get("status") == "success":
+                label = operation["label"]
+                payed[label] = payed.get(label, 0) + float(operation["amount"])
+        if not history.get("next_record"):
+            return payed
+        page = {"start_record": history["next_record"]}
@@ -0,0 +1,38 @@
+from http import HTTPStatus
+from typing import Optional
+
+import metrics
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Запросы к Bot API с замером времени и ошибок по методам API."""
+
+    __slots__ = ()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        with metrics.track(
+            metrics.EXTERNAL_DURATION, metrics.EXTERNAL_ERRORS, "telegram", api_method
+        ):
+            status_code, payload = await super().do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        if status_code >= HTTPStatus.BAD_REQUEST:
+            metrics.EXTERNAL_ERRORS.labels("telegram", api_method).inc()
+        return status_code, payload
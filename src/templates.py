@@ -1,32 +1,83 @@
 import re
+from typing import Iterator
 
 import jinja2
+from jinja2.ext import Extension
+from jinja2.lexer import Token, TokenStream
 
 import config
 
+# Шаблоны без параметров, ответы по ним рендерятся один раз.
+STATIC_TEMPLATES = ("start.j2", "help.j2", "not_authorized.j2")
+
+_MULTIPLE_SPACES = re.compile(" +")
+_SPACES_AROUND_NEWLINE = re.compile(" *\n *")
+
+_static_responses: dict[str, str] = {}
+
+
+def _normalize_text(text: str) -> str:
+    text = text.replace("\n", " ").replace("<br>", "\n")
+    text = _MULTIPLE_SPACES.sub(" ", text).replace(" .", ".").replace(" ,", ",")
+    text = _SPACES_AROUND_NEWLINE.sub("\n", text)
+    return text.replace("{FOURPACES}", "    ")
+
+
+class WhitespaceNormalizer(Extension):
+    """Нормализует пробелы и переносы в тексте шаблона при компиляции,
+    чтобы не делать этого при каждом рендере."""
+
+    def filter_stream(self, stream: TokenStream) -> Iterator[Token]:
+        for token in stream:
+            if token.type == "data":
+                token = Token(token.lineno, token.type, _normalize_text(token.value))
+            yield token
+
 
 def render_template(template_name: str, data: dict | None = None) -> str:
     if data is None:
-        data = {}
+        if template_name not in _static_responses:
+            _static_responses[template_name] = _render(template_name, {})
+        return _static_responses[template_name]
+    return _render(template_name, data)
+
+
+def _render(template_name: str, data: dict) -> str:
     template = _get_template_env().get_template(template_name)
-    rendered = template.render(**data).replace("\n", " ")
-    rendered = rendered.replace("<br>", "\n")
-    rendered = re.sub(" +", " ", rendered).replace(" .", ".").replace(" ,", ",")
-    rendered = "\n".join(line.strip() for line in rendered.split("\n"))
-    rendered = rendered.replace("{FOURPACES}", "    ")
-    return rendered
+    return template.render(**data).strip(" ")
+
+
+def warm_up() -> None:
+    """Заранее рендерит ответы по шаблонам без параметров."""
+    for template_name in STATIC_TEMPLATES:
+        render_template(template_name)
+
+
+def compile_templates() -> None:
+    """Собирает скомпилированные шаблоны в `config.TEMPLATES_BUNDLE`."""
+    env = _create_env(jinja2.FileSystemLoader(searchpath=config.TEMPLATES_DIR))
+    env.compile_templates(config.TEMPLATES_BUNDLE, zip="deflated", ignore_errors=False)
+
+
+def _create_env(loader: jinja2.BaseLoader) -> jinja2.Environment:
+    return jinja2.Environment(
+        loader=loader,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        autoescape=True,
+        extensions=[WhitespaceNormalizer],
+    )
 
 
 def _get_template_env():
     if not getattr(_get_template_env, "template_env", None):
-        template_loader = jinja2.FileSystemLoader(searchpath=config.TEMPLATES_DIR)
-        env = jinja2.Environment(
-            loader=template_loader,
-            trim_blocks=True,
-            lstrip_blocks=True,
-            autoescape=True,
-        )
-
-        _get_template_env.template_env = env
+        if config.TEMPLATES_BUNDLE.exists():
+            template_loader: jinja2.BaseLoader = jinja2.ModuleLoader(
+                config.TEMPLATES_BUNDLE
+            )
+        else:
+            template_loader = jinja2.FileSystemLoader(searchpath=config.TEMPLATES_DIR)
+
+        _get_template_env.template_env = _create_env(template_loader)
 
     return _get_template_env.template_env
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable
+
+import metrics
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+UPDATE_QUEUE_WAIT = metrics.histogram(
+    "bot_update_queue_wait_seconds",
+    "Сколько обновление ждало начала обработки.",
+)
+UPDATES_IN_PROGRESS = metrics.gauge(
+    "bot_updates_in_progress", "Сколько обновлений обрабатывается сейчас."
+)
+
+
+class TimestampedUpdateQueue(asyncio.Queue):
+    """
+    Очередь обновлений приложения, которая запоминает, когда в неё
+    попало каждое обновление. Её читает `UserOrderedUpdateProcessor`,
+    чтобы в ожидание вошли и очередь, и семафор базового класса.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._received_at: dict[int, float] = {}
+
+    # put() неограниченной очереди тоже кладёт обновление через put_nowait().
+    def put_nowait(self, item: object) -> None:
+        if isinstance(item, Update):
+            self._received_at[item.update_id] = time.monotonic()
+        super().put_nowait(item)
+
+    def pop_received_at(self, update: object) -> float | None:
+        if not isinstance(update, Update):
+            return None
+        return self._received_at.pop(update.update_id, None)
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления параллельно, но обновления одного пользователя —
+    строго по очереди, в порядке поступления.
+
+    Слот из `max_workers` занимается только после блокировки пользователя,
+    чтобы пачка обновлений от одного пользователя не заняла все слоты.
+    Семафор базового класса ограничивает число ожидающих обновлений.
+    Время ожидания считается от попадания обновления в `update_queue`.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_pending_updates: int,
+        update_queue: TimestampedUpdateQueue | None = None,
+    ) -> None:
+        super().__init__(max_concurrent_updates=max_pending_updates)
+        self._workers = asyncio.BoundedSemaphore(max_workers)
+        self._user_locks: dict[int, asyncio.Lock] = {}
+        self._user_pending: Counter[int] = Counter()
+        self._update_queue = update_queue
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        received_at = None
+        if self._update_queue:
+            received_at = self._update_queue.pop_received_at(update)
+        if received_at is None:
+            received_at = time.monotonic()
+        user = update.effective_user if isinstance(update, Update) else None
+        if not user:
+            async with self._workers:
+                await self._run(coroutine, received_at)
+            return
+
+        lock = self._user_locks.setdefault(user.id, asyncio.Lock())
+        self._user_pending[user.id] += 1
+        try:
+            async with lock, self._workers:
+                await self._run(coroutine, received_at)
+        finally:
+            self._user_pending[user.id] -= 1
+            if not self._user_pending[user.id]:
+                del self._user_pending[user.id]
+                del self._user_locks[user.id]
+
+    async def _run(self, coroutine: Awaitable[Any], received_at: float) -> None:
+        UPDATE_QUEUE_WAIT.observe(time.monotonic() - received_at)
+        UPDATES_IN_PROGRESS.inc()
+        try:
+            await coroutine
+        finally:
+            UPDATES_IN_PROGRESS.dec()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,95 @@
+import asyncio
+import hmac
+import json
+import signal
+from http import HTTPStatus
+
+from telegram import Update
+from telegram.ext import Application
+
+import config
+from http_listener import HttpListener, Request
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"  # noqa: S105
+
+
+class WebhookListener(HttpListener):
+    """
+    HTTP-сервер для вебхука Telegram.
+
+    Принимает POST-запросы с обновлениями на `url_path` и кладёт их в очередь
+    обновлений приложения, как это делает опрос getUpdates.
+    """
+
+    name = "Webhook"
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str,
+        port: int,
+        url_path: str,
+        secret_token: str,
+    ) -> None:
+        super().__init__(listen, port, url_path)
+        self._application = application
+        self._secret_token = secret_token.encode()
+
+    async def stop(self, timeout: float | None = config.WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """
+        Перестаёт принимать соединения и ждёт, пока начатые запросы
+        положат обновления в очередь.
+        """
+        await super().stop(timeout)
+
+    async def handle(self, request: Request) -> HTTPStatus:
+        if not hmac.compare_digest(
+            request.headers.get(SECRET_TOKEN_HEADER, "").encode(), self._secret_token
+        ):
+            return HTTPStatus.FORBIDDEN
+        update = Update.de_json(json.loads(request.body), self._application.bot)
+        if not update:
+            return HTTPStatus.BAD_REQUEST
+        await self._application.update_queue.put(update)
+        return HTTPStatus.OK
+
+
+def run_webhook(application: Application) -> None:
+    """Запускает бота в режиме вебхука до SIGINT или SIGTERM."""
+    asyncio.run(_serve(application))
+
+
+async def _serve(application: Application) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    listener = WebhookListener(
+        application,
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        url_path=config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET_TOKEN,
+    )
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await listener.start()
+        await application.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop.wait()
+    finally:
+        # Пока бот остановлен, Telegram копит обновления и повторит их
+        # после запуска, а уже принятые обрабатываются до конца.
+        await listener.stop()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
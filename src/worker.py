@@ -0,0 +1,192 @@
+"""
+Процесс для фоновой работы: ежемесячных списаний и проверки оплаты счетов.
+
+Пользователи делятся на `WORKER_SHARDS` частей, каждой частью владеет один
+воркер, пока продлевает её аренду в таблице `job_lease`. Воркеры поровну
+делят части между собой, а часть упавшего воркера забирает другой, как
+только истечёт её аренда. Запускается командой `python src/worker.py`,
+у бота при этом должно быть `BACKGROUND_JOBS=worker`.
+"""
+import asyncio
+import logging
+import math
+import os
+import signal
+import socket
+import time
+from datetime import timedelta
+
+import handlers
+import metrics
+import migrations
+from outbox import outbox
+from services import leases, outline, validation, yoomoney
+from services.bill_watch import BillWatcher, PayedBillsCallback
+from services.fee_scheduler import FeeScheduler
+from services.shards import UserShard
+from telegram import Bot
+from telegram_request import InstrumentedRequest
+
+import config
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Аренды с этим префиксом — признак жизни воркеров, по ним делятся части.
+WORKER_LEASE_PREFIX = "worker:"
+# Версия схемы, с которой появилась таблица аренд job_lease.
+SCHEMA_VERSION = 4
+
+
+class ShardJobs:
+    """Списания и проверка оплаты счетов для одной части пользователей."""
+
+    def __init__(self, shard: UserShard, on_payed: PayedBillsCallback) -> None:
+        self.scheduler = FeeScheduler(shard)
+        self.watcher = BillWatcher(shard)
+        self._on_payed = on_payed
+        self._keys_loaded_at = 0.0
+
+    async def start(self) -> None:
+        await self.scheduler.start()
+        self._keys_loaded_at = time.monotonic()
+        await self.watcher.start(on_payed=self._on_payed)
+
+    async def refresh(self) -> None:
+        """Подхватывает счета и ключи, созданные процессом бота."""
+        await self.watcher.load()
+        keys_age = time.monotonic() - self._keys_loaded_at
+        if keys_age >= config.WORKER_KEYS_RELOAD_INTERVAL:
+            await self.scheduler.load()
+            self._keys_loaded_at = time.monotonic()
+
+    async def stop(self) -> None:
+        await self.scheduler.stop()
+        await self.watcher.stop()
+
+
+class Worker:
+    def __init__(
+        self, worker_id: str, shard_count: int, on_payed: PayedBillsCallback
+    ) -> None:
+        self.worker_id = worker_id
+        self.shards = [UserShard(number, shard_count) for number in range(shard_count)]
+        self.jobs: dict[UserShard, ShardJobs] = {}
+        self._on_payed = on_payed
+        self._ttl = timedelta(seconds=config.WORKER_LEASE_TTL)
+        self._renewed_at = time.monotonic()
+
+    @property
+    def lease_name(self) -> str:
+        return f"{WORKER_LEASE_PREFIX}{self.worker_id}"
+
+    async def rebalance(self) -> None:
+        """
+        Продлевает аренды своих частей и забирает свободные, пока у воркера
+        не наберётся поровну с остальными. Лишние части отпускает.
+        """
+        await leases.acquire(self.lease_name, self.worker_id, self._ttl)
+        live_workers = await leases.count_live(WORKER_LEASE_PREFIX)
+        fair_share = math.ceil(len(self.shards) / max(live_workers, 1))
+        for shard in list(self.jobs):
+            if len(self.jobs) > fair_share:
+                await self._drop(shard)
+                await leases.release(shard.lease_name, self.worker_id)
+            elif not await leases.acquire(shard.lease_name, self.worker_id, self._ttl):
+                logger.warning(f"Lease of shard {shard.lease_name} was lost.")
+                await self._drop(shard)
+        for shard in self.shards:
+            if len(self.jobs) >= fair_share:
+                break
+            if shard not in self.jobs and await leases.acquire(
+                shard.lease_name, self.worker_id, self._ttl
+            ):
+                await self._take(shard)
+        self._renewed_at = time.monotonic()
+        for jobs in self.jobs.values():
+            await jobs.refresh()
+
+    async def _take(self, shard: UserShard) -> None:
+        logger.info(f"Worker {self.worker_id} took shard {shard.lease_name}.")
+        jobs = ShardJobs(shard, self._on_payed)
+        await jobs.start()
+        self.jobs[shard] = jobs
+
+    async def _drop(self, shard: UserShard) -> None:
+        logger.info(f"Worker {self.worker_id} dropped shard {shard.lease_name}.")
+        await self.jobs.pop(shard).stop()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            try:
+                await self.rebalance()
+            except Exception:
+                logger.exception("Worker leases renewal failed.")
+                # Аренды, возможно, уже истекли и части забрал другой воркер.
+                if time.monotonic() - self._renewed_at > config.WORKER_LEASE_TTL:
+                    for shard in list(self.jobs):
+                        await self._drop(shard)
+            try:
+                await asyncio.wait_for(
+                    stop.wait(), timeout=config.WORKER_LEASE_RENEW_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+        await self.stop()
+
+    async def stop(self) -> None:
+        """Останавливает работу и отпускает аренды, не дожидаясь их истечения."""
+        for shard in list(self.jobs):
+            await self._drop(shard)
+            await leases.release(shard.lease_name, self.worker_id)
+        await leases.release(self.lease_name, self.worker_id)
+
+
+async def run_worker() -> None:
+    async with config.read_engine.connect() as conn:
+        await conn.run_sync(migrations.require_version, SCHEMA_VERSION)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    bot = Bot(
+        config.TELEGRAM_BOT_TOKEN,
+        base_url=f"{config.TELEGRAM_API_URL}/bot",
+        request=InstrumentedRequest(),
+    )
+    metrics_server = metrics.MetricsServer(
+        config.METRICS_LISTEN, config.WORKER_METRICS_PORT
+    )
+    worker = Worker(
+        config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}",
+        config.WORKER_SHARDS,
+        on_payed=handlers.notify_payed_bills,
+    )
+    await bot.initialize()
+    if config.WORKER_METRICS_PORT:
+        await metrics_server.start()
+    outbox.start(bot)
+    logger.info(f"Worker {worker.worker_id} started.")
+    try:
+        await worker.run(stop)
+    finally:
+        await outbox.stop()
+        await metrics_server.stop()
+        await yoomoney.close_client()
+        await outline.close_clients()
+        await validation.close_client()
+        await bot.shutdown()
+
+
+def main():
+    if not config.TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN env variable is required by the worker.")
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
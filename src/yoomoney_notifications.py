@@ -0,0 +1,89 @@
+import hashlib
+import hmac
+import logging
+import urllib.parse
+import uuid
+from http import HTTPStatus
+
+from services import billing
+from services.bill_watch import watcher
+
+import config
+from http_listener import HttpListener, Request
+
+logger = logging.getLogger(__name__)
+
+# Поля уведомления в порядке, в котором они входят в строку для sha1_hash.
+SIGNED_FIELDS = (
+    "notification_type",
+    "operation_id",
+    "amount",
+    "currency",
+    "datetime",
+    "sender",
+    "codepro",
+    "notification_secret",
+    "label",
+)
+
+
+def sign(notification: dict[str, str], secret: str) -> str:
+    """sha1_hash уведомления, как его считает ЮMoney."""
+    fields = {**notification, "notification_secret": secret}
+    return hashlib.sha1(  # noqa: S324
+        "&".join(fields.get(name, "") for name in SIGNED_FIELDS).encode()
+    ).hexdigest()
+
+
+class YooMoneyNotificationListener(HttpListener):
+    """
+    HTTP-сервер для уведомлений ЮMoney о входящих платежах.
+
+    Проверяет подпись уведомления и сразу зачисляет оплаченный счёт на баланс.
+    Ответ 200 ЮMoney получает и тогда, когда счёт не найден, уже оплачен
+    или оплачен не полностью: иначе уведомление будет отправляться повторно.
+    """
+
+    name = "YooMoney notifications listener"
+    max_body_size = 64 * 1024
+
+    def __init__(self, listen: str, port: int, url_path: str, secret: str) -> None:
+        super().__init__(listen, port, url_path)
+        self._secret = secret
+
+    async def handle(self, request: Request) -> HTTPStatus:
+        notification = dict(urllib.parse.parse_qsl(request.body.decode()))
+        if not hmac.compare_digest(
+            notification.get("sha1_hash", ""), sign(notification, self._secret)
+        ):
+            logger.warning("YooMoney notification with a wrong sha1_hash.")
+            return HTTPStatus.FORBIDDEN
+        await self.process(notification)
+        return HTTPStatus.OK
+
+    async def process(self, notification: dict[str, str]) -> None:
+        """Зачисляет счёт из проверенного уведомления."""
+        # Платёж с протекцией или замороженный платёж ещё не зачислен
+        # на кошелёк, его подтвердит сверка с историей операций.
+        if notification.get("codepro") == "true":
+            return
+        if notification.get("unaccepted") == "true":
+            return
+        try:
+            bill_id = uuid.UUID(notification.get("label", ""))
+        except ValueError:
+            return
+        # amount входит в подпись и, как в истории операций, указан
+        # за вычетом комиссии. Недоплаченный счёт не зачисляется.
+        payed_amount = float(notification.get("amount", ""))
+        watcher.mark_payed(
+            await billing.credit_bills([bill_id], payed_amount=payed_amount)
+        )
+
+
+listener = YooMoneyNotificationListener(
+    listen=config.YOOMONEY_NOTIFICATION_LISTEN,
+    port=config.YOOMONEY_NOTIFICATION_PORT,
+    url_path=config.YOOMONEY_NOTIFICATION_PATH,
+    secret=config.YOOMONEY_NOTIFICATION_SECRET,
+)
@@ -4,6 +4,7 @@ import uuid
 
 import pytest_asyncio
 from models import Balance, Bill, BotUser, Server, UserKey
+from services.catalogue import catalogue
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -17,14 +18,12 @@ async def _init_models(engine: AsyncEngine):
 
 @pytest_asyncio.fixture(name="patch_engine", scope="session", autouse=True)
 async def patch_engine_fixture() -> AsyncIterator[AsyncEngine]:
-    with patch(
-        "config.engine",
-        new=create_async_engine(
-            "sqlite+aiosqlite:////var/test.sqlite?cache=shared",
-            connect_args={"check_same_thread": False},
-            echo=True,
-        ),
-    ) as engine:
+    engine = create_async_engine(
+        "sqlite+aiosqlite:////var/test.sqlite?cache=shared",
+        connect_args={"check_same_thread": False},
+        echo=True,
+    )
+    with patch("config.engine", new=engine), patch("config.read_engine", new=engine):
         await _init_models(engine)
         yield engine
 
@@ -57,7 +56,7 @@ async def create_user_with_key_fixture(db_session: AsyncSession):
     return test_user, test_key
 
 
-@pytest_asyncio.fixture(name="create_server")
+@pytest_asyncio.fixture(name="create_server", scope="session")
 async def create_server_fixture(db_session: AsyncSession):
     test_server = Server(
         api_url="test_url",
@@ -67,6 +66,7 @@ async def create_server_fixture(db_session: AsyncSession):
     )
     db_session.add(test_server)
     await db_session.commit()
+    catalogue.invalidate()
 
     return test_server
 
@@ -0,0 +1,92 @@
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from models import Bill
+
+from services import billing
+from services.bill_watch import BillWatcher
+from services.shards import UserShard
+
+
+@pytest.mark.asyncio
+async def test_bill_watcher_polls_only_open_bills():
+    now = datetime.now()
+    watcher = BillWatcher()
+    on_payed = MagicMock()
+    watcher._on_payed = on_payed
+    payed_bill = Bill(user_id=1, bill_id=uuid.uuid4(), sum=150, issued_at=now)
+    watcher.watch(payed_bill.bill_id, issued_at=now)
+    # Срок оплаты этого счёта истёк: его оплата проверяется в последний раз,
+    # после чего счёт удаляется.
+    expired_bill_id = uuid.uuid4()
+    watcher.watch(expired_bill_id, issued_at=now - billing.BILL_TTL)
+
+    with patch(
+        "services.bill_watch.billing.reconcile_payments",
+        new_callable=AsyncMock,
+        return_value=[payed_bill],
+    ) as reconcile_mock, patch(
+        "services.bill_watch.billing.delete_expired_bills",
+        new_callable=AsyncMock,
+        return_value=1,
+    ) as delete_mock:
+        assert await watcher.poll(now) == [payed_bill]
+        assert len(watcher) == 0
+        # Открытых счетов не осталось: ЮMoney больше не опрашивается.
+        assert await watcher.poll(now) == []
+
+    reconcile_mock.assert_awaited_once()
+    delete_mock.assert_awaited_once_with([expired_bill_id])
+    on_payed.assert_called_once_with([payed_bill])
+
+
+@pytest.mark.asyncio
+async def test_bill_watcher_loads_open_bills(db_session):
+    now = datetime.now()
+    open_bill_id, expired_bill_id, payed_bill_id = (uuid.uuid4() for _ in range(3))
+    db_session.add_all(
+        [
+            Bill(user_id=10, bill_id=open_bill_id, sum=150, issued_at=now),
+            Bill(
+                user_id=10,
+                bill_id=expired_bill_id,
+                sum=150,
+                issued_at=now - billing.BILL_TTL - timedelta(minutes=1),
+            ),
+            Bill(
+                user_id=10, bill_id=payed_bill_id, sum=150, issued_at=now, payed_at=now
+            ),
+        ]
+    )
+    await db_session.commit()
+    watcher = BillWatcher()
+
+    await watcher.load()
+
+    assert open_bill_id in watcher._expirations
+    assert payed_bill_id not in watcher._expirations
+    # Счёт, истёкший пока бот был остановлен, удаляется первой очисткой.
+    due_bill_ids = watcher._expirations.pop_due(now)
+    assert expired_bill_id in due_bill_ids
+    assert open_bill_id not in due_bill_ids
+
+
+@pytest.mark.asyncio
+async def test_bill_watcher_loads_only_its_shard(db_session):
+    now = datetime.now()
+    own_bill_id, other_bill_id = uuid.uuid4(), uuid.uuid4()
+    db_session.add_all(
+        [
+            Bill(user_id=21, bill_id=own_bill_id, sum=150, issued_at=now),
+            Bill(user_id=22, bill_id=other_bill_id, sum=150, issued_at=now),
+        ]
+    )
+    await db_session.commit()
+    watcher = BillWatcher(UserShard(number=1, total=2))
+
+    await watcher.load()
+
+    assert own_bill_id in watcher._expirations
+    assert other_bill_id not in watcher._expirations
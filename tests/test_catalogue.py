@@ -0,0 +1,100 @@
+import time
+
+import pytest
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from handlers import SERVERS_PAGE_SIZE, _build_servers_keyboards
+from models import Server
+from services.catalogue import (
+    ServerCatalogue,
+    ServerFullError,
+    ServerNotAvailableError,
+    add_server,
+    catalogue,
+    reserve_key_slot,
+    update_server,
+)
+
+
+@pytest.mark.asyncio
+async def test_catalogue_invalidation(create_server):
+    await catalogue.servers()
+    version = catalogue.version
+    assert (await catalogue.get(1)).api_url == "test_url"
+    assert catalogue.version == version
+
+    server = await add_server("TC", "192.168.0.2", "catalogue_url")
+    assert server.id in [server.id for server in await catalogue.servers()]
+    assert catalogue.version == version + 1
+
+    await update_server(server.id, is_active=False)
+    with pytest.raises(ServerNotAvailableError):
+        await catalogue.get(server.id)
+
+
+@pytest.mark.asyncio
+async def test_catalogue_picks_up_changes_from_other_process(create_server):
+    bot_catalogue = ServerCatalogue()
+    await bot_catalogue.servers()
+
+    # Глобальный catalogue играет роль manage.py, кеш бота он не сбрасывает.
+    server = await add_server("TP", "192.168.0.3", "other_process_url")
+    assert server.id not in [server.id for server in await bot_catalogue.servers()]
+
+    bot_catalogue._checked_at -= config.SERVER_CATALOGUE_CHECK_INTERVAL
+    assert server.id in [server.id for server in await bot_catalogue.servers()]
+    await update_server(server.id, is_active=False)
+
+
+def test_servers_keyboard_pages():
+    servers = [
+        Server(id=server_id, country_code="TS", ip_address="10.0.0.1", api_url="url")
+        for server_id in range(SERVERS_PAGE_SIZE + 1)
+    ]
+
+    first_page, last_page = _build_servers_keyboards(servers)
+
+    assert len(first_page.inline_keyboard) == SERVERS_PAGE_SIZE + 2
+    assert first_page.inline_keyboard[0][0].callback_data == "server_auto"
+    assert first_page.inline_keyboard[-1][0].callback_data == "servers_page_1"
+    last_server_button = last_page.inline_keyboard[0][0]
+    assert last_server_button.callback_data == f"server_{SERVERS_PAGE_SIZE}"
+    assert last_page.inline_keyboard[-1][0].callback_data == "servers_page_0"
+
+
+@pytest.mark.asyncio
+async def test_full_server_leaves_catalogue(create_server):
+    server = await add_server("TF", "192.168.0.3", "full_url", capacity=1)
+    async with AsyncSession(config.engine) as session:
+        await reserve_key_slot(server.id, session=session)
+        await session.commit()
+        with pytest.raises(ServerFullError):
+            await reserve_key_slot(server.id, session=session)
+
+    catalogue.invalidate()
+    assert server.id not in [server.id for server in await catalogue.servers()]
+    with pytest.raises(ServerFullError):
+        await catalogue.get(server.id)
+    await update_server(server.id, is_active=False)
+
+
+@pytest.mark.asyncio
+async def test_least_loaded_server():
+    servers = ServerCatalogue()
+    servers._servers = {
+        1: Server(id=1, country_code="A", ip_address="", api_url="", key_count=50),
+        2: Server(
+            id=2, country_code="B", ip_address="", api_url="", capacity=10, key_count=1
+        ),
+        3: Server(
+            id=3, country_code="C", ip_address="", api_url="", capacity=2, key_count=2
+        ),
+    }
+    servers._loaded_at = servers._checked_at = time.monotonic()
+
+    # 50 из 1000 по умолчанию меньше, чем 1 из 10, заполненный сервер пропускается.
+    assert (await servers.least_loaded()).id == 1
+    servers.record_key_issued(3)
+    servers._servers[1].key_count = 500
+    assert (await servers.least_loaded()).id == 2
@@ -0,0 +1,89 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import exc, text
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from models import Balance, Bill, PooledKey, Server, UserKey
+from services import billing
+from services.catalogue import catalogue
+from services.db_management import add_new_key
+from services.outline import OutlineKey
+
+# Сервисы не должны ждать второго соединения на запись дольше этого.
+DEADLOCK_TIMEOUT = 10
+
+
+@pytest_asyncio.fixture(name="production_engines")
+async def production_engines_fixture(tmp_path):
+    with patch("config.DB_PROFILE", "production"), patch(
+        "config.SQLITE_DB_FILE", str(tmp_path / "db.sqlite3")
+    ):
+        engine = config.create_engine()
+        read_engine = config.create_engine(read_only=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    catalogue.invalidate()
+    with patch("config.engine", new=engine), patch(
+        "config.read_engine", new=read_engine
+    ):
+        yield engine, read_engine
+    catalogue.invalidate()
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_read_engine_is_read_only(production_engines):
+    _, read_engine = production_engines
+    async with read_engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            await conn.execute(text("INSERT INTO balance (user_id, sum) VALUES (1, 1)"))
+
+
+@pytest.mark.asyncio
+@patch("services.db_management.key_pool.assign_key")
+@patch("services.db_management.key_inventory.create_key")
+async def test_services_share_single_writer_connection(
+    create_mock, assign_mock, production_engines
+):
+    engine, _ = production_engines
+    create_mock.side_effect = [
+        OutlineKey(key_id=str(user_id), name="user", access_url=f"ss://{user_id}")
+        for user_id in range(3)
+    ]
+    now = datetime.now()
+    async with AsyncSession(engine) as session:
+        session.add(Server(id=1, api_url="test_url", country_code="TS", ip_address=""))
+        session.add(PooledKey(server_id=1, outline_key_id="p", access_url="ss://p"))
+        session.add_all(Balance(user_id=user_id, sum=300) for user_id in range(1, 5))
+        bill_id = uuid.uuid4()
+        session.add(Bill(user_id=1, bill_id=bill_id, sum=150, issued_at=now))
+        await session.commit()
+
+    # Покупки из пула и с созданием ключа идут одновременно с другими
+    # записями через единственное соединение на запись.
+    await asyncio.wait_for(
+        asyncio.gather(
+            *(
+                add_new_key(user_id, "user", "User", server_id=1)
+                for user_id in range(1, 5)
+            ),
+            billing.credit_bills([bill_id]),
+            billing.withdraw_monthly_fee(),
+        ),
+        timeout=DEADLOCK_TIMEOUT,
+    )
+
+    async with AsyncSession(engine) as session:
+        keys = (await session.exec(select(UserKey))).unique().all()
+    assert len(keys) == 4
+    assert await billing.check_balance(1) == 300 + 150 - config.MONTHLY_FEE
+    assert await billing.check_balance(2) == 300 - config.MONTHLY_FEE
+    assert {key.last_payed_at > now - timedelta(minutes=1) for key in keys} == {True}
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from models import BotUser, UserKey
+from services import billing
+from services.deadlines import DeadlineQueue
+from services.fee_scheduler import FeeScheduler
+
+
+def test_deadline_queue():
+    now = datetime.now()
+    queue: DeadlineQueue[int] = DeadlineQueue()
+    queue.schedule(1, now + timedelta(days=1))
+    queue.schedule(2, now - timedelta(seconds=1))
+    queue.schedule(3, now - timedelta(seconds=2))
+    # Перенос срока ключа 3: старая запись в куче игнорируется.
+    queue.schedule(3, now + timedelta(days=2))
+    queue.cancel(1)
+
+    assert queue.pop_due(now) == [2]
+    assert queue.next_deadline() == now + timedelta(days=2)
+    assert len(queue) == 1
+
+
+@pytest.mark.asyncio
+async def test_fee_scheduler_charge_due():
+    now = datetime.now()
+    scheduler = FeeScheduler()
+    scheduler.schedule_key(1, last_payed_at=now - billing.BILLING_PERIOD)
+    scheduler.schedule_key(2, last_payed_at=now)
+    report = billing.WithdrawalReport(
+        charged_keys=1, elapsed=0.0, charged_key_ids=[1], charged_at=now
+    )
+
+    with patch(
+        "services.fee_scheduler.billing.withdraw_monthly_fee",
+        new_callable=AsyncMock,
+        return_value=report,
+    ) as withdraw_mock:
+        assert await scheduler.charge_due(now) == report
+        # Следующий срок ни у одного ключа ещё не наступил.
+        assert await scheduler.charge_due(now) is None
+
+    withdraw_mock.assert_awaited_once()
+    assert scheduler._deadlines.next_deadline() == now + billing.BILLING_PERIOD
+
+
+@pytest.mark.asyncio
+async def test_fee_scheduler_reloads_keys_charged_elsewhere(db_session):
+    now = datetime.now()
+    user = BotUser(telegram_id=601, telegram_name="user", telegram_fullname="User")
+    # За ключ уже списал другой процесс, пока срок лежал в куче.
+    key = UserKey(
+        user=user, key_name="key", key_body="ss://601", server_id=1, last_payed_at=now
+    )
+    db_session.add_all([user, key])
+    await db_session.commit()
+    await db_session.refresh(key)
+    key_id = key.id
+    deleted_key_id = key_id + 1000
+    scheduler = FeeScheduler()
+    scheduler.schedule_key(key_id, last_payed_at=now - billing.BILLING_PERIOD)
+    scheduler.schedule_key(deleted_key_id, last_payed_at=now - billing.BILLING_PERIOD)
+    report = billing.WithdrawalReport(
+        charged_keys=0, elapsed=0.0, charged_key_ids=[], charged_at=now
+    )
+
+    with patch(
+        "services.fee_scheduler.billing.withdraw_monthly_fee",
+        new_callable=AsyncMock,
+        return_value=report,
+    ):
+        await scheduler.charge_due(now)
+
+    assert scheduler._deadlines.next_deadline() == now + billing.BILLING_PERIOD
+    assert deleted_key_id not in scheduler._deadlines
@@ -0,0 +1,49 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from models import UserKey
+from services import key_inventory
+from services.catalogue import add_server, update_server
+from services.outline import OutlineKey
+
+
+@pytest.mark.asyncio
+async def test_sync_server(create_server, db_session):
+    server = await add_server("TI", "192.168.0.4", "inventory_url")
+    db_session.add(
+        UserKey(
+            telegram_id=123,
+            key_name="issued",
+            key_body="ss://issued",
+            server_id=server.id,
+        )
+    )
+    db_session.add(
+        UserKey(
+            telegram_id=123, key_name="lost", key_body="ss://lost", server_id=server.id
+        )
+    )
+    await db_session.commit()
+    remote_keys = [
+        OutlineKey("1", "issued", "ss://issued"),
+        OutlineKey("2", "", "ss://orphan"),
+    ]
+
+    with patch("services.outline.list_keys", AsyncMock(return_value=remote_keys)):
+        first_sync = await key_inventory.sync_server(server)
+    orphaned = await key_inventory.find_orphaned_keys([server.id])
+    missing = await key_inventory.find_missing_keys([server.id])
+    remote_keys = [OutlineKey("1", "renamed", "ss://issued")]
+    with patch("services.outline.list_keys", AsyncMock(return_value=remote_keys)):
+        second_sync = await key_inventory.sync_server(server)
+        repeated_sync = await key_inventory.sync_server(server)
+    await update_server(server.id, is_active=False)
+
+    assert first_sync == (server.id, 2, 0, 0)
+    assert [key.outline_key_id for key in orphaned] == ["2"]
+    assert [key.key_body for key in missing] == ["ss://lost"]
+    assert second_sync == (server.id, 0, 1, 1)
+    assert repeated_sync == (server.id, 0, 0, 0)
+    assert await key_inventory.find_key("renamed", server.id) == "ss://issued"
+    assert await key_inventory.find_key("issued", server.id) is None
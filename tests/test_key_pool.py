@@ -0,0 +1,80 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+import pytest_asyncio
+from sqlmodel import col, delete, select
+
+import config
+from models import Balance, PooledKey, UserKey
+from services import outline
+from services.db_management import NotEnoughMoneyOnBalanceError, add_new_key
+from services.key_pool import refill_key_pools
+
+
+@pytest_asyncio.fixture(name="empty_key_pool")
+async def empty_key_pool_fixture(db_session):
+    yield
+    await db_session.exec(delete(PooledKey))
+    await db_session.commit()
+
+
+@pytest.mark.asyncio
+async def test_refill_key_pools(create_server, empty_key_pool, db_session):
+    created_keys = [
+        outline.OutlineKey(key_id=str(key_id), name="pooled", access_url=f"ss://{key_id}")
+        for key_id in range(config.KEY_POOL_SIZE)
+    ]
+    client = AsyncMock()
+    client.create_key.side_effect = created_keys
+    with patch("services.key_pool.outline.create_client", return_value=client):
+        assert await refill_key_pools() == config.KEY_POOL_SIZE
+        # Пул полон, повторный вызов ничего не создаёт.
+        assert await refill_key_pools() == 0
+
+    pooled_keys = (await db_session.exec(select(PooledKey))).all()
+    assert len(pooled_keys) == config.KEY_POOL_SIZE
+
+
+@pytest.mark.asyncio
+@patch("services.db_management.key_inventory.create_key")
+@patch("services.key_pool.outline.rename_key")
+async def test_add_new_key_from_pool(
+    rename_mock, create_mock, create_server, empty_key_pool, db_session
+):
+    telegram_user_id = 444
+    db_session.add(Balance(user_id=telegram_user_id, sum=config.MONTHLY_FEE))
+    db_session.add(
+        PooledKey(server_id=1, outline_key_id="pooled_id", access_url="ss://pooled")
+    )
+    await db_session.commit()
+    pooled_before = len((await db_session.exec(select(PooledKey))).all())
+
+    await add_new_key(telegram_user_id, "pool_user", "Pool User", server_id=1)
+
+    user_key = (
+        await db_session.exec(
+            select(UserKey).where(col(UserKey.telegram_id) == telegram_user_id)
+        )
+    ).unique().one()
+    assert user_key.key_body.startswith("ss://")
+    assert len((await db_session.exec(select(PooledKey))).all()) == pooled_before - 1
+    create_mock.assert_not_called()
+    rename_mock.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("services.db_management.check_balance", return_value=config.MONTHLY_FEE)
+async def test_add_new_key_returns_pooled_key_when_balance_is_short(
+    balance_mock, create_server, empty_key_pool, db_session
+):
+    telegram_user_id = 445
+    db_session.add(
+        PooledKey(server_id=1, outline_key_id="kept_id", access_url="ss://kept")
+    )
+    await db_session.commit()
+
+    with pytest.raises(NotEnoughMoneyOnBalanceError):
+        await add_new_key(telegram_user_id, "short_user", "Short User", server_id=1)
+
+    pooled_urls = (await db_session.exec(select(PooledKey.access_url))).all()
+    assert "ss://kept" in pooled_urls
@@ -0,0 +1,65 @@
+import httpx
+import pytest
+
+import metrics
+
+
+@pytest.mark.asyncio
+async def test_instrument_records_latency_and_errors():
+    duration = metrics.Histogram("test_duration_seconds", "", labelnames=("name",))
+    errors = metrics.Counter("test_errors_total", "", labelnames=("name",))
+
+    @metrics.instrument(duration, errors, "failing")
+    async def failing():
+        raise RuntimeError
+
+    @metrics.instrument(duration, errors, "working")
+    async def working():
+        return 1
+
+    assert await working() == 1
+    with pytest.raises(RuntimeError):
+        await failing()
+
+    assert working.__name__ == "working"
+    assert duration.labels("working").count == 1
+    assert duration.labels("failing").count == 1
+    assert errors.labels("failing").value == 1
+    assert errors.labels("working").value == 0
+
+
+def test_render_labeled_histogram():
+    duration = metrics.Histogram(
+        "test_render_seconds", "Test.", buckets=(0.1, 1), labelnames=("handler",)
+    )
+    duration.labels("/balance").observe(0.5)
+
+    assert duration.render() == [
+        "# HELP test_render_seconds Test.",
+        "# TYPE test_render_seconds histogram",
+        'test_render_seconds_bucket{handler="/balance",le="0.1"} 0',
+        'test_render_seconds_bucket{handler="/balance",le="1"} 1',
+        'test_render_seconds_bucket{handler="/balance",le="+Inf"} 1',
+        'test_render_seconds_sum{handler="/balance"} 0.5',
+        'test_render_seconds_count{handler="/balance"} 1',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    metrics.HANDLER_DURATION.labels("/test").observe(0.01)
+    server = metrics.MetricsServer("127.0.0.1", 0)
+    await server.start()
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{server.port}"
+        ) as client:
+            response = await client.get("/metrics")
+            not_found = await client.get("/")
+    finally:
+        await server.stop()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'bot_handler_duration_seconds_count{handler="/test"} 1' in response.text
+    assert not_found.status_code == 404
@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlmodel import SQLModel
+
+from migrations import (
+    MIGRATIONS,
+    SchemaOutdatedError,
+    _add_server_capacity,
+    explain_service_queries,
+    require_version,
+    run_migrations,
+)
+
+
+@pytest.mark.asyncio
+async def test_run_migrations(patch_engine):
+    async with patch_engine.begin() as conn:
+        applied = await conn.run_sync(run_migrations)
+        # Повторный запуск ничего не применяет.
+        assert await conn.run_sync(run_migrations) == []
+        versions = (
+            await conn.execute(text("SELECT version FROM schema_migration"))
+        ).scalars().all()
+        plans = await conn.run_sync(explain_service_queries)
+
+    assert {migration.version for migration in applied} <= set(versions)
+    assert {migration.version for migration in MIGRATIONS} == set(versions)
+    unpayed_bills_plan = plans["billing.list_unpayed_bills"]
+    ledger_plan = plans["billing.check_balance (ledger)"]
+    assert any("ix_bill_unpaid_user_id" in row for row in unpayed_bills_plan)
+    assert any("ix_balance_user_id" in row for row in ledger_plan)
+
+
+def test_add_server_capacity_to_existing_table():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE server (id INTEGER PRIMARY KEY)")
+        conn.exec_driver_sql("CREATE TABLE user_key (id INTEGER, server_id INTEGER)")
+        conn.exec_driver_sql("INSERT INTO server (id) VALUES (1), (2)")
+        conn.exec_driver_sql("INSERT INTO user_key VALUES (1, 1), (2, 1)")
+        _add_server_capacity(conn)
+        rows = conn.exec_driver_sql(
+            "SELECT id, capacity, key_count FROM server ORDER BY id"
+        ).all()
+
+    assert [tuple(row) for row in rows] == [(1, None, 2), (2, None, 0)]
+
+
+def test_require_version():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        with pytest.raises(SchemaOutdatedError):
+            require_version(conn, 4)
+        SQLModel.metadata.create_all(conn)
+        run_migrations(conn)
+        require_version(conn, 4)
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, call, patch
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbox import Outbox, Priority, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_outbox_sends_interactive_first():
+    outbox = Outbox()
+    bot = AsyncMock()
+    outbox.send_nowait(1, text="notification")
+    outbox.send_nowait(2, priority=Priority.INTERACTIVE, text="reply")
+
+    with patch("config.OUTBOX_WORKERS", 1):
+        outbox.start(bot)
+    await outbox.stop()
+
+    assert bot.send_message.await_args_list == [
+        call(chat_id=2, text="reply"),
+        call(chat_id=1, text="notification"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_after_flood_control():
+    outbox = Outbox()
+    bot = AsyncMock()
+    bot.send_message.side_effect = [RetryAfter(0), None]
+    outbox.start(bot)
+
+    await outbox.send(1, text="reply")
+    await outbox.stop()
+
+    assert bot.send_message.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_outbox_burst_to_one_chat_does_not_block_others():
+    outbox = Outbox()
+    bot = AsyncMock()
+    with patch("config.TELEGRAM_CHAT_RATE", 10), patch(
+        "config.TELEGRAM_CHAT_BURST", 1
+    ), patch("config.OUTBOX_WORKERS", 2):
+        # Сообщения чата 1 уходят не чаще 10 в секунду, всего около 0.5 с.
+        for number in range(6):
+            outbox.send_nowait(1, priority=Priority.INTERACTIVE, text=str(number))
+        outbox.start(bot)
+        started = time.monotonic()
+        await asyncio.wait_for(outbox.send(2, text="other"), timeout=1)
+        other_delay = time.monotonic() - started
+        await outbox.stop()
+
+    assert other_delay < 0.1
+    chat_texts = [
+        sent.kwargs["text"]
+        for sent in bot.send_message.await_args_list
+        if sent.kwargs["chat_id"] == 1
+    ]
+    assert chat_texts == [str(number) for number in range(6)]
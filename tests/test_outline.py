@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from models import Server
+from services import outline
+
+
+def _outline_api(request: httpx.Request) -> httpx.Response:
+    if request.method == "POST":
+        return httpx.Response(
+            201, json={"id": "7", "name": "", "accessUrl": "ss://new_key"}
+        )
+    if request.method == "PUT":
+        return httpx.Response(204)
+    return httpx.Response(
+        200,
+        json={
+            "accessKeys": [
+                {"id": "1", "name": "test_user", "accessUrl": "ss://existing"},
+                {"id": "2", "name": "other_user", "accessUrl": "ss://other"},
+            ]
+        },
+    )
+
+
+@pytest.fixture(name="outline_client")
+def outline_client_fixture():
+    client = outline.OutlineClient("https://outline.test/secret")
+    client._http = httpx.AsyncClient(
+        base_url="https://outline.test/secret",
+        transport=httpx.MockTransport(_outline_api),
+    )
+    with patch("services.outline.create_client", return_value=client):
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_outline_keys(outline_client):
+    server = Server(country_code="TS", ip_address="127.0.0.1", api_url="test_url")
+
+    keys = await outline.list_keys(server)
+    new_key = await outline.create_key("new_user", server)
+
+    assert [key.name for key in keys] == ["test_user", "other_user"]
+    assert new_key == outline.OutlineKey("7", "new_user", "ss://new_key")
@@ -1,32 +1,48 @@
-from unittest.mock import patch
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from sqlalchemy import func
 from sqlmodel import col, select
 
-from models import Balance, BotUser, UserKey
+import config
+from models import Balance, Bill, BotUser, UserBalance, UserKey
 from services.billing import (
+    BalanceDrift,
     add_money_to_balance,
     check_balance,
-    delete_stale_bills,
+    delete_expired_bills,
+    find_balance_drift,
     list_unpayed_bills,
+    rebuild_balance_snapshots,
+    reconcile_payments,
+    withdraw_from_balance,
+    withdraw_monthly_fee,
 )
 from services.db_management import (
+    NotEnoughMoneyOnBalanceError,
     _check_if_user_has_key,
     add_new_key,
 )
+from services.outline import OutlineKey
 
 
 @pytest.mark.asyncio
 @patch("services.db_management._check_if_user_has_key", return_value=[])
-@patch("services.db_management.outline.create_key", return_value="test_key")
+@patch(
+    "services.db_management.key_inventory.create_key",
+    return_value=OutlineKey(key_id="1", name="test_user", access_url="test_key"),
+)
 async def test_add_new_key_to_db(
     outline_mock, user_has_key_return, db_session, create_server
 ):
     telegram_user_id = 333
     telegram_username = "test_user"
     telegram_user_fullname = "Test User"
-    user_key = await add_new_key(
+    db_session.add(Balance(user_id=telegram_user_id, sum=150))
+    await db_session.commit()
+    result = await add_new_key(
         telegram_user_id,
         telegram_username,
         telegram_user_fullname,
@@ -35,7 +51,7 @@ async def test_add_new_key_to_db(
     user_key = (
         (
             await db_session.exec(
-                select(UserKey).filter(col(BotUser.telegram_id) == telegram_user_id)
+                select(UserKey).filter(col(UserKey.telegram_id) == telegram_user_id)
             )
         )
         .unique()
@@ -44,6 +60,64 @@ async def test_add_new_key_to_db(
 
     assert user_key.user.telegram_id == telegram_user_id
     assert user_key.key_body == "test_key"
+    assert result.instance.keys[0].key_body == "test_key"  # type: ignore
+
+
+@pytest.mark.asyncio
+@patch("config.BACKGROUND_JOBS", "worker")
+@patch("services.db_management.fee_scheduler.scheduler.schedule_key")
+@patch(
+    "services.db_management.key_inventory.create_key",
+    return_value=OutlineKey(key_id="3", name="worker_user", access_url="ss://worker"),
+)
+async def test_add_new_key_leaves_scheduling_to_workers(
+    create_mock, schedule_mock, db_session, create_server
+):
+    telegram_user_id = 336
+    db_session.add(Balance(user_id=telegram_user_id, sum=config.MONTHLY_FEE))
+    await db_session.commit()
+
+    await add_new_key(telegram_user_id, "worker_user", "Worker User", server_id=1)
+
+    schedule_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("services.db_management.check_balance", return_value=config.MONTHLY_FEE)
+@patch("services.db_management.key_inventory.delete_key")
+@patch(
+    "services.db_management.key_inventory.create_key",
+    return_value=OutlineKey(key_id="2", name="late_user", access_url="ss://late"),
+)
+async def test_add_new_key_rechecks_balance_on_charge(
+    create_mock, delete_mock, balance_mock, db_session, create_server
+):
+    # Деньги списала другая покупка, пока создавался ключ на сервере.
+    telegram_user_id = 334
+    with pytest.raises(NotEnoughMoneyOnBalanceError):
+        await add_new_key(telegram_user_id, "late_user", "Late User", server_id=1)
+
+    delete_mock.assert_awaited_once()
+    assert delete_mock.await_args.args == ("2",)
+    assert delete_mock.await_args.kwargs["server"].id == 1
+    assert not (
+        await db_session.exec(
+            select(UserKey).where(col(UserKey.telegram_id) == telegram_user_id)
+        )
+    ).first()
+
+
+@pytest.mark.asyncio
+async def test_withdraw_from_balance(db_session):
+    user_id = 335
+    db_session.add(Balance(user_id=user_id, sum=config.MONTHLY_FEE))
+    await db_session.commit()
+
+    assert await withdraw_from_balance(user_id, config.MONTHLY_FEE, db_session)
+    assert not await withdraw_from_balance(user_id, config.MONTHLY_FEE, db_session)
+    await db_session.commit()
+
+    assert await check_balance(user_id) == 0
 
 
 @pytest.mark.asyncio
@@ -89,5 +163,108 @@ async def test_list_unpayed_bills(create_bill_test_data, db_session):
 
 
 @pytest.mark.asyncio
-async def test_delete_bills(create_bill_test_data, db_session):
-    await delete_stale_bills()
+async def test_delete_expired_bills(db_session):
+    expired_bill_id, payed_bill_id = uuid.uuid4(), uuid.uuid4()
+    db_session.add_all(
+        [
+            Bill(user_id=40, sum=150, bill_id=expired_bill_id),
+            Bill(user_id=40, sum=150, bill_id=payed_bill_id, payed_at=datetime.now()),
+        ]
+    )
+    await db_session.commit()
+
+    # Оплаченный счёт не удаляется, даже если его срок истёк.
+    assert await delete_expired_bills([expired_bill_id, payed_bill_id]) == 1
+    assert await delete_expired_bills([expired_bill_id]) == 0
+
+
+@pytest.mark.asyncio
+async def test_reconcile_payments(create_balance_test_data, db_session):
+    bill_id = uuid.uuid4()
+    db_session.add(Bill(user_id=2, sum=150, bill_id=bill_id))
+    await db_session.commit()
+    balance_before = await check_balance(user_id=2)
+
+    with patch(
+        "services.billing.yoomoney.list_payed_labels",
+        new_callable=AsyncMock,
+        return_value={str(bill_id): 147.75, "unknown_label": 150},
+    ):
+        payed_bills = await reconcile_payments()
+
+    assert [payed.bill_id for payed in payed_bills] == [bill_id]
+    assert payed_bills[0].payed_at
+    assert await check_balance(user_id=2) == balance_before + 150
+
+
+@pytest.mark.asyncio
+async def test_reconcile_payments_skips_underpaid_bill(db_session):
+    bill_id = uuid.uuid4()
+    db_session.add(Bill(user_id=41, sum=150, bill_id=bill_id))
+    await db_session.commit()
+    balance_before = await check_balance(user_id=41)
+
+    with patch(
+        "services.billing.yoomoney.list_payed_labels",
+        new_callable=AsyncMock,
+        return_value={str(bill_id): 10},
+    ):
+        assert await reconcile_payments() == []
+
+    bill = await db_session.get(Bill, bill_id)
+    assert bill and not bill.payed_at
+    assert await check_balance(user_id=41) == balance_before
+
+
+@pytest.mark.asyncio
+async def test_balance_snapshot_drift(db_session):
+    await add_money_to_balance(user_id=555, ammount=300, session=db_session)
+    await add_money_to_balance(user_id=555, ammount=-150, session=db_session)
+    await db_session.commit()
+    assert await check_balance(user_id=555) == 150
+
+    # Операция в обход add_money_to_balance не попадает в снимок.
+    db_session.add(Balance(user_id=555, sum=10))
+    await db_session.commit()
+    assert BalanceDrift(555, 150, 160) in await find_balance_drift()
+
+    await rebuild_balance_snapshots()
+    assert await find_balance_drift() == []
+    assert await check_balance(user_id=555) == 160
+
+
+@pytest.mark.asyncio
+async def test_withdraw_monthly_fee(db_session):
+    # Списываем плату за ключи, оставшиеся от других тестов.
+    await withdraw_monthly_fee()
+    db_session.add(Balance(user_id=666, sum=1000))
+    db_session.add_all(
+        [
+            UserKey(
+                telegram_id=user_id,
+                key_body=f"due_key_{key_number}",
+                server_id=1,
+                last_payed_at=datetime.now() - timedelta(days=40),
+            )
+            for key_number, user_id in enumerate((666, 666, 667))
+        ]
+        + [
+            UserKey(
+                telegram_id=666,
+                key_body="payed_key",
+                server_id=1,
+                last_payed_at=datetime.now(),
+            )
+        ]
+    )
+    await db_session.commit()
+
+    report = await withdraw_monthly_fee()
+    assert report.charged_keys == 3
+    assert (await withdraw_monthly_fee()).charged_keys == 0
+
+    assert await check_balance(user_id=666) == 1000 - 2 * config.MONTHLY_FEE
+    snapshot = await db_session.get(UserBalance, 666)
+    assert snapshot
+    assert snapshot.sum == 1000 - 2 * config.MONTHLY_FEE
+    assert await check_balance(user_id=667) == -config.MONTHLY_FEE
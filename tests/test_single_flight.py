@@ -0,0 +1,62 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from services import db_management
+from services.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_calls():
+    flight: SingleFlight[str, int] = SingleFlight(window=60)
+    release = asyncio.Event()
+    calls = 0
+
+    async def call() -> int:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    first = asyncio.create_task(flight.run("key", call))
+    second = asyncio.create_task(flight.run("key", call))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first == await second == 1
+    # Повторный вызов в окне получает тот же результат.
+    assert await flight.run("key", call) == 1
+    assert await flight.run("other", call) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_forgets_after_window():
+    flight: SingleFlight[str, int] = SingleFlight(window=0)
+    call = AsyncMock(side_effect=ValueError)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            await flight.run("key", call)
+
+    assert call.await_count == 2
+    assert len(flight) == 1
+
+
+@pytest.mark.asyncio
+async def test_add_new_key_double_tap_buys_one_key():
+    result = db_management.ServiceResult(instance=None, is_created=True)  # type: ignore
+
+    with patch(
+        "services.db_management._add_new_key",
+        new_callable=AsyncMock,
+        return_value=result,
+    ) as add_mock:
+        results = await asyncio.gather(
+            db_management.add_new_key(901, "user", "User", server_id=1),
+            db_management.add_new_key(901, "user", "User", server_id=1),
+        )
+        await db_management.add_new_key(901, "user", "User", server_id=None)
+
+    assert results == [result, result]
+    assert add_mock.await_count == 2
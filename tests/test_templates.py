@@ -0,0 +1,66 @@
+import re
+from types import SimpleNamespace
+
+import jinja2
+import pytest
+
+import config
+import templates
+from templates import render_template
+
+
+def _legacy_render(template_name: str, data: dict) -> str:
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=config.TEMPLATES_DIR),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        autoescape=True,
+    )
+    rendered = env.get_template(template_name).render(**data).replace("\n", " ")
+    rendered = rendered.replace("<br>", "\n")
+    rendered = re.sub(" +", " ", rendered).replace(" .", ".").replace(" ,", ",")
+    rendered = "\n".join(line.strip() for line in rendered.split("\n"))
+    return rendered.replace("{FOURPACES}", "    ")
+
+
+_USER = SimpleNamespace(
+    keys=[
+        SimpleNamespace(id=1, key_body="ss://first"),
+        SimpleNamespace(id=2, key_body="ss://second"),
+    ]
+)
+
+
+@pytest.mark.parametrize(
+    ("template_name", "data"),
+    [
+        ("start.j2", None),
+        ("help.j2", None),
+        ("not_authorized.j2", None),
+        ("bill.j2", {"url": "https://yoomoney.ru/quickpay/confirm.xml?label=1"}),
+        (
+            "new_key.j2",
+            {"data": {"is_created": True, "instance": _USER, "telegram_name": "u"}},
+        ),
+        (
+            "new_key.j2",
+            {"data": {"is_created": False, "instance": _USER, "telegram_name": "u"}},
+        ),
+    ],
+)
+def test_render_template_matches_runtime_normalization(template_name, data):
+    assert render_template(template_name, data) == _legacy_render(
+        template_name, data or {}
+    )
+
+
+def test_compile_templates(tmp_path, monkeypatch):
+    bundle = tmp_path / "templates_compiled.zip"
+    monkeypatch.setattr(config, "TEMPLATES_BUNDLE", bundle)
+    templates.compile_templates()
+
+    env = templates._create_env(jinja2.ModuleLoader(bundle))
+    data = {"url": "https://yoomoney.ru/quickpay/confirm.xml?label=1"}
+    assert env.get_template("bill.j2").render(**data).strip(" ") == render_template(
+        "bill.j2", data
+    )
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+from update_processor import (
+    UPDATE_QUEUE_WAIT,
+    TimestampedUpdateQueue,
+    UserOrderedUpdateProcessor,
+)
+
+
+def _update(update_id: int, user_id: int) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type=Chat.PRIVATE),
+            from_user=User(id=user_id, first_name="Test", is_bot=False),
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_updates_of_one_user_run_in_order():
+    processor = UserOrderedUpdateProcessor(max_workers=4, max_pending_updates=100)
+    events = []
+
+    async def handle(update_id: int, delay: float):
+        events.append(("start", update_id))
+        await asyncio.sleep(delay)
+        events.append(("end", update_id))
+
+    observed = UPDATE_QUEUE_WAIT.count
+    await asyncio.gather(
+        processor.process_update(_update(1, user_id=1), handle(1, 0.05)),
+        processor.process_update(_update(2, user_id=1), handle(2, 0)),
+        processor.process_update(_update(3, user_id=2), handle(3, 0)),
+    )
+
+    # Второе обновление пользователя 1 ждёт первое,
+    # а обновление пользователя 2 обрабатывается сразу.
+    assert events.index(("end", 1)) < events.index(("start", 2))
+    assert events.index(("end", 3)) < events.index(("end", 1))
+    assert UPDATE_QUEUE_WAIT.count == observed + 3
+    assert not processor._user_locks
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_includes_pending_limit():
+    update_queue = TimestampedUpdateQueue()
+    processor = UserOrderedUpdateProcessor(
+        max_workers=4, max_pending_updates=1, update_queue=update_queue
+    )
+
+    async def handle(delay: float):
+        await asyncio.sleep(delay)
+
+    for update_id in (1, 2):
+        await update_queue.put(_update(update_id, user_id=update_id))
+    first, second = update_queue.get_nowait(), update_queue.get_nowait()
+    observed_count, observed_sum = UPDATE_QUEUE_WAIT.count, UPDATE_QUEUE_WAIT.sum
+    await asyncio.gather(
+        processor.process_update(first, handle(0.05)),
+        processor.process_update(second, handle(0)),
+    )
+
+    # Второе обновление ждало, пока первое освободит единственное место.
+    assert UPDATE_QUEUE_WAIT.count == observed_count + 2
+    assert UPDATE_QUEUE_WAIT.sum - observed_sum >= 0.05
+    assert not update_queue._received_at
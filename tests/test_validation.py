@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from services import validation
+from services.validation import is_user_in_channel, set_membership
+
+
+@pytest.mark.asyncio
+async def test_is_user_in_channel_uses_membership_index():
+    requests = []
+
+    def _telegram_api(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        status = "member" if request.url.params["user_id"] == "1" else "left"
+        return httpx.Response(200, json={"ok": True, "result": {"status": status}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_telegram_api))
+    with patch("services.validation.create_client", return_value=client), patch.dict(
+        validation._memberships, clear=True
+    ):
+        assert await is_user_in_channel(1, channel_id=100)
+        assert not await is_user_in_channel(2, channel_id=100)
+        assert await is_user_in_channel(1, channel_id=100)
+        assert not await is_user_in_channel(2, channel_id=100)
+        assert len(requests) == 2
+
+        set_membership(2, channel_id=100, is_member=True)
+        assert await is_user_in_channel(2, channel_id=100)
+        assert len(requests) == 2
+
+
+def test_membership_index_is_capped():
+    with patch.dict(validation._memberships, clear=True), patch(
+        "config.MEMBERSHIP_CACHE_SIZE", 2
+    ):
+        for user_id in range(3):
+            set_membership(user_id, channel_id=100, is_member=True)
+        # Обновлённая запись становится самой новой.
+        set_membership(1, channel_id=100, is_member=True)
+        set_membership(3, channel_id=100, is_member=True)
+
+        assert list(validation._memberships) == [(100, 1), (100, 3)]
@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+from webhook import SECRET_TOKEN_HEADER, WebhookListener
+
+SECRET_TOKEN = "test_secret"  # noqa: S105
+
+# Обновление в том виде, в котором его присылает Telegram.
+RECORDED_UPDATE = {
+    "update_id": 10001,
+    "message": {
+        "message_id": 1,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private", "first_name": "Test"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+@pytest_asyncio.fixture(name="listener")
+async def listener_fixture():
+    application = ApplicationBuilder().token("123:TEST").updater(None).build()
+    listener = WebhookListener(
+        application,
+        listen="127.0.0.1",
+        port=0,
+        url_path="/telegram",
+        secret_token=SECRET_TOKEN,
+    )
+    await listener.start()
+    yield listener, application
+    await listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_webhook_puts_update_to_queue(listener):
+    listener, application = listener
+    base_url = f"http://127.0.0.1:{listener.port}"
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        response = await client.post(
+            "/telegram",
+            json=RECORDED_UPDATE,
+            headers={SECRET_TOKEN_HEADER: SECRET_TOKEN},
+        )
+
+    assert response.status_code == 200
+    update = application.update_queue.get_nowait()
+    assert isinstance(update, Update)
+    assert update.update_id == RECORDED_UPDATE["update_id"]
+    assert update.message and update.message.text == "/start"
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_bad_requests(listener):
+    listener, application = listener
+    base_url = f"http://127.0.0.1:{listener.port}"
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        wrong_secret = await client.post(
+            "/telegram", json=RECORDED_UPDATE, headers={SECRET_TOKEN_HEADER: "wrong"}
+        )
+        wrong_path = await client.post(
+            "/other", json=RECORDED_UPDATE, headers={SECRET_TOKEN_HEADER: SECRET_TOKEN}
+        )
+        not_json = await client.post(
+            "/telegram", content=b"{", headers={SECRET_TOKEN_HEADER: SECRET_TOKEN}
+        )
+
+    assert wrong_secret.status_code == 403
+    assert wrong_path.status_code == 404
+    assert not_json.status_code == 400
+    assert application.update_queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_truncated_body(listener):
+    listener, application = listener
+    reader, writer = await asyncio.open_connection("127.0.0.1", listener.port)
+    writer.write(
+        "POST /telegram HTTP/1.1\r\n"
+        f"{SECRET_TOKEN_HEADER}: {SECRET_TOKEN}\r\n"
+        "Content-Length: 100\r\n\r\n{".encode()
+    )
+    # Клиент оборвал тело запроса раньше Content-Length.
+    writer.write_eof()
+
+    assert (await reader.readline()).startswith(b"HTTP/1.1 400")
+    writer.close()
+    assert application.update_queue.empty()
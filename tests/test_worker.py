@@ -0,0 +1,50 @@
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from services import leases
+from worker import Worker
+
+TTL = timedelta(minutes=1)
+
+
+@pytest.mark.asyncio
+async def test_lease_owned_until_expired():
+    assert await leases.acquire("test:lease", "a", TTL)
+    assert await leases.acquire("test:lease", "a", TTL)
+    assert not await leases.acquire("test:lease", "b", TTL)
+    # Аренда истекла: её забирает другой владелец.
+    assert await leases.acquire("test:lease", "a", -TTL)
+    assert await leases.acquire("test:lease", "b", TTL)
+
+    await leases.release("test:lease", "a")
+    assert not await leases.acquire("test:lease", "a", TTL)
+    await leases.release("test:lease", "b")
+    assert await leases.acquire("test:lease", "a", TTL)
+
+
+@pytest.mark.asyncio
+async def test_workers_split_shards_and_fail_over():
+    first = Worker("first", shard_count=3, on_payed=MagicMock())
+    second = Worker("second", shard_count=3, on_payed=MagicMock())
+
+    with patch("worker.ShardJobs.start", new_callable=AsyncMock), patch(
+        "worker.ShardJobs.refresh", new_callable=AsyncMock
+    ), patch("worker.ShardJobs.stop", new_callable=AsyncMock):
+        await first.rebalance()
+        assert len(first.jobs) == 3
+
+        # Второй воркер видит, что все части заняты, а первый отпускает лишние.
+        await second.rebalance()
+        assert len(second.jobs) == 0
+        await first.rebalance()
+        await second.rebalance()
+        assert len(first.jobs) == 2
+        assert len(second.jobs) == 1
+        assert not first.jobs.keys() & second.jobs.keys()
+
+        await first.stop()
+        await second.rebalance()
+        assert len(second.jobs) == 3
+        await second.stop()
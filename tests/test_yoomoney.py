@@ -1,7 +1,85 @@
 import uuid
+from datetime import datetime
+from unittest.mock import patch
 
-from services.yoomoney import _create_new_bill
+import httpx
+import pytest
 
+from services import yoomoney
+from services.yoomoney import (
+    build_payment_url,
+    get_receiver_account,
+    list_payed_labels,
+)
 
-def test_yoomoney_payments():
-    _create_new_bill(uuid.uuid4())
+
+def _mock_client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url="https://yoomoney.ru/api/",
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def _yoomoney_api(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/api/account-info":
+        return httpx.Response(200, json={"account": "4100000000000"})
+    if request.url.path == "/api/operation-history":
+        form = dict(httpx.QueryParams(request.content.decode()))
+        if "start_record" not in form:
+            return httpx.Response(
+                200,
+                json={
+                    "operations": [
+                        {"label": "first", "status": "success", "amount": 99.5},
+                        {
+                            "label": "in_progress",
+                            "status": "in_progress",
+                            "amount": 150,
+                        },
+                    ],
+                    "next_record": "2",
+                },
+            )
+        return httpx.Response(
+            200,
+            json={
+                "operations": [
+                    {"label": "second", "status": "success", "amount": 147.75}
+                ]
+            },
+        )
+    return httpx.Response(200)
+
+
+@pytest.mark.asyncio
+async def test_yoomoney_payments():
+    requests = []
+
+    def _api(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return _yoomoney_api(request)
+
+    bill_id = str(uuid.uuid4())
+    with patch(
+        "services.yoomoney.create_client", return_value=_mock_client(_api)
+    ), patch.object(yoomoney, "_receiver_account", None):
+        receiver = await get_receiver_account()
+        assert await get_receiver_account() == receiver
+
+    url = build_payment_url(receiver, bill_id, 150)
+
+    assert len(requests) == 1
+    assert url == build_payment_url(receiver, bill_id, 150)
+    assert "receiver=4100000000000" in url
+    assert "sum=150" in url
+    assert f"label={bill_id}" in url
+
+
+@pytest.mark.asyncio
+async def test_list_payed_labels():
+    with patch(
+        "services.yoomoney.create_client", return_value=_mock_client(_yoomoney_api)
+    ):
+        labels = await list_payed_labels(since=datetime.now())
+
+    assert labels == {"first": 99.5, "second": 147.75}
@@ -0,0 +1,122 @@
+import uuid
+
+import httpx
+import pytest
+import pytest_asyncio
+from models import Bill
+
+from services.billing import check_balance
+from yoomoney_notifications import YooMoneyNotificationListener, sign
+
+SECRET = "notification_secret"  # noqa: S105
+
+
+def _notification(label: str, **fields: str) -> dict[str, str]:
+    notification = {
+        "notification_type": "p2p-incoming",
+        "operation_id": "1234567",
+        "amount": "147.75",
+        "withdraw_amount": "150.00",
+        "currency": "643",
+        "datetime": "2024-01-01T12:00:00Z",
+        "sender": "41001000040",
+        "codepro": "false",
+        "label": label,
+        **fields,
+    }
+    notification["sha1_hash"] = sign(notification, SECRET)
+    return notification
+
+
+@pytest_asyncio.fixture(name="listener")
+async def listener_fixture():
+    listener = YooMoneyNotificationListener(
+        listen="127.0.0.1", port=0, url_path="/yoomoney", secret=SECRET
+    )
+    await listener.start()
+    yield listener
+    await listener.stop()
+
+
+def test_sign():
+    # Пример из документации ЮMoney.
+    notification = {
+        "notification_type": "p2p-incoming",
+        "operation_id": "1234567",
+        "amount": "300.00",
+        "currency": "643",
+        "datetime": "2011-07-01T09:00:00.000+04:00",
+        "sender": "41001XXXXXXXX",
+        "codepro": "false",
+        "label": "YM.label.12345",
+    }
+
+    assert sign(notification, "01234567890ABCDEF01234567890") == (
+        "a2ee4a9195f4a90e893cff4f62eeba0b662321f9"
+    )
+
+
+@pytest.mark.asyncio
+async def test_notification_credits_bill_once(listener, db_session):
+    bill_id = uuid.uuid4()
+    db_session.add(Bill(user_id=30, bill_id=bill_id, sum=150))
+    await db_session.commit()
+    balance_before = await check_balance(user_id=30)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{listener.port}"
+    ) as client:
+        # ЮMoney повторяет уведомление, если не получил ответ.
+        responses = [
+            await client.post("/yoomoney", data=_notification(str(bill_id)))
+            for _ in range(2)
+        ]
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert await check_balance(user_id=30) == balance_before + 150
+
+
+@pytest.mark.asyncio
+async def test_notification_rejects_bad_requests(listener, db_session):
+    bill_id = uuid.uuid4()
+    db_session.add(Bill(user_id=31, bill_id=bill_id, sum=150))
+    await db_session.commit()
+    balance_before = await check_balance(user_id=31)
+    forged = {**_notification(str(bill_id)), "amount": "1500.00"}
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{listener.port}"
+    ) as client:
+        forged_response = await client.post("/yoomoney", data=forged)
+        protected_response = await client.post(
+            "/yoomoney", data=_notification(str(bill_id), codepro="true")
+        )
+        unknown_response = await client.post(
+            "/yoomoney", data=_notification("not-a-bill")
+        )
+        not_found_response = await client.post("/other", data={})
+
+    assert forged_response.status_code == 403
+    assert protected_response.status_code == 200
+    assert unknown_response.status_code == 200
+    assert not_found_response.status_code == 404
+    assert await check_balance(user_id=31) == balance_before
+
+
+@pytest.mark.asyncio
+async def test_notification_ignores_underpayment(listener, db_session):
+    bill_id = uuid.uuid4()
+    db_session.add(Bill(user_id=32, bill_id=bill_id, sum=150))
+    await db_session.commit()
+    balance_before = await check_balance(user_id=32)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{listener.port}"
+    ) as client:
+        response = await client.post(
+            "/yoomoney",
+            data=_notification(str(bill_id), amount="9.95", withdraw_amount="10.00"),
+        )
+
+    assert response.status_code == 200
+    assert await check_balance(user_id=32) == balance_before